@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import collections
+import threading
+
+from . import utils
+
+##############################################################################
+# Change
+##############################################################################
+
+
+class ConnectionChange(object):
+
+    '''
+      A single batch of changes to the local connection state.
+
+       - sequence  (monotonically increasing batch number, starting at 1)
+       - added     (connection type keyed dictionary of utils.Connection sets)
+       - removed   (connection type keyed dictionary of utils.Connection sets)
+    '''
+    __slots__ = ['sequence', 'added', 'removed']
+
+    def __init__(self, sequence, added, removed):
+        self.sequence = sequence
+        self.added = added
+        self.removed = removed
+
+    def __str__(self):
+        return '{sequence: %s, added: %s, removed: %s}' % (
+            self.sequence,
+            sum(len(connections) for connections in self.added.values()),
+            sum(len(connections) for connections in self.removed.values()))
+
+    __repr__ = __str__
+
+##############################################################################
+# Feed
+##############################################################################
+
+
+class ConnectionChangeFeed(object):
+
+    '''
+      Ordered, bounded queue of connection changes. Producers (the connection
+      cache callback) publish batches, consumers remember the last sequence
+      number they saw and drain everything after it.
+
+      If a consumer falls so far behind that batches it hasn't seen have
+      already been discarded, drain flags a resync - the consumer should
+      then rebuild from the full connection state instead.
+    '''
+
+    def __init__(self, max_length=256):
+        '''
+          @param max_length : number of batches to hold on to
+          @type int
+        '''
+        self._lock = threading.Lock()
+        self._changes = collections.deque(maxlen=max_length)
+        self._sequence = 0
+
+    @property
+    def sequence(self):
+        '''
+          @return the sequence number of the most recently published batch (0 if none yet)
+          @rtype int
+        '''
+        return self._sequence
+
+    def publish(self, added, removed):
+        '''
+          Queue up a batch of changes. Empty batches are dropped.
+
+          @param added : connection type keyed dictionary of utils.Connection sets
+          @type dict
+          @param removed : connection type keyed dictionary of utils.Connection sets
+          @type dict
+
+          @return the sequence number of the batch or None if it was empty
+          @rtype int
+        '''
+        if not any(added.values()) and not any(removed.values()):
+            return None
+        with self._lock:
+            self._sequence += 1
+            self._changes.append(ConnectionChange(self._sequence, added, removed))
+            return self._sequence
+
+    def drain(self, since=0):
+        '''
+          Retrieve all batches published after the specified sequence number.
+
+          @param since : the last sequence number the consumer has processed
+          @type int
+
+          @return (latest sequence number, list of ConnectionChange, resync flag)
+          @rtype (int, list, bool)
+        '''
+        with self._lock:
+            sequence = self._sequence
+            if since >= sequence:
+                return sequence, [], False
+            oldest = self._changes[0].sequence if self._changes else sequence + 1
+            changes = [change for change in self._changes if change.sequence > since]
+        return sequence, changes, since < oldest - 1
+
+
+def merge_changes(changes):
+    '''
+      Collapse a list of change batches into a single (added, removed) pair,
+      cancelling out connections that came and went in between.
+
+      @param changes : batches in sequence order
+      @type [ConnectionChange]
+
+      @return (added, removed) connection type keyed dictionaries of sets
+      @rtype (dict, dict)
+    '''
+    added = utils.create_empty_connection_type_dictionary(set)
+    removed = utils.create_empty_connection_type_dictionary(set)
+    for change in changes:
+        for connection_type in utils.connection_types:
+            for connection in change.removed[connection_type]:
+                if connection in added[connection_type]:
+                    added[connection_type].discard(connection)
+                else:
+                    removed[connection_type].add(connection)
+            for connection in change.added[connection_type]:
+                if connection in removed[connection_type]:
+                    removed[connection_type].discard(connection)
+                else:
+                    added[connection_type].add(connection)
+    return added, removed
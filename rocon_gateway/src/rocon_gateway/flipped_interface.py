@@ -14,7 +14,7 @@ import socket
 import rospy
 import rosgraph
 import rocon_gateway_utils
-from gateway_msgs.msg import RemoteRuleWithStatus
+from gateway_msgs.msg import RemoteRule, RemoteRuleWithStatus, Rule
 
 from . import utils
 from . import interactive_interface
@@ -124,7 +124,8 @@ class FlippedInterface(interactive_interface.InteractiveInterface):
     def _update_flipped(self, flipped, filtered_flips):
         updated_flipped = {}
         for connection_type in flipped.keys():
-            updated_flipped[connection_type] = [copy.deepcopy(r) for r in flipped[connection_type] if not r in filtered_flips[connection_type]]
+            filtered = set(id(r) for r in filtered_flips[connection_type])
+            updated_flipped[connection_type] = [r for r in flipped[connection_type] if id(r) not in filtered]
         return updated_flipped
 
     def _filter_flipped_in_interfaces(self, new_flips, flipped_in_registrations):
@@ -132,25 +133,30 @@ class FlippedInterface(interactive_interface.InteractiveInterface):
           Gateway should not flip out the flipped-in interface.
         '''
         filtered_flips = utils.create_empty_connection_type_dictionary()
-        for connection_type in utils.connection_types:
-            for rule in flipped_in_registrations[connection_type]:
-                r = self._is_registration_in_remote_rule(rule, new_flips[connection_type])
-                if r:
-                    filtered_flips[connection_type].append(r)
-
         for connection_type in new_flips.keys():
-            new_flips[connection_type] = [r for r in new_flips[connection_type] if not r in filtered_flips[connection_type]]
+            remaining_flips = []
+            for r in new_flips[connection_type]:
+                if self._is_remote_rule_flipped_in(r, flipped_in_registrations):
+                    filtered_flips[connection_type].append(r)
+                else:
+                    remaining_flips.append(r)
+            new_flips[connection_type] = remaining_flips
 
         rospy.logdebug("Gateway : filtered flip list to prevent cyclic flipping - %s"%str(filtered_flips))
 
         return new_flips, filtered_flips
 
-    def _is_registration_in_remote_rule(self, rule, new_flip_remote_rules):
-        for r in new_flip_remote_rules:
-            node = r.rule.node.split(",")[0]
-            if rule.local_node == node and rule.remote_gateway == r.gateway and rule.connection.rule.name == r.rule.name:
-                return r
-        return None
+    def _is_remote_rule_flipped_in(self, remote_rule, flipped_in_registrations):
+        '''
+          Check if the (local) node of a flip is one of our own flip-in registrations
+          coming back from the gateway it originated from.
+        '''
+        node = utils.split_node_uri(remote_rule.rule.node)[0]
+        registration = flipped_in_registrations.find_by_local_node(node)
+        return (registration is not None and
+                registration.remote_gateway == remote_rule.gateway and
+                registration.connection.rule.name == remote_rule.rule.name and
+                registration.connection.rule.type == remote_rule.rule.type)
 
     def update_flip_status(self, flip, status):
         '''
@@ -239,10 +245,10 @@ class FlippedInterface(interactive_interface.InteractiveInterface):
             if matched:
                 for gateway in matched_gateways:
                     try:
-                        matched_flip = copy.deepcopy(flip_rule)
-                        matched_flip.gateway = gateway  # just in case we used a regex or matched basename
-                        matched_flip.rule.name = name  # just in case we used a regex
-                        matched_flip.rule.node = "%s,%s"%(node, master.lookupNode(node))  # just in case we used a regex
+                        # gateway, name and node just in case we used a regex or matched basename
+                        matched_flip = RemoteRule(
+                            gateway,
+                            Rule(flip_rule.rule.type, name, "%s,%s" % (node, master.lookupNode(node))))
                         matched_flip_rules.append(matched_flip)
                     except rosgraph.masterapi.MasterError as e:
                         # Node has been gone already. skips sliently
@@ -8,7 +8,6 @@
 # Imports
 ###############################################################################
 
-import copy
 import os
 import threading
 
@@ -19,6 +18,7 @@ import rocon_python_comms
 
 from gateway_msgs.msg import RemoteRuleWithStatus as FlipStatus
 
+from . import change_feed
 from . import utils
 from . import ros_parameters
 #from .watcher_thread import WatcherThread
@@ -39,7 +39,8 @@ class Gateway(object):
       Used to synchronise with hubs.
     '''
 
-    def __init__(self, hub_manager, param, unique_name, publish_gateway_info_callback):
+    def __init__(self, hub_manager, param, unique_name, publish_gateway_info_callback, local_master=None,
+                 trace_recorder=None):
         '''
         @param hub_manager : container for all the hubs this gateway connects to
         @type hub_api.HubManmager
@@ -50,13 +51,21 @@ class Gateway(object):
         @param unique_name : gateway name (param['name']) with unique uuid hash appended
 
         @param publish_gateway_info_callback : callback for publishing gateway info
+
+        @param local_master : use this local master (e.g. one on a stand-in ros master) instead of creating one
+        @type LocalMaster
+
+        @param trace_recorder : record spin loop iterations (and connection cache callbacks if creating the
+                                local master)
+        @type trace.TraceRecorder
         '''
         self.hub_manager = hub_manager
-        self.master = None
+        self.trace_recorder = trace_recorder
+        self.master = local_master
         # handling slow startup timeout
         while self.master is None:
             try:
-                self.master = LocalMaster()
+                self.master = LocalMaster(trace_recorder=trace_recorder)
             except rocon_python_comms.NotFoundException as exc:
                 rospy.logwarn(str(exc))
                 rospy.logwarn("Cannot create Gateway's LocalMaster. Retrying...")
@@ -84,6 +93,9 @@ class Gateway(object):
         if self._param['advertise_all']:
             # no extra blacklist beyond the default (keeping it simple in yaml for now)
             self.public_interface.advertise_all([])
+        # where the public interface is up to in the local master's change feed, None until the first full update
+        self._public_interface_sequence = None
+        self._public_interface_rules_version = None
 
         self.network_interface_manager = NetworkInterfaceManager(self._param['network_interface'])
         # TODO : Use self._param['watch_loop_period'] to set the connection_cache spin freq ( OR directly in connection_cache node ) ?
@@ -94,21 +106,32 @@ class Gateway(object):
         rospy.logdebug("node[%s, %s] entering spin(), pid[%s]", rospy.core.get_caller_id(), rospy.core.get_node_uri(), os.getpid())
         try:
             while not rospy.core.is_shutdown():
-                self.update_network_information()
-                remote_gateway_hub_index = self.hub_manager.create_remote_gateway_hub_index()
-
-                with self.master.get_connection_state() as connections:
-                    self.update_flipped_interface(connections, remote_gateway_hub_index)
-                    self.update_public_interface(connections)
-                    self.update_pulled_interface(connections, remote_gateway_hub_index)
-
-                registrations = self.hub_manager.get_flip_requests()
-                self.update_flipped_in_interface(registrations, remote_gateway_hub_index)
+                self.spin_once()
                 rospy.rostime.wallsleep(1)
         except KeyboardInterrupt:
             rospy.logdebug("keyboard interrupt, shutting down")
             rospy.core.signal_shutdown('keyboard interrupt')
 
+    def spin_once(self):
+        '''
+          A single iteration of the spin loop, synchronising the local
+          connections with the hubs once. Tests and benchmarks can step
+          the gateway with this instead of spinning it (and sleeping).
+        '''
+        if self.trace_recorder is not None:
+            self.trace_recorder.record_spin()
+        self.update_network_information()
+        remote_gateway_hub_index = self.hub_manager.create_remote_gateway_hub_index()
+
+        # immutable snapshot, the connection cache callback is free to swap in a new one meanwhile
+        version, connections = self.master.get_connection_snapshot()
+        self.update_flipped_interface(connections, remote_gateway_hub_index)
+        self.update_public_interface(connections, version)
+        self.update_pulled_interface(connections, remote_gateway_hub_index)
+
+        registrations = self.hub_manager.get_flip_requests()
+        self.update_flipped_in_interface(registrations, remote_gateway_hub_index)
+
     def is_connected(self):
         '''
           We often check if we're connected to any hubs often just to ensure we
@@ -195,8 +218,7 @@ class Gateway(object):
                 state_changed = True
                 rospy.loginfo("Gateway : sending unflip request [%s]%s" % (flip.gateway, utils.format_rule(flip.rule)))
                 for hub in remote_gateway_hub_index[flip.gateway]:
-                    rule = copy.deepcopy(flip.rule)
-                    if hub.send_unflip_request(flip.gateway, rule):
+                    if hub.send_unflip_request(flip.gateway, flip.rule):
                         # This hub was used to send the original flip request
                         hub.remove_flip_details(flip.gateway, flip.rule.name, flip.rule.type, flip.rule.node)
                         break
@@ -206,8 +228,12 @@ class Gateway(object):
         # rospy.loginfo("flipped_connections = {}".format(flipped_connections))
         for flip in flipped_connections:
             for hub in remote_gateway_hub_index[flip.remote_rule.gateway]:
-                remote_rule = copy.deepcopy(flip.remote_rule)
-                remote_rule.rule.node = remote_rule.rule.node.split(",")[0]  # get only node name, the xmlrpc_uri is not serialised
+                # get only node name, the xmlrpc_uri is not serialised
+                remote_rule = gateway_msgs.RemoteRule(
+                    flip.remote_rule.gateway,
+                    gateway_msgs.Rule(flip.remote_rule.rule.type,
+                                      flip.remote_rule.rule.name,
+                                      utils.split_node_uri(flip.remote_rule.rule.node)[0]))
                 status = hub.get_flip_request_status(remote_rule)
                 if status is not None:
                     flip_state_changed = self.flipped_interface.update_flip_status(flip.remote_rule, status)
@@ -265,7 +291,9 @@ class Gateway(object):
                     registration = utils.Registration(connection, pull.gateway)
                     new_registration = self.master.register(registration)
                     if new_registration is not None:
-                        self.pulled_interface.registrations[registration.connection.rule.type].append(new_registration)
+                        if not self.pulled_interface.registrations.add(new_registration):
+                            # shouldn't happen, we just checked - but never leave one behind on the master
+                            self.master.unregister(new_registration)
                         hub = remote_gateway_hub_index[pull.gateway][0]
                         hub.post_pull_details(pull.gateway, pull.rule.name, pull.rule.type, pull.rule.node)
                         state_changed = True
@@ -282,25 +310,44 @@ class Gateway(object):
                     #hub = remote_gateway_hub_index[pull.gateway][0]
                     # if hub:
                     #    hub.remove_pull_details(pull.gateway, pull.rule.name, pull.rule.type, pull.rule.node)
-                    self.pulled_interface.registrations[
-                        existing_registration.connection.rule.type].remove(existing_registration)
+                    self.pulled_interface.registrations.remove(existing_registration)
                     state_changed = True
         if state_changed:
             self._publish_gateway_info()
 
-    def update_public_interface(self, local_connection_index):
+    def update_public_interface(self, local_connection_index, version=None):
         """
           Process the list of local connections and check against
           the current rules and patterns for changes. If a rule
           has become (un)available take appropriate action.
 
+          Given the snapshot version, only the changes since the last update
+          are processed (from the local master's change feed). The whole
+          snapshot is only matched again on the first update, when the rules
+          changed or when the change feed asks for a resync.
+
           @param local_connection_index : list of current local connections parsed from the master
           @type : { utils.ConnectionType.xxx : utils.Connection[] } dictionaries
+
+          @param version : version of the local connection snapshot (see LocalMaster.get_connection_snapshot)
+          @type int
         """
         state_changed = False
         # new_conns, lost_conns are of type { gateway_msgs.ConnectionType.xxx : utils.Connection[] }
-        new_conns, lost_conns = self.public_interface.update(
-            local_connection_index, self.master.generate_advertisement_connection_details)
+        (sequence, changes, resync) = (None, [], True)
+        if version is not None and self._public_interface_sequence is not None and \
+                self._public_interface_rules_version == self.public_interface.rules_version:
+            (sequence, changes, resync) = self.master.get_connection_changes(self._public_interface_sequence)
+        if resync:
+            self._public_interface_rules_version = self.public_interface.rules_version
+            new_conns, lost_conns = self.public_interface.update(
+                local_connection_index, self.master.generate_advertisement_connection_details)
+            self._public_interface_sequence = version
+        else:
+            added, removed = change_feed.merge_changes(changes)
+            new_conns, lost_conns = self.public_interface.update_changes(
+                added, removed, self.master.generate_advertisement_connection_details)
+            self._public_interface_sequence = sequence
         # public_interface is of type gateway_msgs.Rule[]
         public_interface = self.public_interface.getInterface()
         for connection_type in utils.connection_types:
@@ -363,7 +410,9 @@ class Gateway(object):
                 state_changed = True
                 new_registration = self.master.register(registration)
                 if new_registration is not None:
-                    self.flipped_interface.registrations[registration.connection.rule.type].append(new_registration)
+                    if not self.flipped_interface.registrations.add(new_registration):
+                        # shouldn't happen, we just checked - but never leave one behind on the master
+                        self.master.unregister(new_registration)
             # Update this flip's status
             if status != FlipStatus.ACCEPTED:
                 for hub in remote_gateway_hub_index[registration.remote_gateway]:
@@ -377,22 +426,14 @@ class Gateway(object):
                 hub.update_multiple_flip_request_status(update_flip_status[hub_uri])
 
         # Remove local registrations that are no longer flipped to this gateway
-        local_registrations = copy.deepcopy(self.flipped_interface.registrations)
-        for connection_type in utils.connection_types:
-            for local_registration in local_registrations[connection_type]:
-                matched_registration = None
-                for (registration, status) in registrations:
-                    if registration.connection == local_registration.connection and \
-                       registration.remote_gateway == local_registration.remote_gateway:
-                        matched_registration = registration
-                        break
-                    else:
-                        continue
-                if matched_registration is None:
-                    state_changed = True
-                    rospy.loginfo("Gateway : unflipping received flip %s" % str(local_registration))
-                    self.master.unregister(local_registration)
-                    self.flipped_interface.registrations[connection_type].remove(local_registration)
+        requested = set((registration.remote_gateway, registration.connection)
+                        for (registration, unused_status) in registrations)
+        for local_registration in self.flipped_interface.registrations.values():
+            if (local_registration.remote_gateway, local_registration.connection) not in requested:
+                state_changed = True
+                rospy.loginfo("Gateway : unflipping received flip %s" % str(local_registration))
+                self.master.unregister(local_registration)
+                self.flipped_interface.registrations.remove(local_registration)
 
         if state_changed:
             self._publish_gateway_info()
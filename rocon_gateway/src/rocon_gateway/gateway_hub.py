@@ -7,6 +7,9 @@
 # Imports
 ###############################################################################
 
+import collections
+import math
+import multiprocessing.pool
 import threading
 import rospy
 import re
@@ -14,12 +17,11 @@ import utils
 from gateway_msgs.msg import RemoteRuleWithStatus as FlipStatus, RemoteRule
 import gateway_msgs.msg as gateway_msgs
 import rocon_python_comms
-import rocon_python_utils
 import rocon_gateway_utils
 import rocon_hub_client
 import rocon_python_redis as redis
 import time
-from rocon_hub_client import hub_api, hub_client
+from rocon_hub_client import hub_api
 from rocon_hub_client.exceptions import HubConnectionLostError, \
     HubNameNotFoundError, HubNotFoundError, HubConnectionFailedError
 
@@ -32,45 +34,160 @@ import rocon_console.console as console
 ##############################################################################
 
 
-class HubConnectionCheckerThread(threading.Thread):
+class LatencyStatistics(object):
     '''
-      Pings redis periodically to figure out if the redis connection is still alive.
+      Rolling round trip time statistics for a hub, in the same
+      [min, avg, max, mdev] (milliseconds) form that ping reports.
     '''
 
-    def __init__(self, ip, port, hub_connection_lost_hook, check_registration):
+    def __init__(self, window=10):
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, rtt):
+        '''
+          @param rtt : round trip time (sec)
+          @type float
+        '''
+        with self._lock:
+            self._samples.append(rtt * 1000.0)
+
+    def average(self):
+        '''
+          @return average round trip time (ms) or None if nothing has been measured yet
+          @rtype float
+        '''
+        with self._lock:
+            if not self._samples:
+                return None
+            return sum(self._samples) / len(self._samples)
+
+    def get(self):
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return [0.0, 0.0, 0.0, 0.0]
+        avg = sum(samples) / len(samples)
+        mdev = math.sqrt(max(0.0, sum(sample * sample for sample in samples) / len(samples) - avg * avg))
+        return [min(samples), avg, max(samples), mdev]
+
+
+class HeartbeatScheduler(threading.Thread):
+    '''
+      Single thread that keeps the gateway alive on all of its hubs. Every
+      period, each hub gets one pipelined round trip over its existing
+      connection pool that pings the server, renews this gateway's ping
+      key (TTL) and checks the gateway is still registered. The round trip
+      time feeds the hub's latency statistics.
+
+      Hubs are beaten concurrently (on a small thread pool) and waited on
+      for at most a period, so one hub sitting out a socket timeout doesn't
+      hold up the others. A hub whose last beat is still running is left
+      out until it finishes.
+
+      If the gateway has been wiped from the hub, the hub's connection lost
+      hook is triggered and the hub dropped. A failed round trip opens the
+      hub's circuit breaker - beats are skipped while it is open (it probes
+      the hub itself) and the hub is only dropped if it stays open for longer
+      than the unresponsive timeout.
+    '''
+
+    def __init__(self, period=1.0, unresponsive_timeout=gateway_msgs.ConnectionStatistics.MAX_TTL):
+        '''
+          @param period : time between heartbeats (sec), keep it well under the hub
+                          watcher's period or it will think we are flaky.
+          @type float
+          @param unresponsive_timeout : give up on a hub whose circuit breaker has been open
+                 this long (sec), by then our ping key has expired on the hub anyway
+          @type float
+        '''
         threading.Thread.__init__(self)
-        self.daemon = True  # clean shut down of thread when hub connection is lost
-        self.ping_frequency = 0.2  # Too spammy? # TODO Need to parametrize
-        self._hub_connection_lost_hook = hub_connection_lost_hook
-        self._check_registration = check_registration
-        self.ip = ip
-        self.port = port
-        self.pinger = rocon_python_utils.network.Pinger(self.ip, self.ping_frequency)
-        self.terminate_requested = False
-
-    def get_latency(self):
-        return self.pinger.get_latency()
+        self.daemon = True
+        self.period = period
+        self.unresponsive_timeout = unresponsive_timeout
+        self._hubs = []
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = {}  # hub : multiprocessing.pool.AsyncResult, only touched by beat()
+        self._shutdown = False
+
+    def shutdown(self):
+        '''
+          Stop beating and wait for beats that are still running.
+        '''
+        self._shutdown = True
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.close()
+            executor.join()
+
+    def add(self, hub):
+        with self._lock:
+            # replaces an obsolete instance for the same hub uri if there is one
+            self._hubs[:] = [h for h in self._hubs if h != hub] + [hub]
+
+    def remove(self, hub):
+        with self._lock:
+            self._hubs[:] = [h for h in self._hubs if h is not hub]
 
     def run(self):
+        rate = rocon_python_comms.WallRate(1.0 / self.period)
+        while not rospy.is_shutdown() and not self._shutdown:
+            self.beat()
+            rate.sleep()
+
+    def beat(self):
         '''
-        This runs in the background to gather the latest connection statistics
-        Note - it's not used in the keep alive check
+          Heartbeat every hub once, dropping those that are no longer alive.
+          Returns when all beats are done or a period has passed.
         '''
-        self.pinger.start()
-        rate = rocon_python_comms.WallRate(self.ping_frequency)
-        alive = True
-        timeout = 1 / self.ping_frequency
-        while alive and not self.terminate_requested:
-            alive, message = hub_client.ping_hub(self.ip, self.port, timeout)
+        with self._lock:
+            hubs = list(self._hubs)
+            if len(hubs) > 1 and self._executor is None and not self._shutdown:
+                self._executor = multiprocessing.pool.ThreadPool(min(len(hubs), 8))
+            executor = self._executor
+        if len(hubs) == 1 and not self._in_flight:
+            # no point paying for a thread hop
+            self._beat(hubs[0])
+            return
+        if executor is None:
+            return  # shut down
+        self._in_flight = dict((hub, result) for hub, result in self._in_flight.items()
+                               if any(hub is h for h in hubs))
+        deadline = time.time() + self.period
+        for hub in hubs:
+            in_flight = self._in_flight.get(hub)
+            if in_flight is not None and not in_flight.ready():
+                rospy.logdebug("Gateway : last heartbeat still running, skipping this one [%s]" % hub.uri)
+                continue
+            self._in_flight[hub] = executor.apply_async(self._beat, (hub,))
+        for hub, result in self._in_flight.items():
+            result.wait(max(0.0, deadline - time.time()))
+            if result.ready():
+                del self._in_flight[hub]
+                if not result.successful():
+                    try:
+                        result.get()
+                    except Exception as e:
+                        rospy.logwarn("Gateway : heartbeat failed unexpectedly [%s][%s]" % (hub.uri, str(e)))
+
+    def _beat(self, hub):
+        circuit_breaker = getattr(hub, 'circuit_breaker', None)
+        message = "hub is unresponsive"
+        if circuit_breaker is None or circuit_breaker.allow():
+            alive, message = hub.heartbeat()
             if alive:
-                alive = self._check_registration()
-                if not alive:
-                    message = "Not registered on the hub."
-            rate.sleep()
-        if not alive:
-            rospy.logwarn("Gateway : hub connection no longer alive, disengaging [%s]" % message)
-            self._hub_connection_lost_hook()
-        # else shutting down thread by request
+                return
+        # failing fast or the beat itself failed to reach the hub
+        if circuit_breaker is not None and not circuit_breaker.allow():
+            if circuit_breaker.open_duration() < self.unresponsive_timeout:
+                return  # skip this beat, the breaker is probing the hub
+            message = "unresponsive for %ss" % self.unresponsive_timeout
+        rospy.logwarn("Gateway : hub connection no longer alive, disengaging [%s]" % message)
+        self.remove(hub)
+        hub._hub_connection_lost_hook()
 
 ##############################################################################
 # Hub
@@ -82,18 +199,21 @@ class GatewayHub(rocon_hub_client.Hub):
     Manages the Hub data.
     This is used both by HubManager for the gateway node, and by the rocon hub watcher.
     """
-    def __init__(self, ip, port, whitelist, blacklist):
+    def __init__(self, ip, port, whitelist, blacklist, connection_pool=None):
         '''
           @param remote_gateway_request_callbacks : to handle redis responses
           @type list of function pointers (back to GatewaySync class
 
           @param ip : redis server ip
           @param port : redis server port
+          @param connection_pool : an already verified pool to the server (e.g. from hub discovery)
+          @type redis.ConnectionPool
 
           @raise HubNameNotFoundError, HubNotFoundError
         '''
         try:
-            super(GatewayHub, self).__init__(ip, port, whitelist, blacklist)  # can just do super() in python3
+            # can just do super() in python3
+            super(GatewayHub, self).__init__(ip, port, whitelist, blacklist, connection_pool)
         except HubNotFoundError:
             raise
         except HubNameNotFoundError:
@@ -103,8 +223,11 @@ class GatewayHub(rocon_hub_client.Hub):
 
         # Setting up some basic parameters in-case we use this API without registering a gateway
         self._redis_keys['gatewaylist'] = hub_api.create_rocon_hub_key('gatewaylist')
+        # gateway key : last seen (hub clock), maintained by the hub watcher
+        self._redis_keys['presence'] = hub_api.create_rocon_hub_key('presence')
         self._unique_gateway_name = ''
-        self.hub_connection_checker_thread = None
+        self.latency_statistics = LatencyStatistics()
+        self.connection_lost_lock = threading.Lock()
 
     ##########################################################################
     # Hub Connections
@@ -155,13 +278,16 @@ class GatewayHub(rocon_hub_client.Hub):
             pipe.get(self._redis_keys['public_key'])
             pipe.set(self._redis_keys['public_key'], serialized_public_key)
             pipe.sadd(self._redis_keys['gatewaylist'], self._redis_keys['gateway'])
+            pipe.sadd(hub_api.create_rocon_gateway_registry_key(unique_gateway_name),
+                      *hub_api.create_rocon_gateway_keys(unique_gateway_name))
 
             # Let hub know we are alive
             pipe.set(ping_key, True)
             pipe.expire(ping_key, gateway_msgs.ConnectionStatistics.MAX_TTL)
 
             ret_pipe = pipe.execute()
-            [r_check_gateway, r_firewall, r_ip, r_oldkey, r_newkey, r_add_gateway, r_ping, r_expire] = ret_pipe
+            [r_check_gateway, r_firewall, r_ip, r_oldkey, r_newkey,
+             r_add_gateway, r_registry, r_ping, r_expire] = ret_pipe
 
         except (redis.WatchError, redis.ConnectionError) as e:
             raise HubConnectionFailedError("Connection Failed while registering hub[%s]" % str(e))
@@ -178,12 +304,7 @@ class GatewayHub(rocon_hub_client.Hub):
             rospy.loginfo('Gateway : found existing mismatched public key on the hub, ' +
                           'requesting resend for all flip-ins.')
             self._resend_all_flip_ins()
-
-        # Mark this gateway as now available
-        self.hub_connection_checker_thread = HubConnectionCheckerThread(
-            self.ip, self.port, self._hub_connection_lost_hook, self.is_gateway_registered)
-        self.hub_connection_checker_thread.start()
-        self.connection_lost_lock = threading.Lock()
+        # From here on the owner's heartbeat scheduler keeps our ping key alive (see heartbeat())
 
     def _hub_connection_lost_hook(self):
         '''
@@ -198,6 +319,30 @@ class GatewayHub(rocon_hub_client.Hub):
             self._hub_connection_lost_gateway_hook = None
         self.connection_lost_lock.release()
 
+    def heartbeat(self):
+        '''
+          Renew this gateway's ping key and verify it is still registered,
+          all in a single round trip (also used to measure latency).
+
+          @return (alive, reason if not alive)
+          @rtype (bool, str)
+        '''
+        ping_key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, ':ping')
+        try:
+            pipe = self._redis_server.pipeline(transaction=False)
+            pipe.ping()
+            pipe.set(ping_key, True)
+            pipe.expire(ping_key, gateway_msgs.ConnectionStatistics.MAX_TTL)
+            pipe.sismember(self._redis_keys['gatewaylist'], self._redis_keys['gateway'])
+            start_time = time.time()
+            unused_ping, unused_set, unused_expire, registered = pipe.execute()
+            self.latency_statistics.add(time.time() - start_time)
+        except (redis.exceptions.ConnectionError, redis.exceptions.ResponseError) as e:
+            return False, str(e)
+        if not registered:
+            return False, "Not registered on the hub."
+        return True, ""
+
     def is_gateway_registered(self):
         '''
           Checks if gateway info is on the hub.
@@ -227,13 +372,7 @@ class GatewayHub(rocon_hub_client.Hub):
           @type gateway_msgs.RemoteGateway
         '''
         try:
-            # Let hub know that we are alive - even for wired connections. Perhaps something can
-            # go wrong for them too, though no idea what. Anyway, writing one entry is low cost
-            # and it makes the logic easier on the hub side.
-            ping_key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, ':ping')
-            self._redis_server.set(ping_key, True)
-            self._redis_server.expire(ping_key, gateway_msgs.ConnectionStatistics.MAX_TTL)
-            # rospy.loginfo("=>{0} TTL {1}".format(ping_key, gateway_msgs.ConnectionStatistics.MAX_TTL))
+            # The ping key (letting the hub know we are alive) is renewed by the heartbeat.
             # this should probably be posted independently  of whether the hub is contactable or not
             # refer to https://github.com/robotics-in-concert/rocon_multimaster/pull/273/files#diff-22b726fec736c73a96fd98c957d9de1aL189
             if not statistics.network_info_available:
@@ -246,7 +385,7 @@ class GatewayHub(rocon_hub_client.Hub):
             self._redis_server.set(network_type, statistics.network_type)
 
             # Update latency statistics
-            latency = self.hub_connection_checker_thread.get_latency()
+            latency = self.latency_statistics.get()
             self.update_named_gateway_latency_stats(self._unique_gateway_name, latency)
             # If wired, don't worry about wireless statistics.
             if statistics.network_type == gateway_msgs.RemoteGateway.WIRED:
@@ -264,13 +403,20 @@ class GatewayHub(rocon_hub_client.Hub):
 
     def unregister_named_gateway(self, gateway_key):
         '''
-          Remove all gateway info for given gateway key from the hub.
+          Remove all gateway info for given gateway key from the hub. The keys
+          to remove come from the gateway's key registry (no KEYS scan), gateways
+          that predate the registry have theirs scanned for instead.
         '''
+        registry_key = hub_api.create_rocon_gateway_registry_key(hub_api.key_base_name(gateway_key))
         try:
-            gateway_keys = self._redis_server.keys(gateway_key + ":*")
+            gateway_keys = self._redis_server.smembers(registry_key)
+            if not gateway_keys:
+                gateway_keys = list(hub_api.scan_keys(self._redis_server, gateway_key + ':*'))
+            hub_api.delete_keys(self._redis_server, gateway_keys)
             pipe = self._redis_server.pipeline()
-            pipe.delete(*gateway_keys)
+            pipe.delete(registry_key)
             pipe.srem(self._redis_keys['gatewaylist'], gateway_key)
+            pipe.zrem(self._redis_keys['presence'], gateway_key)
             pipe.execute()
         except (redis.exceptions.ConnectionError, redis.exceptions.ResponseError):
             pass
@@ -333,6 +479,27 @@ class GatewayHub(rocon_hub_client.Hub):
         finally:
             pipe.reset()
 
+    def mark_named_gateways_available(self, updates):
+        '''
+          Batched version of mark_named_gateway_available - all updates go to
+          the hub in a single round trip.
+
+          @param updates : (gateway_key, available, time_since_last_seen) tuples
+          @type list
+        '''
+        if not updates:
+            return
+        pipe = self._redis_server.pipeline(transaction=False)
+        try:
+            for (gateway_key, available, time_since_last_seen) in updates:
+                pipe.set(gateway_key + ":available", available)
+                pipe.set(gateway_key + ":time_since_last_seen", int(time_since_last_seen))
+            unused_ret_pipe = pipe.execute()
+        except (redis.WatchError, redis.ConnectionError) as e:
+            raise HubConnectionFailedError("Connection Failed while updating gateway availability [%s]" % str(e))
+        finally:
+            pipe.reset()
+
     ##########################################################################
     # Hub Data Retrieval
     ##########################################################################
@@ -602,7 +769,7 @@ class GatewayHub(rocon_hub_client.Hub):
           @type string
         '''
         key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'flips')
-        serialized_data = utils.serialize([gateway, name, connection_type, node])
+        serialized_data = utils.serialize_details(gateway, name, connection_type, node)
         self._redis_server.sadd(key, serialized_data)
 
     def remove_flip_details(self, gateway, name, connection_type, node):
@@ -620,7 +787,7 @@ class GatewayHub(rocon_hub_client.Hub):
           @type string
         '''
         key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'flips')
-        serialized_data = utils.serialize([gateway, name, connection_type, node])
+        serialized_data = utils.serialize_details(gateway, name, connection_type, node)
         self._redis_server.srem(key, serialized_data)
 
     def post_pull_details(self, gateway, name, connection_type, node):
@@ -638,7 +805,7 @@ class GatewayHub(rocon_hub_client.Hub):
           @type string
         '''
         key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'pulls')
-        serialized_data = utils.serialize([gateway, name, connection_type, node])
+        serialized_data = utils.serialize_details(gateway, name, connection_type, node)
         self._redis_server.sadd(key, serialized_data)
 
     def remove_pull_details(self, gateway, name, connection_type, node):
@@ -656,7 +823,7 @@ class GatewayHub(rocon_hub_client.Hub):
           @type string
         '''
         key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'pulls')
-        serialized_data = utils.serialize([gateway, name, connection_type, node])
+        serialized_data = utils.serialize_details(gateway, name, connection_type, node)
         self._redis_server.srem(key, serialized_data)
 
     ##########################################################################
@@ -925,13 +1092,13 @@ class GatewayHub(rocon_hub_client.Hub):
         key = hub_api.create_rocon_gateway_key(remote_gateway, 'flip_ins')
         # rule.node is two parts (node_name, xmlrpc_uri) - but serialised connection rule is only node name
         # strip the xmlrpc_uri for comparision tests
-        rule.node = rule.node.split(",")[0]
+        rule_key = (rule.type, rule.name, utils.split_node_uri(rule.node)[0])
         try:
             encoded_flip_ins = self._redis_server.smembers(key)
             for flip_in in encoded_flip_ins:
                 unused_status, source, connection_list = utils.deserialize_request(flip_in)
                 connection = utils.get_connection_from_list(connection_list)
-                if source == hub_api.key_base_name(self._redis_keys['gateway']) and rule == connection.rule:
+                if source == hub_api.key_base_name(self._redis_keys['gateway']) and rule_key == connection.key:
                     self._redis_server.srem(key, flip_in)
                     return True
         except redis.exceptions.ConnectionError:
@@ -7,6 +7,7 @@
 # Imports
 ##############################################################################
 
+import os
 import rospy
 import rocon_gateway
 import uuid
@@ -16,9 +17,12 @@ import std_msgs.msg as std_msgs
 import std_srvs.srv as std_srvs
 from urlparse import urlparse
 import rocon_hub_client
+from rocon_hub_client import profiler
 
 from . import gateway
 from . import hub_manager
+from . import trace
+from . import utils
 
 ##############################################################################
 # Gateway Configuration and Main Loop Class
@@ -53,21 +57,36 @@ class GatewayNode():
                                              # that have dropped out of wireless range.
                                              # gateway_msgs.ErrorCodes.HUB_CONNECTION_UNRESOLVABLE
                                              ]
+        try:
+            utils.set_serialization_format(self._param['hub_serialization_format'])
+        except ValueError as e:
+            rospy.logerr("Gateway : %s, writing pickles instead." % str(e))
+        self._trace_recorder = None
+        if self._param['trace_file']:
+            # before anything talks to the hubs or the connection cache
+            trace_file = os.path.expanduser(self._param['trace_file'])
+            self._trace_recorder = trace.TraceRecorder(trace_file, self._unique_name, self._param)
+            rocon_hub_client.set_backend(trace.TracingBackend(rocon_hub_client.get_backend(), self._trace_recorder))
+            rospy.loginfo("Gateway : recording a trace [%s]" % trace_file)
         self._hub_manager = hub_manager.HubManager(
             hub_whitelist=self._param['hub_whitelist'],
-            hub_blacklist=self._param['hub_blacklist']
+            hub_blacklist=self._param['hub_blacklist'],
+            trace_recorder=self._trace_recorder
         )
         # Be careful of the construction sequence here, parts depend on others.
         self._gateway_publishers = self._setup_ros_publishers()
         # self._publish_gateway_info needs self._gateway_publishers
-        self._gateway = gateway.Gateway(self._hub_manager, self._param, self._unique_name, self._publish_gateway_info)
+        self._gateway = gateway.Gateway(self._hub_manager, self._param, self._unique_name, self._publish_gateway_info,
+                                        trace_recorder=self._trace_recorder)
         self._gateway_services = self._setup_ros_services()  # Needs self._gateway
         self._gateway_subscribers = self._setup_ros_subscribers()  # Needs self._gateway
+        self._profiling_services = profiler.ProfilingServices(self._param['profiling_interval'])
         # 'ip:port' : (error_code, error_code_str) dictionary of hubs that this gateway has tried to register,
         # but not been permitted (hub is not in whitelist, or is blacklisted)
         direct_hub_uri_list = [self._param['hub_uri']] if self._param['hub_uri'] != '' else []
         self._hub_discovery_thread = rocon_hub_client.HubDiscovery(
-            self._hub_ensure_connection, direct_hub_uri_list, self._param['disable_zeroconf'], self._disallowed_hubs)
+            self._hub_ensure_connection, direct_hub_uri_list, self._param['disable_zeroconf'], self._disallowed_hubs,
+            self._hub_manager.lose_hub)
 
         # Make local gateway information immediately available
         self._publish_gateway_info()
@@ -91,6 +110,10 @@ class GatewayNode():
             self._hub_discovery_thread.shutdown()
 
             self._gateway = None
+            self._hub_manager.shutdown()
+            self._profiling_services.shutdown()
+            if self._trace_recorder is not None:
+                self._trace_recorder.close()
         except Exception as e:
             rospy.logerr("Gateway : unknown error on shutdown [%s][%s]" % (str(e), type(e)))
             raise
@@ -99,12 +122,13 @@ class GatewayNode():
     # Hub Discovery & Connection
     ##########################################################################
 
-    def _hub_ensure_connection(self, ip, port):
+    def _hub_ensure_connection(self, ip, port, connection_pool=None):
         '''
         Called when the hub discovery can ping a hub
 
         :param ip:
         :param port:
+        :param connection_pool: warm connection pool to the hub from discovery (optional)
         :return:
         '''
 
@@ -113,7 +137,7 @@ class GatewayNode():
             # we already tried this one before, quietly return from here.
             return self._disallowed_hubs[uri]
 
-        hub, error_code, error_code_str = self._hub_manager.is_connected_to_hub(ip, port)
+        hub, error_code, error_code_str = self._hub_manager.is_connected_to_hub(ip, port, connection_pool)
         if error_code == gateway_msgs.ErrorCodes.NO_HUB_CONNECTION:
             error_code, error_code_str = self._register_gateway(hub)
 
@@ -205,23 +229,32 @@ class GatewayNode():
         gateway_services['remote_gateway_info'] = rospy.Service(
             '~remote_gateway_info', gateway_srvs.RemoteGatewayInfo, self.ros_service_remote_gateway_info)  # @IgnorePep8
         gateway_services['advertise'] = rospy.Service(
-            '~advertise', gateway_srvs.Advertise, self._gateway.ros_service_advertise)  # @IgnorePep8
+            '~advertise', gateway_srvs.Advertise,
+            self._traced_service('advertise', self._gateway.ros_service_advertise))
         gateway_services['advertise_all'] = rospy.Service(
-            '~advertise_all', gateway_srvs.AdvertiseAll, self._gateway.ros_service_advertise_all)  # @IgnorePep8
+            '~advertise_all', gateway_srvs.AdvertiseAll,
+            self._traced_service('advertise_all', self._gateway.ros_service_advertise_all))
         gateway_services['flip'] = rospy.Service(
-            '~flip', gateway_srvs.Remote, self._gateway.ros_service_flip)  # @IgnorePep8
+            '~flip', gateway_srvs.Remote, self._traced_service('flip', self._gateway.ros_service_flip))  # @IgnorePep8
         gateway_services['flip_all'] = rospy.Service(
-            '~flip_all', gateway_srvs.RemoteAll, self._gateway.ros_service_flip_all)  # @IgnorePep8
+            '~flip_all', gateway_srvs.RemoteAll,
+            self._traced_service('flip_all', self._gateway.ros_service_flip_all))
         gateway_services['pull'] = rospy.Service(
-            '~pull', gateway_srvs.Remote, self._gateway.ros_service_pull)  # @IgnorePep8
+            '~pull', gateway_srvs.Remote, self._traced_service('pull', self._gateway.ros_service_pull))  # @IgnorePep8
         gateway_services['pull_all'] = rospy.Service(
-            '~pull_all', gateway_srvs.RemoteAll, self._gateway.ros_service_pull_all)  # @IgnorePep8
+            '~pull_all', gateway_srvs.RemoteAll,
+            self._traced_service('pull_all', self._gateway.ros_service_pull_all))
         #gateway_services['set_watcher_period'] = rospy.Service(
         #    '~set_watcher_period',
         #    gateway_srvs.SetWatcherPeriod,
         #    self._gateway.ros_service_set_watcher_period)  # @IgnorePep8
         return gateway_services
 
+    def _traced_service(self, name, handler):
+        if self._trace_recorder is None:
+            return handler
+        return self._trace_recorder.wrap_service(name, handler)
+
     def _setup_ros_publishers(self):
         gateway_publishers = {}
         gateway_publishers['gateway_info'] = rospy.Publisher('~gateway_info', gateway_msgs.GatewayInfo, latch=True, queue_size=5)
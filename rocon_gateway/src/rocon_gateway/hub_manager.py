@@ -7,7 +7,10 @@
 # Imports
 ###############################################################################
 
+import multiprocessing
+import multiprocessing.pool
 import threading
+import time
 
 import rospy
 import gateway_msgs.msg as gateway_msgs
@@ -16,8 +19,15 @@ import rocon_python_redis as redis
 
 from .exceptions import GatewayUnavailableError
 from . import gateway_hub
+from . import hub_selector
 from . import utils
 
+##############################################################################
+# Constants
+##############################################################################
+
+_SKIPPED = object()  # marker for a hub that was too busy to service a request in time
+
 ##############################################################################
 # Hub Manager
 ##############################################################################
@@ -27,22 +37,74 @@ class HubManager(object):
     """
     :ivar hubs: list of gateway hub instances
     :vartype hubs: [rocon_gateway.GatewayHub]
+
+    Operations on multiple hubs are fanned out over a small thread pool
+    and run concurrently, each hub serialised by its own lock. Results are
+    gathered up to a deadline - a hub that doesn't answer in time (or fails)
+    is skipped (and logged) rather than stalling everything else. Where a
+    missing answer would read as "nothing there" (the remote gateway index,
+    flip requests), the hub's last good answer stands in for it.
+    ``_hub_lock`` only guards the hub list itself.
+
+    Where a remote gateway is on several hubs, they are ordered by the hub
+    selector (latency and health, with a sticky preference) so callers
+    taking the first hub get the best one.
     """
 
     ##########################################################################
     # Init & Shutdown
     ##########################################################################
 
-    def __init__(self, hub_whitelist, hub_blacklist):
+    def __init__(self, hub_whitelist, hub_blacklist, hub_timeout=2.0, heartbeat_thread=True, trace_recorder=None):
+        '''
+          @param hub_timeout : how long to wait on each hub for the result of an operation (sec)
+          @type float
+          @param heartbeat_thread : keep the hubs alive from a background thread, otherwise
+                 the owner is responsible for calling heartbeat() regularly
+          @type bool
+          @param trace_recorder : record the (decrypted) flip requests read from the hubs
+          @type trace.TraceRecorder
+        '''
         self._param = {}
         self._param['hub_whitelist'] = hub_whitelist
         self._param['hub_blacklist'] = hub_blacklist
+        self._param['hub_timeout'] = hub_timeout
         self.hubs = []
         self._hub_lock = threading.Lock()
+        self._hub_locks = {}  # hub uri : threading.Lock
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # last good answers, hub uri : result
+        self._last_remote_gateway_names = {}
+        self._last_flip_requests = {}
+        self._hub_selector = hub_selector.HubSelector()
+        self._trace_recorder = trace_recorder
+        # one thread keeping this gateway alive on all hubs (ping key, registration check, latency)
+        self._heartbeat_scheduler = gateway_hub.HeartbeatScheduler()
+        if heartbeat_thread:
+            self._heartbeat_scheduler.start()
 
     def is_connected(self):
         return True if self.hubs else False
 
+    def shutdown(self):
+        '''
+          Stop the fan out and heartbeat threads. Anything still running on a hub is waited for.
+        '''
+        self._heartbeat_scheduler.shutdown()
+        with self._executor_lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.close()
+            executor.join()
+
+    def heartbeat(self):
+        '''
+          Heartbeat all hubs once, right now. Only needed when not running the heartbeat thread.
+        '''
+        self._heartbeat_scheduler.beat()
+
     ##########################################################################
     # Introspection
     ##########################################################################
@@ -57,10 +119,8 @@ class HubManager(object):
           @rtype list of str
         '''
         remote_gateway_names = []
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            remote_gateway_names.extend(hub.list_remote_gateway_names())
-        self._hub_lock.release()
+        for unused_hub, names in self._fan_out(lambda hub: hub.list_remote_gateway_names()):
+            remote_gateway_names.extend(names)
         # return the list without duplicates
         return list(set(remote_gateway_names))
 
@@ -71,17 +131,19 @@ class HubManager(object):
 
             dic['remote_gateway_name'] = ['hub1', 'hub2']
 
-          where the hub list is a list of actual hub object references.
+          where the hub list is a list of actual hub object references,
+          best (preferred) hub first.
         '''
         dic = {}
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            for remote_gateway in hub.list_remote_gateway_names():
+        for hub, remote_gateways in self._fan_out(lambda hub: hub.list_remote_gateway_names(),
+                                                  last_results=self._last_remote_gateway_names):
+            for remote_gateway in remote_gateways:
                 if remote_gateway in dic:
                     dic[remote_gateway].append(hub)
                 else:
                     dic[remote_gateway] = [hub]
-        self._hub_lock.release()
+        for remote_gateway, hubs in dic.items():
+            dic[remote_gateway] = self._hub_selector.rank(remote_gateway, hubs)
         return dic
 
     def get_flip_requests(self):
@@ -91,11 +153,16 @@ class HubManager(object):
           @return list of flip registration requests
           @rtype list of utils.Registration
         '''
+        def get_unblocked_flipped_in_connections(hub):
+            hub_registrations = hub.get_unblocked_flipped_in_connections()
+            if self._trace_recorder is not None:
+                # decrypted, so replaying them doesn't need this gateway's private key
+                self._trace_recorder.record_flip_requests(hub.uri, hub_registrations)
+            return hub_registrations
         registrations = []
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            registrations.extend(hub.get_unblocked_flipped_in_connections())
-        self._hub_lock.release()
+        for unused_hub, hub_registrations in self._fan_out(get_unblocked_flipped_in_connections,
+                                                           last_results=self._last_flip_requests):
+            registrations.extend(hub_registrations)
         return registrations
 
     def remote_gateway_info(self, remote_gateway_name):
@@ -108,16 +175,12 @@ class HubManager(object):
           @return remote gateway information
           @rtype gateway_msgs.RemotGateway or None
         '''
-        remote_gateway_info = None
-        self._hub_lock.acquire()
-        for hub in self.hubs:
+        def remote_gateway_info(hub):
             if remote_gateway_name in hub.list_remote_gateway_names():
-                # I don't think we need more than one hub's info....
-                remote_gateway_info = hub.remote_gateway_info(remote_gateway_name)
-                if remote_gateway_info is not None:
-                    break
-        self._hub_lock.release()
-        return remote_gateway_info
+                return hub.remote_gateway_info(remote_gateway_name)
+            return None
+        # I don't think we need more than one hub's info....the preferred hub's will do
+        return self._select_result(remote_gateway_name, self._fan_out(remote_gateway_info))
 
     def get_remote_gateway_firewall_flag(self, remote_gateway_name):
         '''
@@ -130,18 +193,29 @@ class HubManager(object):
                   gateway information cannot found
           @rtype Bool
         '''
-        firewall_flag = None
-        self._hub_lock.acquire()
-        for hub in self.hubs:
+        def firewall_flag(hub):
             if remote_gateway_name in hub.list_remote_gateway_names():
-                # I don't think we need more than one hub's info....
                 try:
-                    firewall_flag = hub.get_remote_gateway_firewall_flag(remote_gateway_name)
-                    break
+                    return hub.get_remote_gateway_firewall_flag(remote_gateway_name)
                 except GatewayUnavailableError:
-                    pass  # cycle through the other hubs looking as well.
-        self._hub_lock.release()
-        return firewall_flag
+                    pass  # the other hubs are looking as well.
+            return None
+        # I don't think we need more than one hub's info....
+        return self._select_result(remote_gateway_name, self._fan_out(firewall_flag))
+
+    def _select_result(self, remote_gateway_name, results):
+        '''
+          Pick the answer from the best ranked hub that had one.
+
+          @param results : (hub, result) pairs from _fan_out, result is None if the hub had no answer
+          @type [(rocon_gateway.GatewayHub, object)]
+        '''
+        answers = dict((hub.uri, result) for hub, result in results if result is not None)
+        if not answers:
+            return None
+        hubs = [hub for hub, result in results if result is not None]
+        # only some of the hubs, leave the preference to get_remote_gateway_hub_index()
+        return answers[self._hub_selector.rank(remote_gateway_name, hubs, update_preference=False)[0].uri]
 
     def send_unflip_request(self, remote_gateway_name, remote_rule):
         '''
@@ -157,16 +231,15 @@ class HubManager(object):
           @param remote_rule : the remote rule to unflip
           @type gateway_msgs.RemoteRule
         '''
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            if remote_gateway_name in hub.list_remote_gateway_names():
-                try:
-                    if hub.send_unflip_request(remote_gateway_name, remote_rule):
-                        self._hub_lock.release()
-                        return
-                except GatewayUnavailableError:
-                    pass  # cycle through the other hubs looking as well.
-        self._hub_lock.release()
+        # only one hub holds the original flip request, stop as soon as it is found
+        for hub in self._get_hubs():
+            with self._get_hub_lock(hub):
+                if remote_gateway_name in hub.list_remote_gateway_names():
+                    try:
+                        if hub.send_unflip_request(remote_gateway_name, remote_rule):
+                            return
+                    except GatewayUnavailableError:
+                        pass  # cycle through the other hubs looking as well.
 
     ##########################################################################
     # Hub Connections
@@ -201,7 +274,8 @@ class HubManager(object):
 
           @raise
         '''
-        self._hub_lock.acquire()
+        hub_lock = self._get_hub_lock(new_hub)
+        hub_lock.acquire()
         try:
             new_hub.register_gateway(firewall_flag,
                                      gateway_unique_name,
@@ -211,45 +285,65 @@ class HubManager(object):
             for connection_type in utils.connection_types:
                 for advertisement in existing_advertisements[connection_type]:
                     new_hub.advertise(advertisement)
-
-            # forcefully replace obsolete hub if needed
-            if new_hub in self.hubs:
-                self.hubs.remove(new_hub)
-
-            self.hubs.append(new_hub)
         except rocon_hub_client.HubError as e:
             return None, e.id, str(e)
         except redis.exceptions.ConnectionError as ce:
             return None, gateway_msgs.ErrorCodes.HUB_CONNECTION_FAILED, str(ce)
         finally:
-            self._hub_lock.release()
+            hub_lock.release()
+        self._hub_lock.acquire()
+        # forcefully replace obsolete hub if needed
+        if new_hub in self.hubs:
+            self.hubs.remove(new_hub)
+        self.hubs.append(new_hub)
+        self._hub_lock.release()
+        self._heartbeat_scheduler.add(new_hub)
         return new_hub, gateway_msgs.ErrorCodes.SUCCESS, "success"
 
-    def is_connected_to_hub(self, ip, port):
+    def is_connected_to_hub(self, ip, port, connection_pool=None):
         '''
           Check if the gateway is properly connected to the hub.
+
+          @param connection_pool : an already verified pool to use if a new hub connection is needed
+          @type redis.ConnectionPool
         '''
         hub = None
         # Retrieve existing hub from set
-        for h in self.hubs:
+        for h in self._get_hubs():
             if h.ip == ip and h.port == port:
                 hub = h
                 break
 
         if not hub:  # if needed we create a new one
             try:
-                hub = gateway_hub.GatewayHub(ip, port, self._param['hub_whitelist'], self._param['hub_blacklist'])
+                hub = gateway_hub.GatewayHub(ip, port, self._param['hub_whitelist'], self._param['hub_blacklist'],
+                                             connection_pool)
             except rocon_hub_client.HubError as e:
                 return None, e.id, str(e)
 
-        self._hub_lock.acquire()
-        registered = hub.is_gateway_registered()
-        self._hub_lock.release()
+        with self._get_hub_lock(hub):
+            registered = hub.is_gateway_registered()
         if registered:
             return hub, gateway_msgs.ErrorCodes.HUB_CONNECTION_ALREADY_EXISTS, "already connected to this hub"
         else:
             return hub, gateway_msgs.ErrorCodes.NO_HUB_CONNECTION, "not connected to this hub"
 
+    def lose_hub(self, ip, port):
+        '''
+          Tear down the connection to a hub that has been reported gone by
+          something other than the heartbeat (e.g. zeroconf), exactly as if
+          its heartbeat had failed.
+
+          @return True if we were connected to the hub
+          @rtype bool
+        '''
+        for hub in self._get_hubs():
+            if hub.ip == ip and hub.port == port:
+                self._heartbeat_scheduler.remove(hub)
+                hub._hub_connection_lost_hook()
+                return True
+        return False
+
     def disengage_hub(self, hub_to_be_disengaged):
         '''
           Disengages a hub. Make sure all necessary connections
@@ -259,25 +353,24 @@ class HubManager(object):
         '''
         # uri = str(ip) + ":" + str(port)
         # Could dig in and find the name here, but not worth the bother.
+        self._heartbeat_scheduler.remove(hub_to_be_disengaged)
         hub_to_be_disengaged.disconnect()  # necessary to kill failing socket receives
         self._hub_lock.acquire()
         if hub_to_be_disengaged in self.hubs:
             rospy.loginfo("Gateway : disengaged connection with the hub [%s][%s]" % (
                 hub_to_be_disengaged.name, hub_to_be_disengaged.uri))
             self.hubs[:] = [hub for hub in self.hubs if hub != hub_to_be_disengaged]
+            self._hub_locks.pop(hub_to_be_disengaged.uri, None)
+            self._last_remote_gateway_names.pop(hub_to_be_disengaged.uri, None)
+            self._last_flip_requests.pop(hub_to_be_disengaged.uri, None)
         self._hub_lock.release()
 
     def advertise(self, connection):
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            hub.advertise(connection)
-        self._hub_lock.release()
+        # writes must not be dropped, so wait for the hub's lock however long it takes
+        self._fan_out(lambda hub: hub.advertise(connection), wait_for_lock=True)
 
     def unadvertise(self, connection):
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            hub.unadvertise(connection)
-        self._hub_lock.release()
+        self._fan_out(lambda hub: hub.unadvertise(connection), wait_for_lock=True)
 
     def match_remote_gateway_name(self, remote_gateway_name):
         '''
@@ -286,11 +379,13 @@ class HubManager(object):
         '''
         matches = []
         weak_matches = []  # doesn't match any hash names, but matches a base name
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            matches.extend(hub.matches_remote_gateway_name(remote_gateway_name))
-            weak_matches.extend(hub.matches_remote_gateway_basename(remote_gateway_name))
-        self._hub_lock.release()
+
+        def match(hub):
+            return (hub.matches_remote_gateway_name(remote_gateway_name),
+                    hub.matches_remote_gateway_basename(remote_gateway_name))
+        for unused_hub, (hub_matches, hub_weak_matches) in self._fan_out(match):
+            matches.extend(hub_matches)
+            weak_matches.extend(hub_weak_matches)
         # these are hash name lists, make sure they didn't pick up matches for a single hash name from multiple hubs
         matches = list(set(matches))
         weak_matches = list(set(weak_matches))
@@ -303,7 +398,105 @@ class HubManager(object):
           @param statistics
           @type gateway_msgs.ConnectionStatistics
         '''
+        self._fan_out(lambda hub: hub.publish_network_statistics(statistics))
+
+    ##########################################################################
+    # Fan Out
+    ##########################################################################
+
+    def _get_hubs(self):
+        '''
+          @return a snapshot of the current hub list
+          @rtype [rocon_gateway.GatewayHub]
+        '''
         self._hub_lock.acquire()
-        for hub in self.hubs:
-            hub.publish_network_statistics(statistics)
+        hubs = list(self.hubs)
         self._hub_lock.release()
+        return hubs
+
+    def _get_hub_lock(self, hub):
+        self._hub_lock.acquire()
+        try:
+            return self._hub_locks.setdefault(hub.uri, threading.Lock())
+        finally:
+            self._hub_lock.release()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = multiprocessing.pool.ThreadPool(8)
+            return self._executor
+
+    def _fan_out(self, operation, wait_for_lock=False, last_results=None):
+        '''
+          Run an operation on every hub concurrently, gathering results in hub
+          order. Hubs that haven't finished by the deadline (including those
+          whose lock is tied up by an earlier, still running operation) or
+          raised are skipped.
+
+          Skipped hubs are left out of the results, unless last_results has an
+          answer from them - then that is used instead. Use it where leaving a
+          hub out would be taken for the hub having nothing (and lead to
+          things being torn down).
+
+          @param operation : callable taking a hub as its only argument
+          @type method
+          @param wait_for_lock : block on the hub lock regardless of the deadline (for writes)
+          @type bool
+          @param last_results : last good result of this operation on each hub, updated here
+          @type dict hub uri : object
+
+          @return list of (hub, result) tuples
+          @rtype [(rocon_gateway.GatewayHub, object)]
+        '''
+        hubs = self._get_hubs()
+        deadline = time.time() + self._param['hub_timeout']
+        lock_deadline = None if wait_for_lock else deadline
+        if len(hubs) == 1:
+            # no point paying for a thread hop
+            try:
+                outcomes = [(hubs[0], self._run_on_hub(hubs[0], operation, lock_deadline))]
+            except Exception as e:
+                outcomes = [(hubs[0], e)]
+        else:
+            executor = self._get_executor()
+            pending = [(hub, executor.apply_async(self._run_on_hub, (hub, operation, lock_deadline))) for hub in hubs]
+            outcomes = []
+            for hub, async_result in pending:
+                try:
+                    outcomes.append((hub, async_result.get(max(0.0, deadline - time.time()))))
+                except multiprocessing.TimeoutError:
+                    outcomes.append((hub, _SKIPPED))
+                except Exception as e:
+                    outcomes.append((hub, e))
+        results = []
+        for hub, result in outcomes:
+            if result is _SKIPPED or isinstance(result, Exception):
+                if result is _SKIPPED:
+                    rospy.logwarn("Gateway : hub is too slow to respond, skipping it this time [%s][%s]" % (
+                        hub.name, hub.uri))
+                else:
+                    rospy.logwarn("Gateway : hub operation failed, skipping it this time [%s][%s][%s]" % (
+                        hub.name, hub.uri, str(result)))
+                if last_results is not None and hub.uri in last_results:
+                    results.append((hub, last_results[hub.uri]))
+                continue
+            if last_results is not None:
+                last_results[hub.uri] = result
+            results.append((hub, result))
+        return results
+
+    def _run_on_hub(self, hub, operation, lock_deadline):
+        hub_lock = self._get_hub_lock(hub)
+        if lock_deadline is None:
+            hub_lock.acquire()
+        else:
+            # no timeouts on lock acquisition in python 2, so poll
+            while not hub_lock.acquire(False):
+                if time.time() > lock_deadline:
+                    return _SKIPPED
+                time.sleep(0.001)
+        try:
+            return operation(hub)
+        finally:
+            hub_lock.release()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+###############################################################################
+# Imports
+###############################################################################
+
+import threading
+
+import rospy
+
+##############################################################################
+# Hub Selector
+##############################################################################
+
+
+class HubSelector(object):
+
+    '''
+      Orders the hubs through which a remote gateway can be reached, best
+      first. Healthy hubs (circuit breaker closed) are ranked by the average
+      round trip time measured by the heartbeat, followed by healthy hubs
+      that haven't been measured yet and finally unhealthy hubs.
+
+      The choice is sticky per remote gateway - the current hub is only
+      abandoned if it becomes unhealthy, disappears or another hub is
+      faster by a clear margin. This stops flips hopping between hubs of
+      similar latency on every bit of jitter.
+    '''
+
+    def __init__(self, switch_ratio=0.7, switch_margin=2.0):
+        '''
+          @param switch_ratio : a hub must have an rtt below this fraction of the current hub's to take over
+          @type float
+          @param switch_margin : and be faster by at least this much (ms)
+          @type float
+        '''
+        self._switch_ratio = switch_ratio
+        self._switch_margin = switch_margin
+        self._preferred = {}  # remote gateway name : hub uri
+        self._lock = threading.Lock()
+
+    def rank(self, remote_gateway, hubs, update_preference=True):
+        '''
+          @param remote_gateway : the hash name for the remote gateway
+          @type str
+          @param hubs : hubs on which the remote gateway is registered
+          @type [rocon_gateway.GatewayHub]
+          @param update_preference : make the best hub the preferred one. Only do this
+                 when ranking all the remote gateway's hubs, not some of them (e.g. those
+                 that happened to answer), else a preferred hub that is left out is lost.
+          @type bool
+
+          @return the same hubs, best first
+          @rtype [rocon_gateway.GatewayHub]
+        '''
+        if len(hubs) < 2:
+            return list(hubs)
+        scores = dict((hub.uri, _score(hub)) for hub in hubs)
+        ranked = sorted(hubs, key=lambda hub: scores[hub.uri])
+        best = ranked[0]
+        with self._lock:
+            current = None
+            preferred_uri = self._preferred.get(remote_gateway)
+            for hub in hubs:
+                if hub.uri == preferred_uri:
+                    current = hub
+                    break
+            if current is not None and current is not best and \
+                    not self._should_switch(scores[current.uri], scores[best.uri]):
+                best = current
+            if update_preference:
+                if preferred_uri is not None and best.uri != preferred_uri:
+                    rospy.loginfo("Gateway : switching hubs for remote gateway [%s][%s->%s]" % (
+                        remote_gateway, preferred_uri, best.uri))
+                self._preferred[remote_gateway] = best.uri
+        return [best] + [hub for hub in ranked if hub is not best]
+
+    def _should_switch(self, current_score, best_score):
+        (current_health, current_rtt) = current_score
+        (best_health, best_rtt) = best_score
+        if current_health != best_health:
+            return True  # current has gone unhealthy (or unmeasured while the best is measured)
+        if current_rtt is None or best_rtt is None:
+            return False
+        return best_rtt < current_rtt * self._switch_ratio and current_rtt - best_rtt > self._switch_margin
+
+
+def _score(hub):
+    '''
+      @return sortable (health rank, average rtt) - lower is better
+      @rtype (int, float)
+    '''
+    circuit_breaker = getattr(hub, 'circuit_breaker', None)
+    if circuit_breaker is not None and not circuit_breaker.allow():
+        return (2, None)
+    rtt = hub.latency_statistics.average()
+    if rtt is None:
+        return (1, None)
+    return (0, rtt)
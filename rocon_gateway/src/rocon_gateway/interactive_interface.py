@@ -15,6 +15,7 @@ import threading
 from gateway_msgs.msg import RemoteRule
 
 from . import utils
+from . import registration_store
 
 ##############################################################################
 # Classes
@@ -50,9 +51,9 @@ class InteractiveInterface(object):
         # Specific rules used to determine what local rules to flip
         self.watchlist = utils.create_empty_connection_type_dictionary()
 
-        # keys are connection_types, elements are lists of utils.Registration objects
+        # indexed store of utils.Registration objects (self.registrations[connection_type] gives a list)
         # Flips from remote gateways that have been locally registered
-        self.registrations = utils.create_empty_connection_type_dictionary()
+        self.registrations = registration_store.RegistrationStore()
 
         # Blacklists when doing flip all - different for each gateway, each value
         # is one of our usual rule type dictionaries
@@ -269,20 +270,7 @@ class InteractiveInterface(object):
           @return matching registration or none
           @rtype utils.Registration
         '''
-
-        matched_registration = None
-        self._lock.acquire()
-        for registration in self.registrations[connection_type]:
-            if (registration.remote_gateway == remote_gateway) and \
-               (registration.connection.rule.name == remote_name) and \
-               (registration.connection.rule.node == remote_node) and \
-               (registration.connection.rule.type == connection_type):
-                matched_registration = registration
-                break
-            else:
-                continue
-        self._lock.release()
-        return matched_registration
+        return self.registrations.find(remote_gateway, connection_type, remote_name, remote_node)
 
     def _is_in_blacklist(self, gateway, connection_type, name, node):
         '''
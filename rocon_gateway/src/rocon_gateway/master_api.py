@@ -7,6 +7,7 @@
 # Imports
 ##############################################################################
 
+import collections
 import os
 import socket
 import httplib
@@ -27,13 +28,64 @@ import threading
 
 import rospy
 import rosgraph
-import rostopic
 import rosservice
 import roslib.names
 import gateway_msgs.msg as gateway_msgs
 import rocon_gateway_utils
 
 from . import utils, GatewayError
+from . import xmlrpc_pool
+from . import change_feed
+
+
+##############################################################################
+# System State
+##############################################################################
+
+# The shapes the connection cache proxy hands over - channel name keyed dictionaries
+# of channels, each with a list of (node, node xmlrpc uri) tuples.
+Channel = collections.namedtuple('Channel', 'name type xmlrpc_uri nodes')
+SystemState = collections.namedtuple('SystemState', 'publishers subscribers services action_servers action_clients')
+
+_action_inbound_topics = ['/goal', '/cancel']
+_action_outbound_topics = ['/status', '/feedback', '/result']
+
+
+def _extract_actions(inbound, outbound):
+    '''
+      Pull the action topics out of the pub/sub lists (modified in place). Action
+      servers subscribe to goal/cancel and publish status/feedback/result, so
+      pass subscribers then publishers to extract servers, the reverse for clients.
+
+      @param inbound : topic name : node set, for goal and cancel
+      @type dict
+      @param outbound : topic name : node set, for status, feedback and result
+      @type dict
+
+      @return action name : node set
+      @rtype dict
+    '''
+    actions = {}
+    for goal_topic in [name for name in inbound.keys() if name.endswith('/goal')]:
+        action_name = goal_topic[:-len('/goal')]
+        nodes = set(inbound.get(goal_topic, ()))
+        for suffix in _action_inbound_topics[1:]:
+            nodes &= inbound.get(action_name + suffix, set())
+        for suffix in _action_outbound_topics:
+            nodes &= outbound.get(action_name + suffix, set())
+        if not nodes:
+            continue
+        actions[action_name] = nodes
+        for topics, suffixes in [(inbound, _action_inbound_topics), (outbound, _action_outbound_topics)]:
+            for suffix in suffixes:
+                topics[action_name + suffix] -= nodes
+                if not topics[action_name + suffix]:
+                    del topics[action_name + suffix]
+    return actions
+
+##############################################################################
+# Local Master
+##############################################################################
 
 
 class LocalMaster(rosgraph.Master):
@@ -45,13 +97,35 @@ class LocalMaster(rosgraph.Master):
       been pulled or flipped in from another gateway.
     '''
 
-    def __init__(self, connection_cache_timeout=None):
-        rosgraph.Master.__init__(self, rospy.get_name())
+    def __init__(self, connection_cache_timeout=None, master_uri=None, use_connection_cache=True, trace_recorder=None):
+        '''
+          @param master_uri : talk to this master rather than the one from the environment
+          @type str
+          @param use_connection_cache : follow a connection cache node, otherwise the owner
+                 polls the master for connection updates with refresh_connections()
+          @type bool
+          @param trace_recorder : record the connection cache callbacks
+          @type trace.TraceRecorder
+        '''
+        rosgraph.Master.__init__(self, rospy.get_name(), master_uri=master_uri)
+        # all master traffic (ours, the anonymous registration nodes and the
+        # topic/service lookups) goes over a handful of keep-alive connections
+        self.master_connection_pool = xmlrpc_pool.XmlrpcConnectionPool(self.master_uri)
+        self.handle = self.master_connection_pool.proxy()
 
         timeout = connection_cache_timeout or rospy.Time(30)
 
+        # Copy-on-write: the (version, connections) snapshot is immutable (dict of frozensets) and
+        # replaced wholesale on every connection cache update, never modified in place. Readers
+        # just grab the reference, the lock only serialises writers.
         self.connections_lock = threading.Lock()
-        self.connections = utils.create_empty_connection_type_dictionary(set)
+        self._connection_snapshot = (0, utils.create_empty_connection_type_dictionary(frozenset))
+        self.change_feed = change_feed.ConnectionChangeFeed()
+        self.trace_recorder = trace_recorder
+        if not use_connection_cache:
+            self.connection_cache = None
+            self.get_system_state = self.getSystemState
+            return
         # in case this class is used directly (script call) we need to find the connection cache
 
         connection_cache_namespace = rocon_gateway_utils.resolve_connection_cache(timeout)
@@ -83,14 +157,15 @@ class LocalMaster(rosgraph.Master):
           @rtype utils.Registration
         '''
         # rograph.Master doesn't care whether the node is prefixed with slash or not, but we use it to
-        # compare registrations later in FlippedInterface._is_registration_in_remote_rule()
-        registration.local_node = "/" + self._get_anonymous_node_name(registration.connection.rule.node)
+        # compare registrations later in FlippedInterface._is_remote_rule_flipped_in()
+        registration = registration.with_local_node(
+            "/" + self._get_anonymous_node_name(registration.connection.rule.node))
         rospy.logdebug("Gateway : registering a new node [%s] for [%s]" % (registration.local_node, registration))
 
         # Then do we need checkIfIsLocal? Needs lots of parsing time, and the outer class should
         # already have handle that.
 
-        node_master = rosgraph.Master(registration.local_node)
+        node_master = xmlrpc_pool.PooledMaster(registration.local_node, self.master_connection_pool)
         if registration.connection.rule.type == rocon_python_comms.PUBLISHER:
             try:
                 node_master.registerPublisher(
@@ -131,11 +206,11 @@ class LocalMaster(rosgraph.Master):
                     registration.connection.rule.name, str(e)))
                 return None
         elif registration.connection.rule.type == rocon_python_comms.SERVICE:
-            node_name = rosservice.get_service_node(registration.connection.rule.name)
-            if node_name is not None:
+            service_uri = self._lookup_service_uri(registration.connection.rule.name)
+            if service_uri is not None:
                 rospy.logwarn(
                     "Gateway : tried to register a service that is already locally available, aborting [%s][%s]" %
-                    (registration.connection.rule.name, node_name))
+                    (registration.connection.rule.name, service_uri))
                 return None
             else:
                 if registration.connection.rule.name is None:
@@ -277,7 +352,7 @@ class LocalMaster(rosgraph.Master):
           @param registration : registration details for an existing gateway registered rule
           @type utils.Registration
         '''
-        node_master = rosgraph.Master(registration.local_node)
+        node_master = xmlrpc_pool.PooledMaster(registration.local_node, self.master_connection_pool)
         rospy.logdebug("Gateway : unregistering local node [%s] for [%s]" % (registration.local_node, registration))
         if registration.connection.rule.type == rocon_python_comms.PUBLISHER:
             try:
@@ -423,62 +498,53 @@ class LocalMaster(rosgraph.Master):
         # getting the topic name, to checking for hte xmlrpc_uri and especially topic_type here in which
         # the topic could have disappeared. When this happens, it returns None.
         connections = []
-        xmlrpc_uri = node.split(",")[1]
-        node = node.split(",")[0]
+        node, xmlrpc_uri = utils.split_node_uri(node)
 
         if xmlrpc_uri is None:
             return connections
         if connection_type == rocon_python_comms.PUBLISHER or connection_type == rocon_python_comms.SUBSCRIBER:
-            type_info = rostopic.get_topic_type(name)[0]  # message type
+            type_info = self._get_topic_type(name)  # message type
             if type_info is not None:
                 connections.append(utils.Connection(gateway_msgs.Rule(connection_type, name, node), type_info, type_info, xmlrpc_uri))
             else:
                 rospy.logwarn('Gateway : [%s] does not have type_info. Cannot flip' % name)
         elif connection_type == rocon_python_comms.SERVICE:
-            type_info = rosservice.get_service_uri(name)
-            type_msg = rosservice.get_service_type(name)
+            type_info = self._lookup_service_uri(name)
             if type_info is not None:
+                type_msg = self._get_service_type(name, type_info)
                 connections.append(utils.Connection(gateway_msgs.Rule(connection_type, name, node), type_msg, type_info, xmlrpc_uri))
-        elif connection_type == rocon_python_comms.ACTION_SERVER:
-            goal_type_info = rostopic.get_topic_type(name + '/goal')[0]  # message type
-            cancel_type_info = rostopic.get_topic_type(name + '/cancel')[0]  # message type
-            status_type_info = rostopic.get_topic_type(name + '/status')[0]  # message type
-            feedback_type_info = rostopic.get_topic_type(name + '/feedback')[0]  # message type
-            result_type_info = rostopic.get_topic_type(name + '/result')[0]  # message type
-            if (
-                goal_type_info is not None and cancel_type_info is not None and
-                status_type_info is not None and feedback_type_info is not None and
-                result_type_info is not None
-            ):
-                connections.append(utils.Connection(gateway_msgs.Rule(rocon_python_comms.SUBSCRIBER, name + '/goal', node), goal_type_info, goal_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.SUBSCRIBER, name + '/cancel', node), cancel_type_info, cancel_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.PUBLISHER, name + '/status', node), status_type_info, status_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.PUBLISHER, name + '/feedback', node), feedback_type_info, feedback_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.PUBLISHER, name + '/result', node), result_type_info, result_type_info, xmlrpc_uri))
-        elif connection_type == rocon_python_comms.ACTION_CLIENT:
-            goal_type_info = rostopic.get_topic_type(name + '/goal')[0]  # message type
-            cancel_type_info = rostopic.get_topic_type(name + '/cancel')[0]  # message type
-            status_type_info = rostopic.get_topic_type(name + '/status')[0]  # message type
-            feedback_type_info = rostopic.get_topic_type(name + '/feedback')[0]  # message type
-            result_type_info = rostopic.get_topic_type(name + '/result')[0]  # message type
+        elif connection_type == rocon_python_comms.ACTION_SERVER or connection_type == rocon_python_comms.ACTION_CLIENT:
+            # one master round trip for all five action topics
+            topic_types = self._get_topic_types()
+            goal_type_info = topic_types.get(name + '/goal')  # message type
+            cancel_type_info = topic_types.get(name + '/cancel')  # message type
+            status_type_info = topic_types.get(name + '/status')  # message type
+            feedback_type_info = topic_types.get(name + '/feedback')  # message type
+            result_type_info = topic_types.get(name + '/result')  # message type
             if (
                 goal_type_info is not None and cancel_type_info is not None and
                 status_type_info is not None and feedback_type_info is not None and
                 result_type_info is not None
             ):
-                connections.append(utils.Connection(gateway_msgs.Rule(rocon_python_comms.PUBLISHER, name + '/goal', node), goal_type_info, goal_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.PUBLISHER, name + '/cancel', node), cancel_type_info, cancel_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.SUBSCRIBER, name + '/status', node), status_type_info, status_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.SUBSCRIBER, name + '/feedback', node), feedback_type_info, feedback_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.SUBSCRIBER, name + '/result', node), result_type_info, result_type_info, xmlrpc_uri))
+                if connection_type == rocon_python_comms.ACTION_SERVER:
+                    inbound, outbound = rocon_python_comms.SUBSCRIBER, rocon_python_comms.PUBLISHER
+                else:
+                    inbound, outbound = rocon_python_comms.PUBLISHER, rocon_python_comms.SUBSCRIBER
+                connections.append(utils.Connection(
+                    gateway_msgs.Rule(inbound, name + '/goal', node),
+                    goal_type_info, goal_type_info, xmlrpc_uri))
+                connections.append(utils.Connection(
+                    gateway_msgs.Rule(inbound, name + '/cancel', node),
+                    cancel_type_info, cancel_type_info, xmlrpc_uri))
+                connections.append(utils.Connection(
+                    gateway_msgs.Rule(outbound, name + '/status', node),
+                    status_type_info, status_type_info, xmlrpc_uri))
+                connections.append(utils.Connection(
+                    gateway_msgs.Rule(outbound, name + '/feedback', node),
+                    feedback_type_info, feedback_type_info, xmlrpc_uri))
+                connections.append(utils.Connection(
+                    gateway_msgs.Rule(outbound, name + '/result', node),
+                    result_type_info, result_type_info, xmlrpc_uri))
         return connections
 
     def generate_advertisement_connection_details(self, connection_type, name, node):
@@ -511,22 +577,68 @@ class LocalMaster(rosgraph.Master):
         if xmlrpc_uri is None:
             return connection
         if connection_type == rocon_python_comms.PUBLISHER or connection_type == rocon_python_comms.SUBSCRIBER:
-            type_info = rostopic.get_topic_type(name)[0]  # message type
+            type_info = self._get_topic_type(name)  # message type
             if type_info is not None:
                 connection = utils.Connection(gateway_msgs.Rule(connection_type, name, node), type_info, type_info, xmlrpc_uri)
         elif connection_type == rocon_python_comms.SERVICE:
-            type_info = rosservice.get_service_uri(name)
-            type_msg = rosservice.get_service_type(name)
+            type_info = self._lookup_service_uri(name)
             if type_info is not None:
+                type_msg = self._get_service_type(name, type_info)
                 connection = utils.Connection(gateway_msgs.Rule(connection_type, name, node), type_msg, type_info, xmlrpc_uri)
         elif connection_type == rocon_python_comms.ACTION_SERVER or connection_type == rocon_python_comms.ACTION_CLIENT:
-            goal_topic = name + '/goal'
-            goal_topic_type = rostopic.get_topic_type(goal_topic)
-            type_info = re.sub('ActionGoal$', '', goal_topic_type[0])  # Base type for action
-            if type_info is not None:
+            goal_topic_type = self._get_topic_type(name + '/goal')
+            if goal_topic_type is not None:
+                type_info = re.sub('ActionGoal$', '', goal_topic_type)  # Base type for action
                 connection = utils.Connection(gateway_msgs.Rule(connection_type, name, node), type_info, type_info, xmlrpc_uri)
         return connection
 
+    def get_master_call_statistics(self):
+        '''
+          Latency counters for all the master traffic generated by the gateway.
+
+          @return method name keyed dictionary of (calls, errors, avg time, max time)
+          @rtype dict
+        '''
+        return self.master_connection_pool.statistics()
+
+    def _get_topic_types(self):
+        '''
+          @return topic name keyed dictionary of message types
+          @rtype dict
+        '''
+        return dict(self.getTopicTypes())
+
+    def _get_topic_type(self, name):
+        '''
+          Equivalent of rostopic.get_topic_type, but over the pooled connections.
+
+          @return the message type or None if the topic is unknown
+          @rtype str
+        '''
+        topic_type = self._get_topic_types().get(name)
+        if topic_type == rosgraph.names.ANYTYPE:
+            return None
+        return topic_type
+
+    def _lookup_service_uri(self, name):
+        '''
+          Equivalent of rosservice.get_service_uri, but over the pooled connections.
+
+          @return the rosrpc uri or None if the service is not registered
+          @rtype str
+        '''
+        try:
+            return self.lookupService(name)
+        except rosgraph.MasterError:
+            return None
+
+    def _get_service_type(self, name, service_uri):
+        '''
+          Equivalent of rosservice.get_service_type without the repeat master
+          lookup (we already have the uri) - this probes the service itself.
+        '''
+        return rosservice.get_service_headers(name, service_uri).get('type', None)
+
     def get_ros_ip(self):
         o = urlparse.urlparse(rosgraph.get_master_uri())
         if o.hostname == 'localhost':
@@ -561,91 +673,153 @@ class LocalMaster(rosgraph.Master):
         name = roslib.names.anonymous_name(t)
         return name
 
+    @staticmethod
+    def _get_connections_from_system_state(system_state):
+        '''
+          Convert a connection cache proxy system state into gateway connections.
+
+          @return connection type keyed dictionary of utils.Connection sets
+          @rtype dict
+        '''
+        connections = {}
+        connections[gateway_msgs.ConnectionType.ACTION_SERVER] = utils._get_connections_from_action_chan_dict(
+            system_state.action_servers, gateway_msgs.ConnectionType.ACTION_SERVER
+        )
+        connections[gateway_msgs.ConnectionType.ACTION_CLIENT] = utils._get_connections_from_action_chan_dict(
+            system_state.action_clients, gateway_msgs.ConnectionType.ACTION_CLIENT
+        )
+        connections[gateway_msgs.ConnectionType.PUBLISHER] = utils._get_connections_from_pub_sub_chan_dict(
+            system_state.publishers, gateway_msgs.ConnectionType.PUBLISHER
+        )
+        connections[gateway_msgs.ConnectionType.SUBSCRIBER] = utils._get_connections_from_pub_sub_chan_dict(
+            system_state.subscribers, gateway_msgs.ConnectionType.SUBSCRIBER
+        )
+        connections[gateway_msgs.ConnectionType.SERVICE] = utils._get_connections_from_service_chan_dict(
+            system_state.services, gateway_msgs.ConnectionType.SERVICE
+        )
+        return connections
+
+    def refresh_connections(self):
+        '''
+          Rebuild the local connection state straight from the master, doing
+          the connection cache's job - for use when running without one. Costs
+          a getSystemState, a getTopicTypes, a lookupNode per node and a
+          lookupService per service.
+        '''
+        self._connection_cache_proxy_cb(self._get_system_state_from_master(), None, None)
+
+    def _get_system_state_from_master(self):
+        '''
+          @return the system state in the connection cache proxy's format
+          @rtype SystemState
+        '''
+        publishers, subscribers, services = self.getSystemState()
+        publishers = dict((name, set(nodes)) for name, nodes in publishers)
+        subscribers = dict((name, set(nodes)) for name, nodes in subscribers)
+        topic_types = self._get_topic_types()
+        node_uris = {}
+
+        def node_uri(node):
+            if node not in node_uris:
+                try:
+                    node_uris[node] = self.lookupNode(node)
+                except rosgraph.MasterError:
+                    node_uris[node] = None  # gone already
+            return node_uris[node]
+
+        def channels(names_and_nodes, xmlrpc_uris=None, type_topic_suffix=''):
+            channel_dict = {}
+            for name, nodes in names_and_nodes:
+                xmlrpc_uri = xmlrpc_uris.get(name) if xmlrpc_uris is not None else None
+                node_uris = [(node, node_uri(node)) for node in nodes if node_uri(node) is not None]
+                channel_dict[name] = Channel(name, topic_types.get(name + type_topic_suffix), xmlrpc_uri, node_uris)
+            return channel_dict
+
+        action_servers = _extract_actions(subscribers, publishers)
+        action_clients = _extract_actions(publishers, subscribers)
+        service_uris = dict((name, self._lookup_service_uri(name)) for name, unused_nodes in services)
+        return SystemState(
+            publishers=channels(publishers.items()),
+            subscribers=channels(subscribers.items()),
+            # service types would need a probe of every service, left as None
+            services=channels(services, service_uris),
+            action_servers=channels(action_servers.items(), type_topic_suffix='/goal'),
+            action_clients=channels(action_clients.items(), type_topic_suffix='/goal')
+        )
+
     def _connection_cache_proxy_cb(self, system_state, added_system_state, lost_system_state):
+        if self.trace_recorder is not None:
+            self.trace_recorder.record_connections(system_state, added_system_state, lost_system_state)
+        # only serialises the producers (connection cache callbacks, refresh_connections),
+        # readers work on the immutable snapshot and the change feed without locking
+        with self.connections_lock:
+            old_connections = self.connections
+            new_connections = {}
+            # if there was no change but we got a callback,
+            # it means it s the first and we need to set the whole list
+            if added_system_state is None and lost_system_state is None:
+                new_connections = self._get_connections_from_system_state(system_state)
+                added = {}
+                removed = {}
+                for connection_type in utils.connection_types:
+                    new_connections[connection_type] = frozenset(new_connections[connection_type])
+                    added[connection_type] = new_connections[connection_type] - old_connections[connection_type]
+                    removed[connection_type] = old_connections[connection_type] - new_connections[connection_type]
+            else:  # we got some diff, we can optimize
+                added = self._get_connections_from_system_state(added_system_state)
+                lost = self._get_connections_from_system_state(lost_system_state)
+                removed = {}
+                for connection_type in utils.connection_types:
+                    new_connections[connection_type] = frozenset(
+                        (old_connections[connection_type] | added[connection_type]) - lost[connection_type])
+                    # only report what actually changed
+                    added[connection_type] -= old_connections[connection_type]
+                    removed[connection_type] = lost[connection_type] & old_connections[connection_type]
+
+            sequence = self.change_feed.publish(added, removed)
+            if sequence is not None:
+                # single reference assignment, atomic as far as readers are concerned
+                self._connection_snapshot = (sequence, new_connections)
+
+    @property
+    def connections(self):
+        '''
+          @return the current connection type keyed dictionary of utils.Connection frozensets
+          @rtype dict
+        '''
+        return self._connection_snapshot[1]
 
-        self.connections_lock.acquire()
-        # if there was no change but we got a callback,
-        # it means it s the first and we need to set the whole list
-        if added_system_state is None and lost_system_state is None:
-            self.connections[gateway_msgs.ConnectionType.ACTION_SERVER] =\
-                utils._get_connections_from_action_chan_dict(
-                        system_state.action_servers, gateway_msgs.ConnectionType.ACTION_SERVER
-                )
-            self.connections[gateway_msgs.ConnectionType.ACTION_CLIENT] =\
-                utils._get_connections_from_action_chan_dict(
-                        system_state.action_clients, gateway_msgs.ConnectionType.ACTION_CLIENT
-                )
-            self.connections[gateway_msgs.ConnectionType.PUBLISHER] =\
-                utils._get_connections_from_pub_sub_chan_dict(
-                        system_state.publishers, gateway_msgs.ConnectionType.PUBLISHER
-                )
-            self.connections[gateway_msgs.ConnectionType.SUBSCRIBER] =\
-                utils._get_connections_from_pub_sub_chan_dict(
-                        system_state.subscribers, gateway_msgs.ConnectionType.SUBSCRIBER
-                )
-            self.connections[gateway_msgs.ConnectionType.SERVICE] =\
-                utils._get_connections_from_service_chan_dict(
-                        system_state.services, gateway_msgs.ConnectionType.SERVICE
-                )
-        else:  # we got some diff, we can optimize
-            # this is not really needed as is ( since the list we get is always updated )
-            # However it is a first step towards an optimized gateway that can work with system state differences
-            new_action_servers = utils._get_connections_from_action_chan_dict(
-                added_system_state.action_servers, gateway_msgs.ConnectionType.ACTION_SERVER
-            )
-            self.connections[gateway_msgs.ConnectionType.ACTION_SERVER] |= new_action_servers
-
-            new_action_clients = utils._get_connections_from_action_chan_dict(
-                added_system_state.action_clients, gateway_msgs.ConnectionType.ACTION_CLIENT
-            )
-            self.connections[gateway_msgs.ConnectionType.ACTION_CLIENT] |= new_action_clients
-
-            new_publishers = utils._get_connections_from_pub_sub_chan_dict(
-                added_system_state.publishers, gateway_msgs.ConnectionType.PUBLISHER
-            )
-            self.connections[gateway_msgs.ConnectionType.PUBLISHER] |= new_publishers
-
-            new_subscribers = utils._get_connections_from_pub_sub_chan_dict(
-                added_system_state.subscribers, gateway_msgs.ConnectionType.SUBSCRIBER
-            )
-            self.connections[gateway_msgs.ConnectionType.SUBSCRIBER] |= new_subscribers
-
-            new_services = utils._get_connections_from_service_chan_dict(
-                added_system_state.services, gateway_msgs.ConnectionType.SERVICE
-            )
-            self.connections[gateway_msgs.ConnectionType.SERVICE] |= new_services
-
-
-            lost_action_servers = utils._get_connections_from_action_chan_dict(
-                lost_system_state.action_servers, gateway_msgs.ConnectionType.ACTION_SERVER
-            )
-            self.connections[gateway_msgs.ConnectionType.ACTION_SERVER] -= lost_action_servers
-
-            lost_action_clients = utils._get_connections_from_action_chan_dict(
-                lost_system_state.action_clients, gateway_msgs.ConnectionType.ACTION_CLIENT
-            )
-            self.connections[gateway_msgs.ConnectionType.ACTION_CLIENT] -= lost_action_clients
-
-            lost_publishers = utils._get_connections_from_pub_sub_chan_dict(
-                lost_system_state.publishers, gateway_msgs.ConnectionType.PUBLISHER
-            )
-            self.connections[gateway_msgs.ConnectionType.PUBLISHER] -= lost_publishers
-
-            lost_subscribers = utils._get_connections_from_pub_sub_chan_dict(
-                lost_system_state.subscribers, gateway_msgs.ConnectionType.SUBSCRIBER
-            )
-            self.connections[gateway_msgs.ConnectionType.SUBSCRIBER] -= lost_subscribers
-
-            lost_services = utils._get_connections_from_service_chan_dict(
-                lost_system_state.services, gateway_msgs.ConnectionType.SERVICE
-            )
-            self.connections[gateway_msgs.ConnectionType.SERVICE] -= lost_services
-
-        self.connections_lock.release()
+    def get_connection_snapshot(self):
+        '''
+          Lock free access to the current local connection state. The snapshot is
+          immutable and remains consistent no matter how long you work on it.
+
+          @return (version, connection type keyed dictionary of utils.Connection frozensets)
+          @rtype (int, dict)
+        '''
+        return self._connection_snapshot
+
+    def get_connection_changes(self, since=0):
+        '''
+          Drain the change feed of the local connection state. Consumers should
+          hang on to the returned sequence number and pass it back in next time.
+          If the resync flag is set, too many changes were missed and the
+          consumer should rebuild from get_connection_snapshot() instead.
+
+          @param since : sequence number of the last change batch processed
+          @type int
+
+          @return (sequence, [change_feed.ConnectionChange], resync)
+          @rtype (int, list, bool)
+        '''
+        return self.change_feed.drain(since)
 
     @contextmanager
     def get_connection_state(self):
-        self.connections_lock.acquire()
-        yield self.connections
-        self.connections_lock.release()
+        '''
+          Kept for backwards compatibility, this no longer locks anything - it just
+          yields the current immutable snapshot (see get_connection_snapshot).
+        '''
+        unused_version, connections = self.get_connection_snapshot()
+        yield connections
 
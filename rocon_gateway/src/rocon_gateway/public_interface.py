@@ -90,6 +90,12 @@ class PublicInterface(object):
 
         self.advertise_all_enabled = False
 
+        # bumped whenever the watchlist or blacklist changes, connections then
+        # have to be matched against the rules all over again (see update)
+        self.rules_version = 0
+        # permitted connections whose details couldn't be looked up yet (see update_changes)
+        self._unresolved = utils.create_empty_connection_type_dictionary(set)
+
         self.lock = threading.Lock()
 
         # Load up static rules.
@@ -115,6 +121,7 @@ class PublicInterface(object):
         self.lock.acquire()
         if not publicRuleExists(rule, self.watchlist[rule.type]):
             self.watchlist[rule.type].append(rule)
+            self.rules_version += 1
             result = rule
         self.lock.release()
         rospy.loginfo("Gateway : adding rule to public watchlist %s" % utils.format_rule(rule))
@@ -141,6 +148,7 @@ class PublicInterface(object):
             try:
                 self.lock.acquire()
                 self.watchlist[rule.type].remove(rule)
+                self.rules_version += 1
                 self.lock.release()
                 return [rule]
             except ValueError:
@@ -156,6 +164,8 @@ class PublicInterface(object):
                     existing_rules.append(existing_rule)
             for rule in existing_rules:
                 self.watchlist[rule.type].remove(existing_rule)  # not terribly optimal
+            if existing_rules:
+                self.rules_version += 1
             self.lock.release()
             return existing_rules
 
@@ -194,6 +204,7 @@ class PublicInterface(object):
             if not publicRuleExists(rule, self.blacklist[rule.type]):
                 self.blacklist[rule.type].append(rule)
 
+        self.rules_version += 1
         self.lock.release()
         return True
 
@@ -211,6 +222,7 @@ class PublicInterface(object):
         # easy hack for resetting the watchlist and blacklist
         self.watchlist = utils.create_empty_connection_type_dictionary()
         self.blacklist = self._default_blacklist
+        self.rules_version += 1
 
         self.lock.release()
 
@@ -366,6 +378,58 @@ class PublicInterface(object):
                     permitted_connections[connection_type])]
             self.public[connection_type][:] = [
                 x for x in self.public[connection_type] if not x.inConnectionList(removed_public[connection_type])]
+            self._unresolved[connection_type].clear()
         self.lock.release()
         #rospy.loginfo("PUBLIC IF : Removed connections: {0}".format(removed_public))
         return new_public, removed_public
+
+    def update_changes(self, added, removed, generate_advertisement_connection_details):
+        '''
+          Incremental version of update, for when only the local connections
+          changed (the rules didn't, see rules_version) - only the added and
+          removed connections are matched against the rules.
+
+          @param added : connections that appeared since the last update
+          @type dict of utils.Connection sets, keyed by connection type
+          @param removed : connections that disappeared since the last update
+          @type dict of utils.Connection sets, keyed by connection type
+
+          @param generate_advertisement_connection_details : function from LocalMaster
+          that generates Connection.type_info and Connection.xmlrpc_uri
+          @type method (see LocalMaster.generate_advertisement_connection_details)
+
+          @return: new public connections, as well as connections to be removed
+          @rtype: utils.Connection[], utils.Connection[]
+        '''
+        new_public = utils.create_empty_connection_type_dictionary()
+        removed_public = utils.create_empty_connection_type_dictionary()
+        for connection_type in utils.connection_types:
+            # removals first, a node coming back with new details shows up in both
+            if removed[connection_type]:
+                self.lock.acquire()
+                self._unresolved[connection_type] -= removed[connection_type]
+                removed_keys = set(connection.key for connection in removed[connection_type])
+                removed_public[connection_type] = [x for x in self.public[connection_type]
+                                                   if x.key in removed_keys]
+                self.public[connection_type][:] = [x for x in self.public[connection_type]
+                                                   if x.key not in removed_keys]
+                self.lock.release()
+            candidates = [connection for connection in added[connection_type] if self._allowRule(connection.rule)]
+            self.lock.acquire()
+            candidates.extend(self._unresolved[connection_type])
+            self._unresolved[connection_type] = set()
+            public_keys = set(x.key for x in self.public[connection_type])
+            for connection in candidates:
+                if connection.key in public_keys:
+                    continue
+                new_connection = generate_advertisement_connection_details(
+                    connection.rule.type, connection.rule.name, connection.rule.node)
+                if new_connection is None:
+                    # vanished from the master in between, or not quite there yet - retry next time
+                    self._unresolved[connection_type].add(connection)
+                    continue
+                public_keys.add(connection.key)
+                new_public[connection_type].append(new_connection)
+                self.public[connection_type].append(new_connection)
+            self.lock.release()
+        return new_public, removed_public
@@ -8,9 +8,9 @@
 # Imports
 ##############################################################################
 
-import copy
 import re
 import rocon_gateway_utils
+import gateway_msgs.msg as gateway_msgs
 
 from . import utils
 from . import interactive_interface
@@ -81,7 +81,7 @@ class PulledInterface(interactive_interface.InteractiveInterface):
         for connection_type in utils.connection_types:
             new_pulls[connection_type] = utils.difflist(pulled[connection_type], self.pulled[connection_type])
             removed_pulls[connection_type] = utils.difflist(self.pulled[connection_type], pulled[connection_type])
-        self.pulled = copy.deepcopy(pulled)
+        self.pulled = pulled
         self._lock.release()
         return new_pulls, removed_pulls
 
@@ -157,10 +157,8 @@ class PulledInterface(interactive_interface.InteractiveInterface):
                 matched = self.is_matched(rule, rule_name, name, node)
 
             if matched:
-                matched_pull = copy.deepcopy(rule)
-                matched_pull.gateway = gateway  # just in case we used a regex or matched basename
-                matched_pull.rule.name = name   # just in case we used a regex
-                matched_pull.rule.node = node   # just in case we used a regex
+                # gateway, name and node just in case we used a regex or matched basename
+                matched_pull = gateway_msgs.RemoteRule(gateway, gateway_msgs.Rule(rule.rule.type, name, node))
                 matched_pull_rules.append(matched_pull)
         return matched_pull_rules
 
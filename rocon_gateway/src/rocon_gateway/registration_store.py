@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import collections
+import threading
+
+from . import utils
+
+##############################################################################
+# Registration Store
+##############################################################################
+
+
+class RegistrationStore(object):
+
+    '''
+      Container for the registrations (flip-ins or pulls) made with the local
+      master. Indexed by remote details (remote gateway, type, name, node)
+      and by the anonymous local node name so lookups don't have to trawl
+      through every registration.
+
+      For compatibility, store[connection_type] still returns the list of
+      registrations of that type (a copy - use add()/remove() to modify).
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # connection type : { remote key : utils.Registration }, in insertion order
+        self._by_type = {}
+        for connection_type in utils.connection_types:
+            self._by_type[connection_type] = collections.OrderedDict()
+        self._by_local_node = {}
+
+    @staticmethod
+    def key(remote_gateway, connection_type, name, node):
+        return (remote_gateway, connection_type, name, node)
+
+    @staticmethod
+    def _registration_key(registration):
+        return (registration.remote_gateway,) + registration.connection.key
+
+    def add(self, registration):
+        '''
+          Add a registration, unless one with the same remote details is already
+          stored. That one is left alone - it is still registered with the local
+          master and losing track of it would leave it there for good.
+
+          @param registration : the (registered) registration
+          @type utils.Registration
+
+          @return False if there already was a registration with these remote details
+          @rtype bool
+        '''
+        key = RegistrationStore._registration_key(registration)
+        with self._lock:
+            registrations = self._by_type[registration.connection.rule.type]
+            if key in registrations:
+                return False
+            registrations[key] = registration
+            if registration.local_node is not None:
+                self._by_local_node[registration.local_node] = registration
+            return True
+
+    def remove(self, registration):
+        '''
+          @param registration : the registration to remove
+          @type utils.Registration
+
+          @raise ValueError if the registration is not stored (as list.remove would)
+        '''
+        key = RegistrationStore._registration_key(registration)
+        with self._lock:
+            registrations = self._by_type[registration.connection.rule.type]
+            if registrations.get(key) != registration:
+                raise ValueError("registration is not in the store [%s]" % registration)
+            del registrations[key]
+            if registration.local_node is not None:
+                self._by_local_node.pop(registration.local_node, None)
+
+    def find(self, remote_gateway, connection_type, name, node):
+        '''
+          @return the registration matching the remote details or None
+          @rtype utils.Registration
+        '''
+        with self._lock:
+            key = RegistrationStore.key(remote_gateway, connection_type, name, node)
+            return self._by_type[connection_type].get(key)
+
+    def find_by_local_node(self, local_node):
+        '''
+          @return the registration made under the specified anonymous local node name or None
+          @rtype utils.Registration
+        '''
+        with self._lock:
+            return self._by_local_node.get(local_node)
+
+    def values(self):
+        '''
+          @return all registrations, of all connection types
+          @rtype [utils.Registration]
+        '''
+        with self._lock:
+            return [registration for registrations in self._by_type.values() for registration in registrations.values()]
+
+    def __getitem__(self, connection_type):
+        with self._lock:
+            return list(self._by_type[connection_type].values())
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(registrations) for registrations in self._by_type.values())
+
+    def keys(self):
+        return self._by_type.keys()
@@ -82,6 +82,16 @@ def setup_ros_parameters():
     # Network interface name (to be used when there are multiple active interfaces))
     param['network_interface'] = rospy.get_param('~network_interface', '')  # string
 
+    # Record a trace of everything driving the gateway to this file (see trace.py), for replaying offline
+    param['trace_file'] = rospy.get_param('~trace_file', '')  # string
+
+    # How entries are written on the hub - 'pickle' (every gateway can read it) or 'wire_format'
+    # (compact, but only readable by gateways that know it). Both are always read.
+    param['hub_serialization_format'] = rospy.get_param('~hub_serialization_format', 'pickle')  # string
+
+    # Time between samples of the profiler behind the ~start_profiling/~stop_profiling services (sec)
+    param['profiling_interval'] = rospy.get_param('~profiling_interval', 0.01)  # float
+
     return param
 
 
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import cPickle as pickle
+import functools
+import gzip
+import threading
+import time
+import weakref
+
+from rocon_hub_client.memory_backend import MemoryServer
+
+from .master_api import Channel, SystemState
+
+##############################################################################
+# Traces
+##############################################################################
+#
+# A trace is a time stamped record of everything that drives a gateway, so
+# a misbehaving gateway can be reproduced offline (see
+# rocon_gateway_tests/scripts/replay_trace.py). It is a gzipped stream of
+# pickled records, the first being the header:
+#
+#   ('rocon_gateway_trace', TRACE_VERSION, unique_name, param, start time)
+#
+# and then (seconds since the start, kind, payload) with kinds
+#
+#   'connections'   : (system_state, added_system_state, lost_system_state), the
+#                     connection cache callback arguments (master_api.SystemState)
+#   'service'       : (service name, request), e.g. ('flip', RemoteRequest)
+#   'spin'          : (), the start of a Gateway.spin_once() iteration
+#   'hub'           : (hub uri, [(command, args, kwargs)], [results]), a round trip to a hub,
+#                     results are None if it failed
+#   'flip_requests' : (hub uri, [(utils.Registration, status)]), the unblocked flip
+#                     requests read from a hub, already decrypted so the gateway's
+#                     private key never goes in the trace
+#
+# Traces are pickles, only replay those you recorded yourself.
+
+TRACE_MAGIC = 'rocon_gateway_trace'
+TRACE_VERSION = 2  # 1 recorded the private keys instead of the flip requests
+
+
+def _copy_system_state(system_state):
+    '''
+      The connection cache proxy's system state in plain master_api types,
+      so traces don't depend on the proxy's classes.
+    '''
+    if system_state is None:
+        return None
+
+    def channels(channel_dict):
+        return dict((name, Channel(channel.name, channel.type, channel.xmlrpc_uri,
+                                   [tuple(node) for node in channel.nodes]))
+                    for name, channel in channel_dict.items())
+    return SystemState(publishers=channels(system_state.publishers),
+                       subscribers=channels(system_state.subscribers),
+                       services=channels(system_state.services),
+                       action_servers=channels(system_state.action_servers),
+                       action_clients=channels(system_state.action_clients))
+
+
+class TraceRecorder(object):
+
+    '''
+      Records a trace to file. Safe to call from any thread.
+    '''
+
+    def __init__(self, path, unique_name, param, clock=time.time):
+        '''
+          @param path : file to write the trace to (overwritten)
+          @type str
+          @param unique_name : name of the gateway being traced
+          @type str
+          @param param : the gateway's parameters (ros_parameters.setup_ros_parameters())
+          @type dict
+        '''
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'wb')
+        self._start_time = clock()
+        pickle.dump((TRACE_MAGIC, TRACE_VERSION, unique_name, param, self._start_time), self._file,
+                    pickle.HIGHEST_PROTOCOL)
+
+    def record(self, kind, *payload):
+        with self._lock:
+            if self._file is None:
+                return  # closed
+            pickle.dump((self._clock() - self._start_time, kind, payload), self._file, pickle.HIGHEST_PROTOCOL)
+
+    def record_connections(self, system_state, added_system_state, lost_system_state):
+        self.record('connections', _copy_system_state(system_state),
+                    _copy_system_state(added_system_state), _copy_system_state(lost_system_state))
+
+    def record_spin(self):
+        self.record('spin')
+
+    def record_hub(self, uri, commands, results):
+        self.record('hub', uri, commands, results)
+
+    def record_flip_requests(self, uri, registrations):
+        self.record('flip_requests', uri, registrations)
+
+    def wrap_service(self, name, handler):
+        '''
+          @return the service handler, recording its requests
+          @rtype func
+        '''
+        @functools.wraps(handler)
+        def traced_handler(request):
+            self.record('service', name, request)
+            return handler(request)
+        return traced_handler
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class TraceReader(object):
+
+    '''
+      Iterates over the (time, kind, payload) records of a trace file.
+    '''
+
+    def __init__(self, path):
+        '''
+          @raise ValueError if it isn't a trace this version can read
+        '''
+        self.path = path
+        self._file = gzip.open(path, 'rb')
+        try:
+            header = pickle.load(self._file)
+        except (EOFError, IOError, pickle.UnpicklingError) as e:
+            raise ValueError("not a gateway trace [%s][%s]" % (path, e))
+        if not isinstance(header, tuple) or len(header) != 5 or header[0] != TRACE_MAGIC:
+            raise ValueError("not a gateway trace [%s]" % path)
+        if header[1] != TRACE_VERSION:
+            raise ValueError("unsupported gateway trace version [%s][%s]" % (path, header[1]))
+        (unused_magic, unused_version, self.unique_name, self.param, self.start_time) = header
+
+    def __iter__(self):
+        while True:
+            try:
+                yield pickle.load(self._file)
+            except EOFError:
+                return
+            except IOError:
+                return  # truncated, e.g. the gateway was killed while recording
+
+    def close(self):
+        self._file.close()
+
+##############################################################################
+# Hub Backend
+##############################################################################
+
+
+class TracingBackend(object):
+
+    '''
+      Wraps a hub backend (see rocon_hub_client.set_backend), recording every
+      command and pipeline sent to the hubs, with the replies.
+    '''
+
+    def __init__(self, backend, recorder):
+        '''
+          @param backend : the backend to trace
+          @type rocon_hub_client.RedisBackend or compatible
+          @param recorder : where to record the round trips
+          @type TraceRecorder
+        '''
+        self._backend = backend
+        self._recorder = recorder
+        self._pool_uris = weakref.WeakKeyDictionary()
+
+    def create_connection_pool(self, ip, port, socket_timeout=5.0):
+        connection_pool = self._backend.create_connection_pool(ip, port, socket_timeout)
+        self._pool_uris[connection_pool] = str(ip) + ':' + str(port)
+        return connection_pool
+
+    def create_client(self, connection_pool):
+        return _TracedRedis(self._backend.create_client(connection_pool),
+                            self._recorder, self._pool_uris.get(connection_pool))
+
+
+class _TracedRedis(object):
+
+    def __init__(self, client, recorder, uri):
+        self._client = client
+        self._recorder = recorder
+        self._uri = uri
+
+    def pipeline(self, *args, **kwargs):
+        return _TracedPipeline(self._client.pipeline(*args, **kwargs), self._recorder, self._uri)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in MemoryServer.commands:
+            return attribute
+
+        def command(*args, **kwargs):
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception:
+                self._recorder.record_hub(self._uri, [(name, args, kwargs)], None)
+                raise
+            self._recorder.record_hub(self._uri, [(name, args, kwargs)], [result])
+            return result
+        return command
+
+
+class _TracedPipeline(object):
+
+    def __init__(self, pipeline, recorder, uri):
+        self._pipeline = pipeline
+        self._recorder = recorder
+        self._uri = uri
+        self._commands = []
+
+    def execute(self, *args, **kwargs):
+        (commands, self._commands) = (self._commands, [])
+        try:
+            results = self._pipeline.execute(*args, **kwargs)
+        except Exception:
+            self._recorder.record_hub(self._uri, commands, None)
+            raise
+        self._recorder.record_hub(self._uri, commands, results)
+        return results
+
+    def reset(self):
+        self._commands = []
+        self._pipeline.reset()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._pipeline, name)
+        if name not in MemoryServer.commands:
+            return attribute
+
+        def command(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            attribute(*args, **kwargs)
+            return self
+        return command
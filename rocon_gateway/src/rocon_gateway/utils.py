@@ -7,7 +7,6 @@
 # Imports
 ##############################################################################
 
-import copy
 import cPickle as pickle
 import os
 import re
@@ -19,6 +18,8 @@ import Crypto.Util.number as CUN
 
 import gateway_msgs.msg as gateway_msgs
 
+from . import wire_format
+
 ##############################################################################
 # Constants
 ##############################################################################
@@ -36,7 +37,36 @@ action_types = ['/goal', '/cancel', '/status', '/feedback', '/result']
 ##############################################################################
 
 
-class Connection():
+def _intern(value):
+    '''
+      Intern names so the many connections/registrations referring to the same
+      topics, nodes and types share a single string. Anything that can't be
+      interned (None, unicode) is passed through untouched.
+    '''
+    try:
+        return intern(value)
+    except TypeError:
+        return value
+
+
+def split_node_uri(node):
+    '''
+      Flip rules carry their node as a combined "node_name,xmlrpc_uri" string.
+      Split it into its parts.
+
+      @param node : node name, possibly with the xmlrpc uri appended
+      @type str
+
+      @return (node name, xmlrpc uri or None if not present)
+      @rtype (str, str)
+    '''
+    if node is None:
+        return None, None
+    node_name, separator, xmlrpc_uri = node.partition(',')
+    return node_name, (xmlrpc_uri if separator else None)
+
+
+class Connection(object):
 
     '''
       An object that represents a connection containing all the gory details
@@ -46,7 +76,14 @@ class Connection():
        - rule (gateway_msgs.msg.Rule) (containing type,name,node)
        - type_info              (msg type for pubsub or service api for services)
        - xmlrpc_uri             (the xmlrpc node uri for the connection)
+
+      Connections are immutable values (hashable, safe to share between
+      threads and containers without copying). Use replace() to derive a
+      modified connection. The rule is a plain message and could technically
+      be modified, but never do that - equality and hashing use the
+      (type, name, node) key captured at construction.
     '''
+    __slots__ = ['rule', 'type_msg', 'type_info', 'xmlrpc_uri', 'key', '_values', '_hash']
 
     def __init__(self, rule, type_msg, type_info, xmlrpc_uri):
         """
@@ -54,14 +91,56 @@ class Connection():
         @param type_info : either topic_type (pubsub), service api (service) or ??? (action)
         @type string
         """
-        self.rule = rule
-        self.type_msg = type_msg
-        self.type_info = type_info
-        self.xmlrpc_uri = xmlrpc_uri
+        rule.type = _intern(rule.type)
+        rule.name = _intern(rule.name)
+        rule.node = _intern(rule.node)
+        type_msg = _intern(type_msg)
+        type_info = _intern(type_info)
+        xmlrpc_uri = _intern(xmlrpc_uri)
+        key = (rule.type, rule.name, rule.node)
+        values = (key, type_msg, type_info, xmlrpc_uri)
+        _set = object.__setattr__
+        _set(self, 'rule', rule)
+        _set(self, 'type_msg', type_msg)
+        _set(self, 'type_info', type_info)
+        _set(self, 'xmlrpc_uri', xmlrpc_uri)
+        _set(self, 'key', key)
+        _set(self, '_values', values)
+        _set(self, '_hash', hash(values))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("connections are immutable, use replace() instead [%s]" % name)
+
+    def __delattr__(self, name):
+        raise AttributeError("connections are immutable [%s]" % name)
+
+    def __reduce__(self):
+        return (Connection, (gateway_msgs.Rule(*self.key), self.type_msg, self.type_info, self.xmlrpc_uri))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def replace(self, type_msg=None, type_info=None, xmlrpc_uri=None):
+        '''
+          Derive a new connection with the same rule, but some of the details
+          replaced (e.g. encrypted).
+
+          @return the new connection
+          @rtype utils.Connection
+        '''
+        return Connection(gateway_msgs.Rule(*self.key),
+                          self.type_msg if type_msg is None else type_msg,
+                          self.type_info if type_info is None else type_info,
+                          self.xmlrpc_uri if xmlrpc_uri is None else xmlrpc_uri)
 
     def __eq__(self, other):
-        if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
+        if self is other:
+            return True
+        if isinstance(other, Connection):
+            return self._hash == other._hash and self._values == other._values
         else:
             return False
 
@@ -69,7 +148,7 @@ class Connection():
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash(((self.rule.type, self.rule.name, self.rule.node), self.type_msg, self.type_info, self.xmlrpc_uri))
+        return self._hash
 
     def __str__(self):
         if self.rule.type == gateway_msgs.ConnectionType.SERVICE:
@@ -106,16 +185,14 @@ class Connection():
           @return true if equivalent, false otherwise
           @rtype Bool
         '''
-        return (self.rule.name == connection.rule.name and
-                self.rule.type == connection.rule.type and
-                self.rule.node == connection.rule.node)
+        return self.key == connection.key
 
 ##############################################################################
 # Registration
 ##############################################################################
 
 
-class Registration():
+class Registration(object):
 
     '''
       An object that represents a connection registered with the local
@@ -126,7 +203,10 @@ class Registration():
        - connection             (the remote connection information)
        - remote_gateway         (the remote gateway from where this connection originated)
        - local_node             (the local anonymously generated node name)
+
+      Like connections, registrations are immutable values.
     '''
+    __slots__ = ['connection', 'remote_gateway', 'local_node', '_hash']
 
     def __init__(self, connection, remote_gateway, local_node=None):
         '''
@@ -139,19 +219,53 @@ class Registration():
           @param local_node : the local node that this registration is created under
           @type string
         '''
-        self.connection = connection
-        self.remote_gateway = remote_gateway
-        self.local_node = local_node
+        remote_gateway = _intern(remote_gateway)
+        local_node = _intern(local_node)
+        _set = object.__setattr__
+        _set(self, 'connection', connection)
+        _set(self, 'remote_gateway', remote_gateway)
+        _set(self, 'local_node', local_node)
+        _set(self, '_hash', hash((connection, remote_gateway, local_node)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("registrations are immutable [%s]" % name)
+
+    def __delattr__(self, name):
+        raise AttributeError("registrations are immutable [%s]" % name)
+
+    def __reduce__(self):
+        return (Registration, (self.connection, self.remote_gateway, self.local_node))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def with_local_node(self, local_node):
+        '''
+          @return a copy of this registration under the specified local node name
+          @rtype utils.Registration
+        '''
+        return Registration(self.connection, self.remote_gateway, local_node)
 
     def __eq__(self, other):
-        if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
+        if self is other:
+            return True
+        if isinstance(other, Registration):
+            return (self._hash == other._hash and
+                    self.connection == other.connection and
+                    self.remote_gateway == other.remote_gateway and
+                    self.local_node == other.local_node)
         else:
             return False
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return self._hash
+
     def __str__(self):
         return '[%s]%s' % (self.remote_gateway, format_rule(self.connection.rule))
 
@@ -178,16 +292,50 @@ class Registration():
 #         return data
 #
 
-def serialize(data):
+# Gateways before the wire format can only read pickles, keep writing those
+# until every gateway on the hubs understands the wire format.
+PICKLE = 'pickle'
+WIRE_FORMAT = 'wire_format'
+_serialization_format = PICKLE
+
+
+def set_serialization_format(serialization_format):
+    '''
+      Choose how entries posted on the hub are written. Both are always read.
+
+      @param serialization_format : PICKLE (readable by any gateway) or WIRE_FORMAT
+      @type str
+
+      @raise ValueError for an unknown format
+    '''
+    global _serialization_format
+    if serialization_format not in (PICKLE, WIRE_FORMAT):
+        raise ValueError("unknown hub serialization format [%s]" % serialization_format)
+    _serialization_format = serialization_format
+
+
+def serialize(data, schema=wire_format.GENERIC):
     # return json.dumps(data)
-    return pickle.dumps(data)
+    if _serialization_format == PICKLE:
+        return pickle.dumps(data)
+    return wire_format.encode(schema, data)
 
 
 def deserialize(str_msg):
+    '''
+      Decode an entry from the hub, either in the wire format or pickled by an older gateway.
+
+      @return the list of fields
+      @rtype list
+    '''
     # return convert(json.loads(str_msg))
+    deserialized_data = None
     try:
-        deserialized_data = pickle.loads(str_msg)
-    except ValueError as e:
+        if wire_format.is_encoded(str_msg):
+            unused_schema, deserialized_data = wire_format.decode(str_msg)
+        else:
+            deserialized_data = wire_format.decode_legacy(str_msg)
+    except (ValueError, pickle.UnpicklingError) as e:
         rospy.logwarn("Gateway : error in deserialization [%s]" % e)
         import traceback
         print(traceback.format_exc())
@@ -195,14 +343,14 @@ def deserialize(str_msg):
     return deserialized_data
 
 
-# TODO :pickle API support directly in Connection object instead of here to make it more visible.
 def serialize_connection(connection):
     return serialize([connection.rule.type,
                       connection.rule.name,
                       connection.rule.node,
                       connection.type_msg,
                       connection.type_info,
-                      connection.xmlrpc_uri]
+                      connection.xmlrpc_uri],
+                     wire_format.CONNECTION
                      )
 
 
@@ -222,12 +370,17 @@ def serialize_connection_request(command, source, connection):
                       connection.rule.node,
                       connection.type_msg,
                       connection.type_info,
-                      connection.xmlrpc_uri]
+                      connection.xmlrpc_uri],
+                     wire_format.CONNECTION_REQUEST
                      )
 
 
+def serialize_details(gateway, name, connection_type, node):
+    return serialize([gateway, name, connection_type, node], wire_format.DETAILS)
+
+
 def serialize_rule_request(command, source, rule):
-    return serialize([command, source, rule.type, rule.name, rule.node])
+    return serialize([command, source, rule.type, rule.name, rule.node], wire_format.RULE_REQUEST)
 
 
 def deserialize_request(request_str):
@@ -280,17 +433,13 @@ def decrypt(ciphertext, key):
 
 
 def decrypt_connection(connection, key):
-    decrypted_connection = copy.deepcopy(connection)
-    decrypted_connection.type_info = decrypt(connection.type_info, key)
-    decrypted_connection.xmlrpc_uri = decrypt(connection.xmlrpc_uri, key)
-    return decrypted_connection
+    return connection.replace(type_info=decrypt(connection.type_info, key),
+                              xmlrpc_uri=decrypt(connection.xmlrpc_uri, key))
 
 
 def encrypt_connection(connection, key):
-    encrypted_connection = copy.deepcopy(connection)
-    encrypted_connection.type_info = encrypt(connection.type_info, key)
-    encrypted_connection.xmlrpc_uri = encrypt(connection.xmlrpc_uri, key)
-    return encrypted_connection
+    return connection.replace(type_info=encrypt(connection.type_info, key),
+                              xmlrpc_uri=encrypt(connection.xmlrpc_uri, key))
 
 ##########################################################################
 # Regex
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import cPickle as pickle
+import cStringIO
+import struct
+
+##############################################################################
+# Format
+##############################################################################
+#
+# Entries posted on the hub (advertisements, flip/pull details, flip requests)
+# are flat lists of strings. On the wire:
+#
+#   magic (1) | version (1) | schema (1) | field count (1) | field end offsets (2 each) | field data...
+#
+# Offsets are little endian unsigned shorts from the start of the entry, with
+# the top bit flagging a None field. Unicode is sent as utf-8. The header
+# (everything up to the field data) fixes the layout of the entry. The
+# first read of an entry unpacks the offsets and slices, from the second
+# read on the decoder has compiled the layout into a struct and it is a
+# single (C) unpack - the gateway reads the same entries off the hub
+# every loop. The magic byte is not a pickle opcode, so entries
+# in the old (pickled) format can still be told apart and read.
+#
+# Gateways older than this format can't read it, so it is only written
+# once the hub serialization format is switched over (see utils.serialize).
+
+MAGIC = '\xc0'
+VERSION = 1
+MAX_ENTRY_LENGTH = 0x7fff
+MAX_FIELDS = 0xff
+
+# schema id : number of fields (None for any)
+GENERIC = 0
+CONNECTION = 1  # type, name, node, type_msg, type_info, xmlrpc_uri
+CONNECTION_REQUEST = 2  # command, source, type, name, node, type_msg, type_info, xmlrpc_uri
+RULE_REQUEST = 3  # command, source, type, name, node
+DETAILS = 4  # gateway, name, type, node
+
+_field_counts = {
+    GENERIC: None,
+    CONNECTION: 6,
+    CONNECTION_REQUEST: 8,
+    RULE_REQUEST: 5,
+    DETAILS: 4,
+}
+
+_NONE = 0x8000
+_OFFSET_MASK = 0x7fff
+_HEADER_LENGTH = 4
+_prefix = MAGIC + chr(VERSION)
+_headers = [_prefix + chr(schema) for schema in range(len(_field_counts))]
+_offset_tables = [struct.Struct('<%dH' % field_count) for field_count in range(MAX_FIELDS + 1)]
+# header : (schema, struct unpacking the fields, indices of the None fields)
+_layouts = {}
+_seen_headers = set()  # headers read once, compiled on the next read
+_MAX_LAYOUTS = 4096
+
+##############################################################################
+# Encoding
+##############################################################################
+
+
+def encode(schema, fields):
+    '''
+      @param schema : one of the schema ids above
+      @type int
+      @param fields : the fields (str, unicode or None)
+      @type list
+
+      @return the encoded entry
+      @rtype str
+
+      @raise ValueError, TypeError if the fields don't fit the schema
+    '''
+    field_count = _field_counts[schema]
+    if field_count is not None and len(fields) != field_count:
+        raise ValueError("wrong number of fields for schema %s [%s != %s]" % (schema, len(fields), field_count))
+    if len(fields) > MAX_FIELDS:
+        raise ValueError("too many fields [%s]" % len(fields))
+    offset_table = _offset_tables[len(fields)]
+    offset = _HEADER_LENGTH + offset_table.size
+    offsets = []
+    data = []
+    for field in fields:
+        if field is None:
+            offsets.append(offset | _NONE)
+            continue
+        if isinstance(field, unicode):
+            field = field.encode('utf-8')
+        elif not isinstance(field, str):
+            raise TypeError("can only encode strings and None [%s]" % type(field))
+        offset += len(field)
+        if offset > MAX_ENTRY_LENGTH:
+            raise ValueError("entry too long [%s bytes]" % offset)
+        offsets.append(offset)
+        data.append(field)
+    return _headers[schema] + chr(len(fields)) + offset_table.pack(*offsets) + ''.join(data)
+
+##############################################################################
+# Decoding
+##############################################################################
+
+
+def is_encoded(data):
+    '''
+      @return True if the entry is in this format (as opposed to a legacy pickle)
+      @rtype bool
+    '''
+    return data[:1] == MAGIC
+
+
+def decode(data):
+    '''
+      @param data : an encoded entry
+      @type str
+
+      @return schema id and the list of fields
+      @rtype (int, list)
+
+      @raise ValueError if the entry is corrupt or from an unknown version
+    '''
+    try:
+        (schema, fields_struct, none_indices) = _layouts[data[:_HEADER_LENGTH + 2 * ord(data[3])]]
+    except (KeyError, IndexError):
+        return _decode_uncompiled(data)
+    try:
+        fields = list(fields_struct.unpack(data))
+    except struct.error:
+        raise ValueError("wire format entry length mismatch [%s]" % len(data))
+    for index in none_indices:
+        fields[index] = None
+    return schema, fields
+
+
+def _decode_uncompiled(data):
+    '''
+      Decode by slicing. Compiling a layout costs more than it saves for a
+      single read, so that waits until the header turns up a second time.
+    '''
+    prefix = data[:2]
+    if prefix != _prefix:
+        if prefix[:1] == MAGIC and len(prefix) == 2:
+            raise ValueError("unsupported wire format version [%s]" % ord(prefix[1]))
+        raise ValueError("not a wire format entry")
+    length = len(data)
+    if length < _HEADER_LENGTH:
+        raise ValueError("truncated wire format entry")
+    (schema, field_count) = (ord(data[2]), ord(data[3]))
+    if _field_counts.get(schema, field_count) not in (None, field_count):
+        raise ValueError("wrong number of fields for schema %s [%s]" % (schema, field_count))
+    offset_table = _offset_tables[field_count]
+    start = _HEADER_LENGTH + offset_table.size
+    if start > length:
+        raise ValueError("truncated wire format entry")
+    ends = offset_table.unpack_from(data, _HEADER_LENGTH)
+    if (ends[-1] & _OFFSET_MASK if ends else start) != length:
+        raise ValueError("wire format entry length mismatch [%s]" % length)
+    starts = (start,) + ends[:-1]
+    fields = [None if end & _NONE else data[begin & _OFFSET_MASK:end] for begin, end in zip(starts, ends)]
+    header = data[:start]
+    if header in _seen_headers:
+        _compile_layout(header, schema, start, starts, ends)
+    else:
+        if len(_seen_headers) >= _MAX_LAYOUTS:
+            _seen_headers.clear()
+        _seen_headers.add(header)
+    return schema, fields
+
+
+def _compile_layout(header, schema, start, starts, ends):
+    lengths = []
+    for begin, end in zip(starts, ends):
+        if (end & _OFFSET_MASK) < (begin & _OFFSET_MASK):
+            return  # fields out of order, leave this one to the slicing
+        lengths.append((end & _OFFSET_MASK) - (begin & _OFFSET_MASK))
+    if len(_layouts) >= _MAX_LAYOUTS:
+        _layouts.clear()
+    _layouts[header] = (schema,
+                        struct.Struct('<%dx' % start + ''.join('%ds' % length for length in lengths)),
+                        tuple(index for index, end in enumerate(ends) if end & _NONE))
+
+##############################################################################
+# Compatibility
+##############################################################################
+
+
+def decode_legacy(data):
+    '''
+      Read an entry pickled by an older gateway. Class lookups are disabled,
+      so only plain data (the lists of strings we used to post) can be loaded,
+      not arbitrary objects.
+
+      @return the unpickled data
+      @rtype list
+
+      @raise pickle.UnpicklingError for anything but plain data
+    '''
+    unpickler = pickle.Unpickler(cStringIO.StringIO(data))
+    unpickler.find_global = None
+    return unpickler.load()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import socket
+import threading
+import time
+
+try:
+    import xmlrpc.client as xmlrpclib  # Python 3.x
+except ImportError:
+    import xmlrpclib
+
+import rosgraph
+
+##############################################################################
+# Transport
+##############################################################################
+
+
+class KeepAliveTransport(xmlrpclib.Transport):
+
+    '''
+      HTTP/1.1 transport that holds on to its connection between requests
+      (the stock transport already does this, we only add a socket timeout so
+      that a wedged master can't hang the gateway forever).
+    '''
+
+    def __init__(self, timeout=None):
+        xmlrpclib.Transport.__init__(self)
+        self._timeout = timeout
+
+    def make_connection(self, host):
+        connection = xmlrpclib.Transport.make_connection(self, host)
+        if self._timeout is not None:
+            connection.timeout = self._timeout
+        return connection
+
+##############################################################################
+# Pool
+##############################################################################
+
+
+class XmlrpcConnectionPool(object):
+
+    '''
+      A small thread safe pool of keep-alive xmlrpc clients to a single
+      server (usually the ros master). Each client owns one persistent
+      http connection and is only ever used by one thread at a time.
+
+      Also keeps per-method call statistics so we can see what the
+      gateway is costing the master.
+    '''
+
+    def __init__(self, uri, max_idle=4, timeout=None):
+        '''
+          @param uri : xmlrpc server uri (e.g. http://localhost:11311)
+          @type str
+          @param max_idle : maximum number of idle connections to hold on to
+          @type int
+          @param timeout : socket timeout for each connection (None for blocking)
+          @type float
+        '''
+        self.uri = uri
+        self._max_idle = max_idle
+        self._timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        # method name : [calls, errors, total time, max time]
+        self._statistics = {}
+
+    def proxy(self):
+        '''
+          @return an object that looks like a ServerProxy, but checks out a
+                  pooled connection for every call.
+          @rtype PooledServerProxy
+        '''
+        return PooledServerProxy(self)
+
+    def call(self, method_name, *args):
+        client = self._acquire()
+        start_time = time.time()
+        try:
+            result = getattr(client[1], method_name)(*args)
+        except (socket.error, xmlrpclib.ProtocolError):
+            # connection is in an unknown state, don't hand it out again
+            client[0].close()
+            self._record(method_name, time.time() - start_time, error=True)
+            raise
+        except Exception:
+            self._release(client)
+            self._record(method_name, time.time() - start_time, error=True)
+            raise
+        self._release(client)
+        self._record(method_name, time.time() - start_time)
+        return result
+
+    def statistics(self):
+        '''
+          Per-method latency counters.
+
+          @return method name keyed dictionary of (calls, errors, avg time, max time)
+          @rtype dict
+        '''
+        statistics = {}
+        with self._lock:
+            for method_name, (calls, errors, total_time, max_time) in self._statistics.items():
+                statistics[method_name] = (calls, errors, total_time / calls, max_time)
+        return statistics
+
+    def reset_statistics(self):
+        with self._lock:
+            self._statistics = {}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for transport, unused_server_proxy in idle:
+            transport.close()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        transport = KeepAliveTransport(self._timeout)
+        return (transport, xmlrpclib.ServerProxy(self.uri, transport=transport))
+
+    def _release(self, client):
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append(client)
+                return
+        client[0].close()
+
+    def _record(self, method_name, elapsed_time, error=False):
+        with self._lock:
+            try:
+                entry = self._statistics[method_name]
+            except KeyError:
+                entry = self._statistics[method_name] = [0, 0, 0.0, 0.0]
+            entry[0] += 1
+            if error:
+                entry[1] += 1
+            entry[2] += elapsed_time
+            if elapsed_time > entry[3]:
+                entry[3] = elapsed_time
+
+
+class PooledServerProxy(object):
+
+    '''
+      Stand in for xmlrpclib.ServerProxy that routes calls through a pool.
+    '''
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __getattr__(self, method_name):
+        if method_name.startswith('__'):
+            raise AttributeError(method_name)
+        pool = self._pool
+        return lambda *args: pool.call(method_name, *args)
+
+##############################################################################
+# Master
+##############################################################################
+
+
+class PooledMaster(rosgraph.Master):
+
+    '''
+      A rosgraph.Master handle for an arbitrary caller id whose calls go
+      over the pooled connections rather than a brand new http connection.
+    '''
+
+    def __init__(self, caller_id, pool):
+        rosgraph.Master.__init__(self, caller_id, master_uri=pool.uri)
+        self.handle = pool.proxy()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import argparse
+import collections
+import gc
+import sys
+import time
+
+import rocon_console.console as console
+from gateway_msgs.msg import ConnectionType, RemoteRuleWithStatus
+from rocon_gateway import master_api
+from rocon_gateway_tests import VirtualTimeDriver
+
+##############################################################################
+# Bursts
+##############################################################################
+#
+# Launch and teardown storms - hundreds of nodes appearing or vanishing at
+# once - through the whole gateway pipeline. A robot gateway advertises
+# and flips everything to a concert gateway (virtual time, fake masters,
+# in-memory hub). Bursts of nodes are registered on the robot's master and
+# fed to its LocalMaster as a single added (launch) or lost (teardown)
+# connection cache diff. Timed from the diff until the robot's public
+# interface, the advertisements on the hub and the flips (accepted by the
+# concert) have all caught up.
+#
+# Costs are reported per changed connection for each base graph size, so
+# it shows whether the pipeline scales with the size of the change or the
+# size of the graph.
+
+Shape = collections.namedtuple('Shape', 'publishers subscribers services actions')
+
+
+def create_empty_system_state():
+    return master_api.SystemState(publishers={}, subscribers={}, services={}, action_servers={}, action_clients={})
+
+
+def create_burst(fake_master, prefix, nodes, shape):
+    '''
+      Register nodes, each with the connections of the shape, on the fake master.
+
+      @return the (name, connection type) of every connection and the system
+              state the connection cache would report them with
+      @rtype (set, master_api.SystemState)
+    '''
+    rules = set()
+    system_state = create_empty_system_state()
+    for i in range(nodes):
+        node = '%s/node_%d' % (prefix, i)
+        node_uri = fake_master.add_node(node)
+        for j in range(shape.publishers):
+            topic = '%s/chatter_%d' % (node, j)
+            fake_master.add_publisher(topic, 'std_msgs/String', node)
+            system_state.publishers[topic] = master_api.Channel(topic, 'std_msgs/String', None, [(node, node_uri)])
+            rules.add((topic, ConnectionType.PUBLISHER))
+        for j in range(shape.subscribers):
+            topic = '%s/command_%d' % (node, j)
+            fake_master.add_subscriber(topic, 'std_msgs/String', node)
+            system_state.subscribers[topic] = master_api.Channel(topic, 'std_msgs/String', None, [(node, node_uri)])
+            rules.add((topic, ConnectionType.SUBSCRIBER))
+        for j in range(shape.services):
+            service = '%s/add_two_ints_%d' % (node, j)
+            fake_master.add_service(service, node)
+            system_state.services[service] = master_api.Channel(service, None, fake_master.service_uris[service],
+                                                                [(node, node_uri)])
+            rules.add((service, ConnectionType.SERVICE))
+        for j in range(shape.actions):
+            action = '%s/fibonacci_%d' % (node, j)
+            fake_master.add_action_server(action, 'actionlib_tutorials/Fibonacci', node)
+            system_state.action_servers[action] = master_api.Channel(
+                action, 'actionlib_tutorials/FibonacciActionGoal', None, [(node, node_uri)])
+            rules.add((action, ConnectionType.ACTION_SERVER))
+    return rules, system_state
+
+
+def create_graph_rules(fake_master):
+    '''
+      @return the (name, connection type) of every topic and service on the fake master
+      @rtype set
+    '''
+    return (set((topic, ConnectionType.PUBLISHER) for topic in fake_master.publishers) |
+            set((topic, ConnectionType.SUBSCRIBER) for topic in fake_master.subscribers) |
+            set((service, ConnectionType.SERVICE) for service in fake_master.services))
+
+##############################################################################
+# Measurement
+##############################################################################
+
+Settlement = collections.namedtuple('Settlement', 'settled iterations time allocations hub_round_trips master_calls')
+
+
+def pipeline_state(virtual_gateway):
+    '''
+      @return the (name, connection type) of the public, advertised (on the hubs) and accepted flipped connections
+      @rtype (set, set, set)
+    '''
+    public = set((connection.rule.name, connection.rule.type)
+                 for connections in virtual_gateway.gateway.public_interface.getConnections().values()
+                 for connection in connections)
+    advertised = set((connection.rule.name, connection.rule.type)
+                     for hub in virtual_gateway.hub_manager.hubs
+                     for connections in hub.get_local_advertisements().values()
+                     for connection in connections)
+    flipped = set((flip.remote_rule.rule.name, flip.remote_rule.rule.type)
+                  for flip in virtual_gateway.gateway.flipped_interface.get_flipped_connections()
+                  if flip.status == RemoteRuleWithStatus.ACCEPTED)
+    return public, advertised, flipped
+
+
+def is_settled(virtual_gateway, rules, present):
+    '''
+      @param present : whether the connections should be all there (launch) or all gone (teardown)
+      @type bool
+    '''
+    for connections in pipeline_state(virtual_gateway):
+        if present and not rules <= connections:
+            return False
+        if not present and rules & connections:
+            return False
+    return True
+
+
+def settle(driver, virtual_gateway, feed, rules, present, max_iterations):
+    '''
+      Feed the change to the gateway, then step the driver until the pipeline
+      has caught up. Only feeding and stepping are measured, checking isn't.
+      Python 2 has no tracemalloc, so allocations are the net number of gc
+      tracked objects created, counted by generation 0 of the (paused)
+      garbage collector.
+
+      @param feed : hands the change to the gateway's local master
+      @type func()
+
+      @rtype Settlement
+    '''
+    totals = {'time': 0.0, 'allocations': 0, 'hub_round_trips': 0}
+
+    def measure(function):
+        gc.collect()
+        gc.disable()
+        hub_round_trips = driver.hub.round_trips
+        allocations = gc.get_count()[0]
+        start_time = time.time()
+        try:
+            function()
+        finally:
+            totals['time'] += time.time() - start_time
+            totals['allocations'] += gc.get_count()[0] - allocations
+            totals['hub_round_trips'] += driver.hub.round_trips - hub_round_trips
+            gc.enable()
+
+    for each in driver.gateways:
+        each.fake_master.reset_statistics()
+    measure(feed)
+    iterations = 0
+    settled = is_settled(virtual_gateway, rules, present)
+    while not settled and iterations < max_iterations:
+        measure(driver.step)
+        iterations += 1
+        settled = is_settled(virtual_gateway, rules, present)
+    return Settlement(settled=settled, iterations=iterations, time=totals['time'],
+                      allocations=totals['allocations'], hub_round_trips=totals['hub_round_trips'],
+                      master_calls=sum(sum(each.fake_master.statistics().values()) for each in driver.gateways))
+
+
+def report(label, nodes, changes, result):
+    colour = console.yellow if result.settled else console.red
+    print(console.cyan + "      %-8s %4d nodes [%5d connections]: " % (label, nodes, changes) + colour +
+          "%s after %2d iterations  total %9.1fms  per change %8.1fus  allocations %7.1f  hub %5.2f  master %5.2f" % (
+              'settled' if result.settled else 'timed out', result.iterations, result.time * 1000.0,
+              result.time * 1000000.0 / changes, float(result.allocations) / changes,
+              float(result.hub_round_trips) / changes, float(result.master_calls) / changes) +
+          console.reset)
+
+##############################################################################
+# Benchmark
+##############################################################################
+
+
+def bench_graph(graph_size, burst_sizes, shape, args):
+    '''
+      @return whether every burst settled
+      @rtype bool
+    '''
+    driver = VirtualTimeDriver(round_trip_time=args.rtt / 1000.0)
+    try:
+        robot = driver.add_gateway('robot', firewall=False)
+        concert = driver.add_gateway('concert', firewall=False)
+        robot.poll_master = False  # fed diffs instead, like the connection cache does
+        # let them see each other
+        driver.run_until(lambda: False, max_iterations=1)
+        robot.advertise_all()
+        robot.flip_all(concert.unique_name)
+
+        robot.fake_master.populate(topics=graph_size, services=graph_size // 10)
+        robot.local_master.refresh_connections()  # the connection cache's first callback is the full state
+        graph_rules = create_graph_rules(robot.fake_master)
+        result = driver.run_until(lambda: is_settled(robot, graph_rules, True), args.max_iterations)
+        print(console.green + "    graph [%d connections]" % len(graph_rules) + console.reset)
+        if not result.converged:
+            print(console.red + "      the graph itself didn't settle after %d iterations" % result.iterations + console.reset)
+            return False
+
+        all_settled = True
+        empty_system_state = create_empty_system_state()
+        for burst_size in burst_sizes:
+            prefix = '/churn_%d' % burst_size
+            rules, system_state = create_burst(robot.fake_master, prefix, burst_size, shape)
+            launch = settle(driver, robot,
+                            lambda: robot.local_master._connection_cache_proxy_cb(
+                                empty_system_state, system_state, empty_system_state),
+                            rules, True, args.max_iterations)
+            report('launch', burst_size, len(rules), launch)
+            for i in range(burst_size):
+                robot.fake_master.remove_node('%s/node_%d' % (prefix, i))
+            teardown = settle(driver, robot,
+                              lambda: robot.local_master._connection_cache_proxy_cb(
+                                  empty_system_state, empty_system_state, system_state),
+                              rules, False, args.max_iterations)
+            report('teardown', burst_size, len(rules), teardown)
+            all_settled = all_settled and launch.settled and teardown.settled
+        return all_settled
+    finally:
+        driver.shutdown()
+
+
+def parse_sizes(sizes):
+    return [int(size) for size in sizes.split(',') if size]
+
+##############################################################################
+# Main
+##############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark launch/teardown bursts through the whole gateway pipeline.')
+    parser.add_argument('-g', '--graphs', default='0,200',
+                        help='comma separated sizes (topics, plus a tenth as many services) of the graph already there')
+    parser.add_argument('-b', '--bursts', default='10,50', help='comma separated numbers of nodes launched/torn down at once')
+    parser.add_argument('-p', '--publishers', type=int, default=2, help='publishers per node')
+    parser.add_argument('-s', '--subscribers', type=int, default=2, help='subscribers per node')
+    parser.add_argument('--services', type=int, default=1, help='services per node')
+    parser.add_argument('-a', '--actions', type=int, default=0, help='action servers per node')
+    parser.add_argument('--rtt', type=float, default=0.0, help='virtual round trip time to the hub (ms)')
+    parser.add_argument('-m', '--max-iterations', type=int, default=10,
+                        help='fail if the pipeline takes more spin loop iterations than this to settle')
+    args = parser.parse_args()
+
+    shape = Shape(args.publishers, args.subscribers, args.services, args.actions)
+    if not sum(shape):
+        parser.exit(1, "Nodes need at least one connection\n")
+    print(console.bold + "Churn" + console.reset +
+          " [per node: %d publishers, %d subscribers, %d services, %d action servers]" % shape)
+    results = [bench_graph(graph_size, parse_sizes(args.bursts), shape, args) for graph_size in parse_sizes(args.graphs)]
+    if not all(results):
+        sys.exit(1)
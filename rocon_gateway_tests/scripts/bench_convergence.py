@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import argparse
+import sys
+
+import rocon_console.console as console
+from gateway_msgs.msg import ConnectionType
+from rocon_gateway_tests import VirtualTimeDriver
+
+##############################################################################
+# Scenarios
+##############################################################################
+#
+# Flip and pull convergence in virtual time - the same exchanges
+# test_flips.py and test_pulls.py wait on, but between gateways on fake
+# masters and an in-memory hub, stepped one spin loop iteration at a time.
+# Reports the iterations (spin loop periods), cpu time and hub/master
+# operations it takes until every flip is ACCEPTED or every pull is
+# registered.
+
+
+def create_connections(virtual_gateway, count, prefix):
+    '''
+      Add count publishers, services and action servers to the gateway's master.
+
+      @return (name, connection type) of each
+      @rtype [(str, str)]
+    '''
+    connections = []
+    for i in range(count):
+        node = '%s/node_%d' % (prefix, i)
+        topic = '%s/chatter_%d' % (prefix, i)
+        service = '%s/add_two_ints_%d' % (prefix, i)
+        action = '%s/fibonacci_%d' % (prefix, i)
+        virtual_gateway.fake_master.add_publisher(topic, 'std_msgs/String', node)
+        virtual_gateway.fake_master.add_service(service, node)
+        virtual_gateway.fake_master.add_action_server(action, 'actionlib_tutorials/Fibonacci', node)
+        connections.extend([(topic, ConnectionType.PUBLISHER),
+                            (service, ConnectionType.SERVICE),
+                            (action, ConnectionType.ACTION_SERVER)])
+    return connections
+
+
+def bench_flips(driver, source, target, count, max_iterations):
+    connections = create_connections(source, count, '/flips')
+    for name, connection_type in connections:
+        source.flip(target.unique_name, name, connection_type)
+    return driver.run_until(
+        lambda: all(source.is_flipped(target.unique_name, name, connection_type) for name, connection_type in connections),
+        max_iterations)
+
+
+def bench_pulls(driver, source, target, count, max_iterations):
+    connections = create_connections(source, count, '/pulls')
+    for name, connection_type in connections:
+        source.advertise(name, connection_type)
+        target.pull(source.unique_name, name, connection_type)
+    return driver.run_until(
+        lambda: all(target.is_pulled(source.unique_name, name, connection_type) for name, connection_type in connections),
+        max_iterations)
+
+
+def report(label, result):
+    colour = console.yellow if result.converged else console.red
+    print(console.cyan + "    %-8s: " % label + colour +
+          "%s after %3d iterations [%5.1fs virtual]  cpu %8.1fms  hub %5d round trips/%6d commands  master %5d calls" % (
+              'converged' if result.converged else 'timed out', result.iterations, result.virtual_time,
+              result.cpu_time * 1000.0, result.hub_round_trips, result.hub_commands, result.master_calls) +
+          console.reset)
+
+##############################################################################
+# Main
+##############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark flip and pull convergence under a virtual clock.')
+    parser.add_argument('-n', '--connections', type=int, default=10,
+                        help='publishers, services and action servers (each) to flip and pull')
+    parser.add_argument('--rtt', type=float, default=20.0, help='virtual round trip time to the hub (ms)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='virtual round trip jitter (ms)')
+    parser.add_argument('--seed', type=int, default=None, help='seed the jitter for repeatable runs')
+    parser.add_argument('-m', '--max-iterations', type=int, default=10,
+                        help='fail if a scenario takes more spin loop iterations than this to converge')
+    args = parser.parse_args()
+
+    driver = VirtualTimeDriver(round_trip_time=args.rtt / 1000.0, jitter=args.jitter / 1000.0, seed=args.seed)
+    try:
+        robot = driver.add_gateway('robot', firewall=False)
+        concert = driver.add_gateway('concert', firewall=False)
+        # let them see each other
+        driver.run_until(lambda: False, max_iterations=1)
+        print(console.bold + "Convergence" + console.reset +
+              " [%d connections, %.0fms rtt]" % (3 * args.connections, args.rtt))
+        results = [('flips', bench_flips(driver, robot, concert, args.connections, args.max_iterations)),
+                   ('pulls', bench_pulls(driver, robot, concert, args.connections, args.max_iterations))]
+        for label, result in results:
+            report(label, result)
+    finally:
+        driver.shutdown()
+    if not all(result.converged for unused_label, result in results):
+        sys.exit(1)
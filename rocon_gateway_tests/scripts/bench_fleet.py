@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import argparse
+import json
+import sys
+import time
+import uuid
+
+import rospy
+import rocon_console.console as console
+import rocon_python_redis as redis
+import gateway_msgs.msg as gateway_msgs
+from gateway_msgs.msg import ConnectionType, RemoteRule, RemoteRuleWithStatus as FlipStatus
+from rocon_gateway import gateway_hub
+from rocon_gateway import utils
+from rocon_hub import redis_server
+import rocon_hub_client
+from rocon_hub_client import hub_api
+
+##############################################################################
+# Fleet
+##############################################################################
+#
+# Starts a private redis server (via rocon_hub's RedisServer) and drives a
+# fleet of N synthetic gateways, each with M connections, through GatewayHub
+# (in-process, one after the other so cpu time can be attributed to each
+# gateway). For every (N, M) configuration the phases are:
+#
+#   register  : every gateway registers with the hub
+#   advertise : every gateway advertises its M connections
+#   pull      : gateway i pulls all of gateway i+1's advertisements
+#   flip      : gateway i flips its M connections to gateway i+1, which accepts them
+#
+# A phase has converged when an observer on the hub sees the final state
+# for every gateway (for flips, when every flipper sees its requests accepted).
+# Hub commands (redis_ops) and the gateways' cpu times are counted over the
+# gateways' work only, the polling for convergence doesn't inflate them.
+#
+# This measures the work of getting the fleet's state onto the hub, not how
+# long it takes to propagate. Every job is a synchronous write to the one
+# hub and there are no watch loops, so a phase has converged as soon as the
+# work is done - convergence_time is work_duration plus one check.
+#
+# Progress goes to stderr, so the json results can be piped from stdout.
+#
+# With --memory the hub is an in-process stand-in (rocon_hub_client.MemoryBackend)
+# instead of a redis server, optionally with simulated round trip times. That
+# is hermetic and measures the algorithmic costs (commands, round trips,
+# decoding) without redis or the network getting in the way.
+
+
+class SyntheticGateway(object):
+
+    def __init__(self, ip, port, index, connection_count):
+        self.name = 'bench_%d' % index + uuid.uuid4().hex
+        self.hub = gateway_hub.GatewayHub(ip, port, [], [])
+        self.connections = []
+        for i in range(connection_count):
+            name = '/%s/topic_%d' % (self.name, i)
+            node = '/%s/node_%d' % (self.name, i % 10)
+            rule = gateway_msgs.Rule(ConnectionType.PUBLISHER, name, node)
+            self.connections.append(utils.Connection(rule, 'std_msgs/String', 'std_msgs/String',
+                                                     'http://127.0.0.1:%d/' % (40000 + index)))
+        self.cpu_time = 0.0
+
+    def run(self, function, *args):
+        '''
+          Run one of this gateway's jobs, accumulating the cpu time it takes.
+        '''
+        start_time = time.clock()
+        try:
+            return function(*args)
+        finally:
+            self.cpu_time += time.clock() - start_time
+
+    def register(self):
+        self.hub.register_gateway(False, self.name, lambda hub: None, '127.0.0.1')
+
+    def advertise(self):
+        for connection in self.connections:
+            self.hub.advertise(connection)
+
+    def pull(self, remote_gateway):
+        connections = self.hub.get_remote_connection_state(remote_gateway)
+        for connection in connections[ConnectionType.PUBLISHER]:
+            self.hub.post_pull_details(remote_gateway, connection.rule.name, connection.rule.type, connection.rule.node)
+
+    def flip(self, remote_gateway):
+        for connection in self.connections:
+            self.hub.send_flip_request(remote_gateway, connection)
+            self.hub.post_flip_details(remote_gateway, connection.rule.name, connection.rule.type, connection.rule.node)
+
+    def accept_flips(self):
+        pending = [(registration, FlipStatus.ACCEPTED)
+                   for registration, status in self.hub.get_unblocked_flipped_in_connections()
+                   if status == FlipStatus.PENDING]
+        if pending:
+            self.hub.update_multiple_flip_request_status(pending)
+
+    def flips_accepted(self, remote_gateway):
+        remote_rules = [RemoteRule(remote_gateway, connection.rule) for connection in self.connections]
+        return all(status == FlipStatus.ACCEPTED for status in self.hub.get_multiple_flip_request_status(remote_rules))
+
+
+class FleetBenchmark(object):
+
+    def __init__(self, port, timeout, memory=False, round_trip_time=0.0):
+        '''
+          @param memory : use an in-process hub rather than a redis server
+          @type bool
+          @param round_trip_time : simulated latency for the in-process hub (sec)
+          @type float
+        '''
+        self._port = port
+        self._timeout = timeout
+        if memory:
+            self._backend = rocon_hub_client.MemoryBackend(latency=rocon_hub_client.LatencyModel(round_trip_time))
+            self._server = None
+        else:
+            self._backend = None
+            self._server = redis_server.RedisServer({'name': 'Bench Fleet Hub', 'port': port, 'max_memory': '512mb'})
+        self._redis = None
+        self._observer = None
+
+    def start(self):
+        if self._backend is not None:
+            self._backend.add_server('localhost', self._port, 'Bench Fleet Hub')
+            rocon_hub_client.set_backend(self._backend)
+            self._redis = self._backend.create_client(self._backend.create_connection_pool('localhost', self._port))
+        else:
+            self._server.start()
+            self._redis = redis.Redis(host='localhost', port=self._port)
+        self._observer = gateway_hub.GatewayHub('localhost', self._port, [], [])
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+        else:
+            rocon_hub_client.set_backend(None)
+
+    def redis_version(self):
+        return self._redis.info()['redis_version']
+
+    def reset(self):
+        '''
+          Clear out the previous configuration's gateways.
+        '''
+        hub_name = self._redis.get('rocon:hub:name')
+        hub_api.delete_keys(self._redis, hub_api.scan_keys(self._redis, 'rocon:*'))
+        self._redis.set('rocon:hub:name', hub_name)
+
+    def run(self, gateway_count, connection_count):
+        '''
+          @return the results for this configuration
+          @rtype dict
+        '''
+        self.reset()
+        result = {'gateways': gateway_count, 'connections': connection_count, 'phases': {}}
+        gateways = [SyntheticGateway('localhost', self._port, i, connection_count) for i in range(gateway_count)]
+        names = [gateway.name for gateway in gateways]
+
+        def neighbour(i):
+            return names[(i + 1) % gateway_count]
+
+        def registered():
+            return set(names) <= set(self._observer.list_remote_gateway_names())
+
+        def advertised():
+            return all(len(self._remote_gateway_info(name).public_interface) == connection_count for name in names)
+
+        def pulled():
+            return all(len(self._remote_gateway_info(name).pulled_interface) == connection_count for name in names)
+
+        def flipped():
+            # not through gateway.run(), polling isn't the gateways' work
+            return all(gateway.flips_accepted(neighbour(i)) for i, gateway in enumerate(gateways))
+
+        # (phase, job, follow up job run once every gateway has done the first, converged)
+        phases = [('register', lambda i, gateway: gateway.register(), None, registered),
+                  ('advertise', lambda i, gateway: gateway.advertise(), None, advertised)]
+        if gateway_count > 1:
+            phases.append(('pull', lambda i, gateway: gateway.pull(neighbour(i)), None, pulled))
+            phases.append(('flip', lambda i, gateway: gateway.flip(neighbour(i)),
+                           lambda i, gateway: gateway.accept_flips(), flipped))
+        for phase, job, follow_up_job, converged in phases:
+            result['phases'][phase] = self._run_phase(gateways, job, follow_up_job, converged)
+            progress(console.cyan + "  %-10s: " % phase + console.yellow + "%(duration).3fs  %(redis_ops_per_second)8.0f ops/s  "
+                     "%(hub_memory_bytes)10d bytes  %(cpu_per_gateway_mean).4fs cpu/gateway  converged: %(converged)s" %
+                     result['phases'][phase] + console.reset)
+        for gateway in gateways:
+            gateway.hub.disconnect()
+        return result
+
+    def _remote_gateway_info(self, name):
+        remote_gateway = self._observer.remote_gateway_info(name)
+        if remote_gateway is None:
+            return gateway_msgs.RemoteGateway()
+        return remote_gateway
+
+    def _run_phase(self, gateways, job, follow_up_job, converged):
+        for gateway in gateways:
+            gateway.cpu_time = 0.0
+        commands_processed = self._redis.info()['total_commands_processed']
+        start_time = time.time()
+        for i, gateway in enumerate(gateways):
+            gateway.run(job, i, gateway)
+        if follow_up_job is not None:
+            for i, gateway in enumerate(gateways):
+                gateway.run(follow_up_job, i, gateway)
+        work_duration = time.time() - start_time
+        # before the observer starts polling
+        redis_ops = self._redis.info()['total_commands_processed'] - commands_processed - 1  # the info call itself
+        convergence_time = None
+        while time.time() - start_time <= self._timeout:
+            if converged():
+                convergence_time = time.time() - start_time
+                break
+            time.sleep(0.001)
+        duration = time.time() - start_time
+        info = self._redis.info()
+        cpu_times = [gateway.cpu_time for gateway in gateways]
+        return {
+            'converged': convergence_time is not None,
+            'convergence_time': convergence_time,
+            'duration': duration,
+            'work_duration': work_duration,
+            'redis_ops': redis_ops,
+            'redis_ops_per_second': redis_ops / work_duration if work_duration > 0 else 0.0,
+            'hub_memory_bytes': info['used_memory'],
+            'cpu_per_gateway_mean': sum(cpu_times) / len(cpu_times),
+            'cpu_per_gateway_max': max(cpu_times),
+        }
+
+##############################################################################
+# Main
+##############################################################################
+
+
+def progress(message):
+    sys.stderr.write(message + "\n")
+
+
+def _int_list(string):
+    return [int(value) for value in string.split(',')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure how the hub and gateways scale with the number of gateways and connections.')
+    parser.add_argument('-g', '--gateways', type=_int_list, default=[1, 5, 10, 20], help='comma separated numbers of gateways')
+    parser.add_argument('-c', '--connections', type=_int_list, default=[10, 50, 100], help='comma separated numbers of connections per gateway')
+    parser.add_argument('-p', '--port', type=int, default=6390, help='port for the private redis server')
+    parser.add_argument('-t', '--timeout', type=float, default=60.0, help='give up on a phase converging after this long (sec)')
+    parser.add_argument('-o', '--output', default=None, help='write the json results here (default stdout)')
+    parser.add_argument('-m', '--memory', action='store_true', help='use an in-process hub instead of a redis server')
+    parser.add_argument('--rtt', type=float, default=0.0, help='simulated round trip time for the in-process hub (ms)')
+    args = parser.parse_args(rospy.myargv()[1:])
+
+    benchmark = FleetBenchmark(args.port, args.timeout, args.memory, args.rtt / 1000.0)
+    benchmark.start()
+    try:
+        results = {'redis_version': benchmark.redis_version(), 'round_trip_time': args.rtt if args.memory else None,
+                   'timestamp': time.time(), 'configurations': []}
+        progress(console.bold + "Benchmarks" + console.reset)
+        for gateway_count in args.gateways:
+            for connection_count in args.connections:
+                progress(console.green + "  %d gateways x %d connections" % (gateway_count, connection_count) + console.reset)
+                results['configurations'].append(benchmark.run(gateway_count, connection_count))
+    finally:
+        benchmark.shutdown()
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print("")
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        progress(console.cyan + "Results: " + console.yellow + args.output + console.reset)
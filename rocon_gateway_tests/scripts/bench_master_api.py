@@ -1,71 +1,253 @@
 #!/usr/bin/env python
-#       
+#
 # License: BSD
-#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE 
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
 #
 ##############################################################################
 # Imports
 ##############################################################################
 
+import argparse
+import collections
+import gc
+import time
+
 import rospy
-import rocon_gateway
 import rocon_console.console as console
 from gateway_msgs.msg import ConnectionType
-import sys
-import itertools
-import rosgraph
+from rocon_gateway import master_api
+from rocon_gateway import utils
 
 ##############################################################################
-# Main
+# System States
 ##############################################################################
 #
-# get_system_state retrieves lists of the form
-# [ [topic1, [node1, ...]], [topic2, [node3, ...]], ... ]
-# subscriber example
-#   ['/d/chatter', ['/d/talker']]
-#   {'subscriber': [{subscriber, name: /d/chatter, node: /d/listener, uri: http://snorriheim:58916/, topic_type: std_msgs/String}
-# service example:
-#   ['/b/add_two_ints', ['/b/add_two_ints_server']]
-#   {service, name: /b/add_two_ints, node: /b/add_two_ints_server, uri: http://snorriheim:51256/, service_api: rosrpc://snorriheim:42463}
-# action client example:
-#   ['/a/fibonacci', ['/a/fibonacci_client']]
-#   {action_client, name: /a/fibonacci, node: /a/fibonacci_client, uri: http://snorriheim:58280/, topic_type: actionlib_tutorials/Fibonacci}
-# action server example
-#   ['/d/fibonacci_server', ['/d/fibonacci_server']]
-#   {action_server, name: /a/fibonacci_server, node: /a/fibonacci_server, uri: http://snorriheim:60001/, topic_type: actionlib_tutorials/Fibonacci}  
+# Benchmarks the path from the connection cache into the gateway:
+#   LocalMaster._connection_cache_proxy_cb and the utils._get_connections_from_*_chan_dict
+# converters it calls, for full state and diff callbacks.
+#
+# The connection cache publishes rocon_std_msgs/ConnectionsList messages, the
+# proxy groups them into channel dictionaries (master_api.SystemState) before
+# calling back. Connections here come from one of:
+#   synthetic : generated, sized on the command line
+#   --bag     : connection_cache/list messages recorded in a bag (replayed as diffs)
+#   --master  : the live ros master
 
-if __name__ == '__main__':
-    rospy.init_node('bench_master_api')
-    master = rosgraph.Master(rospy.get_name())
-    connection_cache = rocon_gateway.ConnectionCache(master.getSystemState)
-    times = {}
-    names = ['start_time', 'get_system_state', 'extract_action_servers', 'extract_action_clients', 'get_pubs', 'get_subs', 'get_services', 'get_action_servers', 'get_action_clients']
-    for name in names:
-        times[name] = 0.0
-    while not rospy.is_shutdown():
+# same fields as rocon_std_msgs/Connection
+Connection = collections.namedtuple('Connection', 'type name node type_msg type_info xmlrpc_uri')
+
+
+def create_synthetic_connections(topics, services, actions, prefix='/synthetic'):
+    connections = []
+    for i in range(topics):
+        node = '%s/node_%d' % (prefix, i // 10)
+        node_uri = 'http://localhost:%d/' % (40000 + i // 10)
+        topic = '%s/topic_%d' % (prefix, i)
+        connections.append(Connection(ConnectionType.PUBLISHER, topic, node, 'std_msgs/String', 'std_msgs/String', node_uri))
+        connections.append(Connection(ConnectionType.SUBSCRIBER, topic, node + '_listener', 'std_msgs/String', 'std_msgs/String', node_uri))
+    for i in range(services):
+        node = '%s/node_%d' % (prefix, i)
+        connections.append(Connection(ConnectionType.SERVICE, '%s/service_%d' % (prefix, i), node, 'std_srvs/Empty',
+                                      'rosrpc://localhost:%d' % (50000 + i), 'http://localhost:%d/' % (40000 + i)))
+    for i in range(actions):
+        action = '%s/action_%d' % (prefix, i)
+        goal_type = 'actionlib_tutorials/FibonacciActionGoal'
+        connections.append(Connection(ConnectionType.ACTION_SERVER, action, '%s/action_server_%d' % (prefix, i),
+                                      goal_type, goal_type, 'http://localhost:%d/' % (45000 + i)))
+        connections.append(Connection(ConnectionType.ACTION_CLIENT, action, '%s/action_client_%d' % (prefix, i),
+                                      goal_type, goal_type, 'http://localhost:%d/' % (46000 + i)))
+    return connections
+
+
+def create_system_state(connections):
+    '''
+      Group connections into channels, as the connection cache proxy does.
+
+      @param connections : anything with the fields of a rocon_std_msgs/Connection
+      @type [Connection]
+
+      @rtype master_api.SystemState
+    '''
+    channels = dict((connection_type, {}) for connection_type in utils.connection_types)
+    for connection in connections:
+        channel_dict = channels[connection.type]
+        channel = channel_dict.get(connection.name)
+        if channel is None:
+            xmlrpc_uri = connection.type_info if connection.type == ConnectionType.SERVICE else None
+            channel = channel_dict[connection.name] = master_api.Channel(connection.name, connection.type_msg, xmlrpc_uri, [])
+        channel.nodes.append((connection.node, connection.xmlrpc_uri))
+    return master_api.SystemState(publishers=channels[ConnectionType.PUBLISHER],
+                                  subscribers=channels[ConnectionType.SUBSCRIBER],
+                                  services=channels[ConnectionType.SERVICE],
+                                  action_servers=channels[ConnectionType.ACTION_SERVER],
+                                  action_clients=channels[ConnectionType.ACTION_CLIENT])
+
+
+def load_recorded_connections(bag_path, topic):
+    '''
+      @return the connections of every ConnectionsList message in the bag
+      @rtype [[Connection]]
+    '''
+    import rosbag  # only needed for replaying recordings
+    recorded = []
+    with rosbag.Bag(bag_path) as bag:
+        for unused_topic, msg, unused_time in bag.read_messages(topics=[topic]):
+            recorded.append([Connection(c.type, c.name, c.node, c.type_msg, c.type_info, c.xmlrpc_uri) for c in msg.connections])
+    return recorded
+
+
+def load_master_connections(local_master):
+    '''
+      @return the connections currently on the live master
+      @rtype [Connection]
+    '''
+    system_state = local_master._get_system_state_from_master()
+    connections = []
+    for connection_type, channel_dict in [(ConnectionType.PUBLISHER, system_state.publishers),
+                                          (ConnectionType.SUBSCRIBER, system_state.subscribers),
+                                          (ConnectionType.SERVICE, system_state.services),
+                                          (ConnectionType.ACTION_SERVER, system_state.action_servers),
+                                          (ConnectionType.ACTION_CLIENT, system_state.action_clients)]:
+        for channel in channel_dict.values():
+            type_info = channel.xmlrpc_uri if connection_type == ConnectionType.SERVICE else channel.type
+            for node, node_uri in channel.nodes:
+                connections.append(Connection(connection_type, channel.name, node, channel.type, type_info, node_uri))
+    return connections
+
+##############################################################################
+# Measurement
+##############################################################################
+
+
+class Stage(object):
+
+    '''
+      Accumulates timings and allocations for one stage of the pipeline.
+      Python 2 has no tracemalloc, so allocations are the net number of
+      gc tracked objects (containers, Connection objects...) created, counted
+      by generation 0 of the (paused) garbage collector.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.times = []
+        self.allocations = []
+
+    def run(self, function, *args):
+        gc.collect()
+        gc.disable()
+        allocations = gc.get_count()[0]
+        start_time = time.time()
         try:
-            connections = {}
-            times['start_time'] = rospy.get_time()  # float version
-            publishers, subscribers, services = connection_cache._get_system_state()
-            times['get_system_state'] = rospy.get_time()
-            action_servers, publishers, subscribers = connection_cache._get_action_servers(publishers, subscribers)
-            times['extract_action_servers'] = rospy.get_time()
-            action_clients, publishers, subscribers = connection_cache._get_action_clients(publishers, subscribers)
-            times['extract_action_clients'] = rospy.get_time()
-            connections[ConnectionType.PUBLISHER] = connection_cache._get_connections_from_pub_sub_list(publishers, ConnectionType.PUBLISHER)
-            times['get_pubs'] = rospy.get_time()
-            connections[ConnectionType.SUBSCRIBER] = connection_cache._get_connections_from_pub_sub_list(subscribers, ConnectionType.SUBSCRIBER)
-            times['get_subs'] = rospy.get_time()
-            connections[ConnectionType.SERVICE] = connection_cache._get_connections_from_service_list(services, ConnectionType.SERVICE)
-            times['get_services'] = rospy.get_time()
-            connections[ConnectionType.ACTION_SERVER] = connection_cache._get_connections_from_action_list(action_servers, ConnectionType.ACTION_SERVER)
-            times['get_action_servers'] = rospy.get_time()
-            connections[ConnectionType.ACTION_CLIENT] = connection_cache._get_connections_from_action_list(action_clients, ConnectionType.ACTION_CLIENT)
-            times['get_action_clients'] = rospy.get_time()
-            print(console.bold + "Benchmarks" + console.reset)
-            for i in range(1, len(names)):
-                print(console.cyan + "  %s: " % names[i] + console.yellow + "%s" % (times[names[i]] - times[names[i-1]]) + console.reset)
-            print(console.green + "  total_time: " + console.magenta + "%s" % (times[names[-1]] - times[names[0]]) + console.reset)
-        except Exception as e:
-            print(console.red + "Lost contact with the master [%s][%s]" % (str(e), type(e)) + console.reset)
-            break
+            return function(*args)
+        finally:
+            self.times.append(time.time() - start_time)
+            self.allocations.append(gc.get_count()[0] - allocations)
+            gc.enable()
+
+    def report(self):
+        print(console.cyan + "    %-24s: " % self.name + console.yellow +
+              "min %8.3fms  mean %8.3fms  allocations %8d" % (
+                  min(self.times) * 1000.0, sum(self.times) * 1000.0 / len(self.times),
+                  sum(self.allocations) / len(self.allocations)) +
+              console.reset)
+
+
+def bench_full(local_master, connections, repeats):
+    stages = collections.OrderedDict((name, Stage(name)) for name in [
+        'system_state', 'action_servers', 'action_clients', 'publishers', 'subscribers', 'services', 'full_callback'])
+    for unused_i in range(repeats):
+        system_state = stages['system_state'].run(create_system_state, connections)
+        for name, connection_type, converter in [
+                ('action_servers', ConnectionType.ACTION_SERVER, utils._get_connections_from_action_chan_dict),
+                ('action_clients', ConnectionType.ACTION_CLIENT, utils._get_connections_from_action_chan_dict),
+                ('publishers', ConnectionType.PUBLISHER, utils._get_connections_from_pub_sub_chan_dict),
+                ('subscribers', ConnectionType.SUBSCRIBER, utils._get_connections_from_pub_sub_chan_dict),
+                ('services', ConnectionType.SERVICE, utils._get_connections_from_service_chan_dict)]:
+            stages[name].run(converter, getattr(system_state, name), connection_type)
+        # start from scratch every time, so every connection is new
+        local_master._connection_snapshot = (0, utils.create_empty_connection_type_dictionary(frozenset))
+        stages['full_callback'].run(local_master._connection_cache_proxy_cb, system_state, None, None)
+    return stages
+
+
+def bench_diffs(local_master, diffs, repeats):
+    '''
+      @param diffs : (full connections to start from, [(added connections, lost connections)])
+      @type tuple
+    '''
+    (initial, changes) = diffs
+    stages = collections.OrderedDict((name, Stage(name)) for name in ['diff_system_states', 'diff_callback'])
+    empty_system_state = create_system_state([])
+    for unused_i in range(repeats):
+        local_master._connection_cache_proxy_cb(create_system_state(initial), None, None)
+        for added, lost in changes:
+            added_system_state = stages['diff_system_states'].run(create_system_state, added)
+            lost_system_state = create_system_state(lost)
+            stages['diff_callback'].run(local_master._connection_cache_proxy_cb,
+                                        empty_system_state, added_system_state, lost_system_state)
+    return stages
+
+
+def create_synthetic_diffs(connections, diff_size, count):
+    '''
+      Every diff replaces diff_size of the publishers with new ones.
+    '''
+    changes = []
+    publishers = [connection for connection in connections if connection.type == ConnectionType.PUBLISHER]
+    for i in range(count):
+        lost = publishers[(i * diff_size) % max(len(publishers), 1):][:diff_size]
+        added = [connection._replace(name=connection.name + '_%d' % i) for connection in lost]
+        changes.append((added, lost))
+    return connections, changes
+
+
+def create_recorded_diffs(recorded):
+    changes = []
+    for previous, current in zip(recorded, recorded[1:]):
+        (previous, current) = (set(previous), set(current))
+        changes.append((list(current - previous), list(previous - current)))
+    return recorded[0], changes
+
+##############################################################################
+# Main
+##############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the connection cache callback path of the gateway.')
+    parser.add_argument('-t', '--topics', type=int, default=1000, help='synthetic topics (one publisher and subscriber each)')
+    parser.add_argument('-s', '--services', type=int, default=100, help='synthetic services')
+    parser.add_argument('-a', '--actions', type=int, default=10, help='synthetic actions (one server and client each)')
+    parser.add_argument('-d', '--diff-size', type=int, default=10, help='connections replaced by each synthetic diff')
+    parser.add_argument('-n', '--diffs', type=int, default=20, help='number of synthetic diffs')
+    parser.add_argument('-r', '--repeats', type=int, default=10, help='number of times to run each benchmark')
+    parser.add_argument('--bag', default=None, help='replay ConnectionsList messages recorded in this bag instead')
+    parser.add_argument('--bag-topic', default='/connection_cache/list', help='topic of the recorded ConnectionsList messages')
+    parser.add_argument('--master', action='store_true', help='use the connections on the live ros master instead')
+    args = parser.parse_args(rospy.myargv()[1:])
+
+    if args.master:
+        rospy.init_node('bench_master_api')
+    # no connection cache needed, the benchmark feeds the callback itself
+    local_master = master_api.LocalMaster(use_connection_cache=False)
+    if args.bag is not None:
+        recorded = load_recorded_connections(args.bag, args.bag_topic)
+        if not recorded:
+            parser.exit(1, "No ConnectionsList messages on %s in %s\n" % (args.bag_topic, args.bag))
+        connections = recorded[-1]
+        diffs = create_recorded_diffs(recorded)
+    else:
+        if args.master:
+            connections = load_master_connections(local_master)
+        else:
+            connections = create_synthetic_connections(args.topics, args.services, args.actions)
+        diffs = create_synthetic_diffs(connections, args.diff_size, args.diffs)
+
+    print(console.bold + "Benchmarks" + console.reset)
+    print(console.green + "  full state [%d connections]" % len(connections) + console.reset)
+    for stage in bench_full(local_master, connections, args.repeats).values():
+        stage.report()
+    print(console.green + "  diffs [%d per run]" % len(diffs[1]) + console.reset)
+    if diffs[1]:
+        for stage in bench_diffs(local_master, diffs, args.repeats).values():
+            stage.report()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import argparse
+import collections
+import json
+import platform
+import re
+import sys
+import time
+import timeit
+
+import rocon_console.console as console
+import rocon_gateway_utils
+from gateway_msgs.msg import ConnectionType, RemoteRule, Rule
+from rocon_gateway import gateway_hub
+from rocon_gateway import interactive_interface
+from rocon_gateway import public_interface
+from rocon_gateway import ros_parameters
+from rocon_gateway import utils
+
+##############################################################################
+# Fixtures
+##############################################################################
+#
+# Microbenchmarks for the primitives the gateway runs thousands of times per
+# loop (per connection, per rule, per remote gateway). Each case works on a
+# batch of typical inputs and is reported as time per operation.
+#
+# Timings are also normalised against a fixed pure python workload
+# (calibrate()), so a baseline recorded on one machine still says something
+# on another. Baselines are json files written with --save, see
+# rocon_gateway_tests/benchmarks. On a noisy machine, record with more
+# repeats (-r 20 -m 0.2) and compare the same way.
+
+BATCH = 100
+UUID = '8bd699042519416d88722e8b0611d43b'
+
+# same as rocon_gateway/param/default_blacklist.yaml
+DEFAULT_BLACKLIST = [
+    {'name': '/rosout.*', 'node': 'None', 'type': ConnectionType.PUBLISHER},
+    {'name': '/rosout.*', 'node': 'None', 'type': ConnectionType.SUBSCRIBER},
+    {'name': '.*get_loggers', 'node': 'None', 'type': ConnectionType.SERVICE},
+    {'name': '.*set_logger_level', 'node': 'None', 'type': ConnectionType.SERVICE},
+    {'name': '/tf', 'node': 'None', 'type': ConnectionType.PUBLISHER},
+    {'name': '/tf', 'node': 'None', 'type': ConnectionType.SUBSCRIBER},
+    {'name': '.*zeroconf.*', 'node': 'None', 'type': ConnectionType.PUBLISHER},
+    {'name': '.*zeroconf.*', 'node': 'None', 'type': ConnectionType.SUBSCRIBER},
+    {'name': '.*zeroconf.*', 'node': 'None', 'type': ConnectionType.SERVICE},
+    {'name': '.*gateway/.*', 'node': 'None', 'type': ConnectionType.PUBLISHER},
+    {'name': '.*gateway/.*', 'node': 'None', 'type': ConnectionType.SUBSCRIBER},
+    {'name': '.*connection_cache/.*', 'node': 'None', 'type': ConnectionType.PUBLISHER},
+    {'name': '.*connection_cache/.*', 'node': 'None', 'type': ConnectionType.SUBSCRIBER},
+]
+
+
+def create_connections(count, prefix='/robot'):
+    connections = []
+    for i in range(count):
+        if i % 4 == 3:
+            rule = Rule(ConnectionType.SERVICE, '%s/service_%d' % (prefix, i), '%s/server_%d' % (prefix, i))
+            connections.append(utils.Connection(rule, 'std_srvs/Empty', 'rosrpc://robot.local:%d' % (50000 + i),
+                                                'http://robot.local:%d/' % (40000 + i)))
+        else:
+            rule = Rule(ConnectionType.PUBLISHER, '%s/topic_%d' % (prefix, i), '%s/talker_%d' % (prefix, i))
+            connections.append(utils.Connection(rule, 'std_msgs/String', 'std_msgs/String',
+                                                'http://robot.local:%d/' % (40000 + i)))
+    return connections
+
+
+def create_rules(count):
+    '''
+      A mix of plain and action rules, as flipped/pulled.
+    '''
+    rules = []
+    for i in range(count):
+        connection_type = [ConnectionType.PUBLISHER, ConnectionType.SERVICE,
+                           ConnectionType.ACTION_CLIENT, ConnectionType.ACTION_SERVER][i % 4]
+        rules.append(RemoteRule('gateway_%d%s' % (i, UUID), Rule(connection_type, '/robot/rule_%d' % i, '/robot/node_%d' % i)))
+    return rules
+
+##############################################################################
+# Cases
+##############################################################################
+#
+# Each case is a setup function returning (function, operations per call).
+# Setup is not timed.
+
+
+def case_serialize_connection():
+    connections = create_connections(BATCH)
+
+    def run():
+        for connection in connections:
+            utils.serialize_connection(connection)
+    return run, len(connections)
+
+
+def case_deserialize_connection():
+    encoded = [utils.serialize_connection(connection) for connection in create_connections(BATCH)]
+
+    def run():
+        for data in encoded:
+            utils.deserialize_connection(data)
+    return run, len(encoded)
+
+
+def case_connection_hash():
+    # a fresh connection per lookup, as when checking callback results against the snapshot
+    connections = create_connections(BATCH)
+    lookups = [connection.replace() for connection in connections]
+    connection_set = frozenset(connections)
+
+    def run():
+        for connection in lookups:
+            connection in connection_set
+    return run, len(lookups)
+
+
+def case_connection_eq():
+    pairs = zip(create_connections(BATCH), create_connections(BATCH))
+
+    def run():
+        for connection, other in pairs:
+            connection == other
+    return run, len(pairs)
+
+
+def case_has_same_rule():
+    pairs = zip(create_connections(BATCH), [connection.replace(xmlrpc_uri='http://other.local:1234/')
+                                            for connection in create_connections(BATCH)])
+
+    def run():
+        for connection, other in pairs:
+            connection.hasSameRule(other)
+    return run, len(pairs)
+
+
+def case_in_connection_list():
+    # worst case, the match is at the end of the list
+    connections = create_connections(BATCH)
+    connection = connections[-1].replace()
+
+    def run():
+        connection.inConnectionList(connections)
+    return run, 1
+
+
+def case_is_matched():
+    # flip/pull all with the default blacklist, the common configuration
+    interface = interactive_interface.InteractiveInterface(ros_parameters.generate_rules(DEFAULT_BLACKLIST), [], [])
+    gateway = 'remote_gateway' + UUID
+    interface.add_all(gateway, [])
+    rule = interface.watchlist[ConnectionType.PUBLISHER][0]
+    names = [('/robot/topic_%d' % i, '/robot/talker_%d' % i) for i in range(BATCH - 2)]
+    names += [('/rosout', '/robot/talker_0'), ('/robot/zeroconf/new_connections', '/robot/zeroconf')]
+
+    def run():
+        for name, node in names:
+            interface.is_matched(rule, rule.rule.name, name, node)
+    return run, len(names)
+
+
+def case_allow_rule():
+    # advertise all with the default blacklist
+    interface = public_interface.PublicInterface(ros_parameters.generate_rules(DEFAULT_BLACKLIST),
+                                                 utils.create_empty_connection_type_dictionary())
+    interface.advertise_all([])
+    rules = [connection.rule for connection in create_connections(BATCH)]
+
+    def run():
+        for rule in rules:
+            interface._allowRule(rule)
+    return run, len(rules)
+
+
+def case_rule_explode():
+    # neither method touches hub state, so skip connecting to a hub
+    hub = object.__new__(gateway_hub.GatewayHub)
+    rules = create_rules(BATCH)
+
+    def run():
+        hub.rule_explode(rules)
+    return run, len(rules)
+
+
+def case_rule_assemble():
+    # plain rules, rule_assemble can't yet cope with remote rules
+    hub = object.__new__(gateway_hub.GatewayHub)
+    rules = [remote_rule.rule for remote_rule in hub.rule_explode(create_rules(BATCH))]
+
+    def run():
+        hub.rule_assemble(rules)
+    return run, len(rules)
+
+
+def case_gateway_basename():
+    names = ['gateway_%d%s' % (i, UUID) if i % 2 else 'gateway_%d' % i for i in range(BATCH)]
+
+    def run():
+        for name in names:
+            rocon_gateway_utils.gateway_basename(name)
+    return run, len(names)
+
+
+def case_is_uuid_postfixed():
+    names = ['gateway_%d%s' % (i, UUID) if i % 2 else 'gateway_%d' % i for i in range(BATCH)]
+
+    def run():
+        for name in names:
+            rocon_gateway_utils.is_uuid_postfixed(name)
+    return run, len(names)
+
+
+_keys = None
+
+
+def _get_keys():
+    global _keys
+    if _keys is None:
+        _keys = utils.generate_private_public_key()
+    return _keys
+
+
+def case_encrypt_connection():
+    (unused_private_key, public_key) = _get_keys()
+    connections = create_connections(BATCH // 10)
+
+    def run():
+        for connection in connections:
+            utils.encrypt_connection(connection, public_key)
+    return run, len(connections)
+
+
+def case_decrypt_connection():
+    (private_key, public_key) = _get_keys()
+    encrypted = [utils.encrypt_connection(connection, public_key) for connection in create_connections(BATCH // 10)]
+
+    def run():
+        for connection in encrypted:
+            utils.decrypt_connection(connection, private_key)
+    return run, len(encrypted)
+
+cases = collections.OrderedDict([
+    ('serialize_connection', case_serialize_connection),
+    ('deserialize_connection', case_deserialize_connection),
+    ('connection_hash', case_connection_hash),
+    ('connection_eq', case_connection_eq),
+    ('has_same_rule', case_has_same_rule),
+    ('in_connection_list', case_in_connection_list),
+    ('is_matched', case_is_matched),
+    ('allow_rule', case_allow_rule),
+    ('rule_explode', case_rule_explode),
+    ('rule_assemble', case_rule_assemble),
+    ('gateway_basename', case_gateway_basename),
+    ('is_uuid_postfixed', case_is_uuid_postfixed),
+    ('encrypt_connection', case_encrypt_connection),
+    ('decrypt_connection', case_decrypt_connection),
+])
+
+##############################################################################
+# Measurement
+##############################################################################
+
+
+def calibrate():
+    '''
+      A fixed workload of the kind of python the primitives are made of
+      (attribute lookups, tuples, dicts, string formatting).
+    '''
+    lookup = {}
+    for i in range(1000):
+        key = ('publisher', '/topic_%d' % i, '/node')
+        lookup[key] = key[1]
+    return lookup
+
+
+def measure(function, operations, repeats, min_time):
+    '''
+      Time the function timeit style, scaling up the number of calls until a
+      run takes at least min_time.
+
+      @return best time per operation (seconds)
+      @rtype float
+    '''
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        duration = timer.timeit(number)
+        if duration >= min_time or number >= 1000000:
+            break
+        number *= 10 if duration < min_time / 10.0 else 2
+    best = min([duration] + timer.repeat(repeats - 1, number))
+    return best / (number * operations)
+
+
+def run(selected, repeats, min_time):
+    results = collections.OrderedDict()
+    for name in selected:
+        function, operations = cases[name]()
+        results[name] = measure(function, operations, repeats, min_time)
+    return results
+
+
+def format_time(seconds):
+    if seconds >= 1e-3:
+        return "%8.3fms" % (seconds * 1e3)
+    if seconds >= 1e-6:
+        return "%8.3fus" % (seconds * 1e6)
+    return "%8.1fns" % (seconds * 1e9)
+
+
+def compare(results, calibration, baseline, threshold):
+    '''
+      Compare calibrated results against a baseline.
+
+      @return names of the cases that regressed by more than the threshold
+      @rtype [str]
+    '''
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline['results']:
+            print(console.cyan + "    %-24s: " % name + console.yellow + format_time(seconds) +
+                  console.reset + "  (no baseline)")
+            continue
+        ratio = (seconds / calibration) / (baseline['results'][name] / baseline['calibration'])
+        if ratio > 1.0 + threshold:
+            regressions.append(name)
+            colour = console.red
+        elif ratio < 1.0 - threshold:
+            colour = console.green
+        else:
+            colour = console.reset
+        print(console.cyan + "    %-24s: " % name + console.yellow + format_time(seconds) +
+              console.reset + "  baseline " + format_time(baseline['results'][name]) +
+              colour + "  %6.2fx" % ratio + console.reset)
+    return regressions
+
+##############################################################################
+# Main
+##############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the gateway hot path primitives.')
+    parser.add_argument('-k', '--select', default=None, help='only run cases matching this regex')
+    parser.add_argument('-r', '--repeats', type=int, default=5, help='timing runs per case, the best is kept')
+    parser.add_argument('-m', '--min-time', type=float, default=0.05, help='minimum duration of a timing run (s)')
+    parser.add_argument('-s', '--save', default=None, help='save the results as a baseline to this file')
+    parser.add_argument('-c', '--compare', default=None, help='compare against the baseline in this file')
+    parser.add_argument('-t', '--threshold', type=float, default=0.25,
+                        help='relative slowdown (calibrated) reported as a regression when comparing')
+    args = parser.parse_args()
+
+    selected = [name for name in cases if args.select is None or re.search(args.select, name)]
+    if not selected:
+        parser.exit(1, "No cases match '%s' [%s]\n" % (args.select, ', '.join(cases)))
+    calibration = measure(calibrate, 1, 2 * args.repeats, args.min_time)
+    print(console.bold + "Benchmarks" + console.reset + " [calibration %s]" % format_time(calibration).strip())
+    results = run(selected, args.repeats, args.min_time)
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(console.green + "  %s [%s]" % (args.compare, baseline.get('machine', 'unknown')) + console.reset)
+        regressions = compare(results, calibration, baseline, args.threshold)
+    else:
+        for name, seconds in results.items():
+            print(console.cyan + "    %-24s: " % name + console.yellow + format_time(seconds) + console.reset)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': '%s, python %s' % (platform.machine(), platform.python_version()),
+                       'recorded': time.strftime('%Y-%m-%d'),
+                       'calibration': calibration,
+                       'results': results}, f, indent=2)
+            f.write('\n')
+        print(console.green + "  saved %s" % args.save + console.reset)
+    if regressions:
+        print(console.red + "Regressions [> %d%%]: %s" % (args.threshold * 100, ', '.join(regressions)) + console.reset)
+        sys.exit(1)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import argparse
+import cPickle as pickle
+import time
+
+import rocon_console.console as console
+from rocon_gateway import wire_format
+from gateway_msgs.msg import ConnectionType
+
+##############################################################################
+# Entries
+##############################################################################
+#
+# Typical hub payloads, as posted by the gateway:
+#   advertisement : [type, name, node, type_msg, type_info, xmlrpc_uri]
+#   flip request  : [command, source, type, name, node, type_msg, type_info, xmlrpc_uri]
+#   flip details  : [gateway, name, type, node]
+#
+# The gateway reads the same entries off the hub every loop, so 'wire format'
+# decodes with the decoder's layouts warmed up, 'wire (cold)' is the first
+# read of an entry.
+
+
+def create_entries(count):
+    entries = {'advertisement': [], 'flip_request': [], 'flip_details': []}
+    for i in range(count):
+        name = '/robot_%d/camera/image_raw' % i
+        node = '/robot_%d/camera_driver' % i
+        advertisement = [ConnectionType.PUBLISHER, name, node, 'sensor_msgs/Image',
+                         'sensor_msgs/Image', 'http://robot-%d.local:43827/' % i]
+        entries['advertisement'].append((wire_format.CONNECTION, advertisement))
+        entries['flip_request'].append((wire_format.CONNECTION_REQUEST,
+                                        ['pending', 'gateway_%032x' % i] + advertisement))
+        entries['flip_details'].append((wire_format.DETAILS,
+                                        ['gateway_%032x' % i, name, ConnectionType.PUBLISHER, node]))
+    return entries
+
+
+def decode_cold(data):
+    '''
+      Decoding an entry with a header the decoder hasn't seen yet.
+    '''
+    wire_format._layouts.clear()
+    wire_format._seen_headers.clear()
+    return wire_format.decode(data)
+
+
+def bench(label, encoded, decode, repeats):
+    start_time = time.time()
+    for unused_i in range(repeats):
+        for data in encoded:
+            decode(data)
+    duration = time.time() - start_time
+    decodes_per_second = len(encoded) * repeats / duration if duration > 0 else float('inf')
+    bytes_per_entry = float(sum(len(data) for data in encoded)) / len(encoded)
+    print(console.cyan + "    %-14s: " % label + console.yellow +
+          "%7.1f bytes/entry  %10.0f decodes/s" % (bytes_per_entry, decodes_per_second) + console.reset)
+    return bytes_per_entry, decodes_per_second
+
+##############################################################################
+# Main
+##############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the hub wire format against the old pickled entries.')
+    parser.add_argument('-n', '--entries', type=int, default=1000, help='number of entries of each kind')
+    parser.add_argument('-r', '--repeats', type=int, default=20, help='number of times to decode each entry')
+    args = parser.parse_args()
+
+    print(console.bold + "Benchmarks" + console.reset)
+    for kind, entries in sorted(create_entries(args.entries).items()):
+        print(console.green + "  %s" % kind + console.reset)
+        pickled = [pickle.dumps(fields) for unused_schema, fields in entries]
+        encoded = [wire_format.encode(schema, fields) for schema, fields in entries]
+        unused_size, pickle_rate = bench('pickle', pickled, pickle.loads, args.repeats)
+        bench('legacy reader', pickled, wire_format.decode_legacy, args.repeats)
+        unused_size, wire_rate = bench('wire format', encoded, wire_format.decode, args.repeats)
+        bench('wire (cold)', encoded, decode_cold, args.repeats)
+        print(console.cyan + "    %-14s: " % 'speedup' + console.magenta + "%.2fx" % (wire_rate / pickle_rate) +
+              console.reset)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import argparse
+import collections
+import cProfile
+import functools
+import time
+import traceback
+
+import rocon_console.console as console
+import rocon_hub_client
+from rocon_gateway import trace
+from rocon_hub_client import hub_api
+from rocon_gateway_tests import VirtualClock, VirtualGateway
+from rocon_gateway_tests.virtual_gateway import create_parameters
+
+##############################################################################
+# Replay
+##############################################################################
+#
+# Feeds a trace recorded by a gateway (~trace_file) back into a fresh
+# Gateway as fast as possible, to reproduce its cpu and latency profile
+# offline. The gateway runs on a fake master and in-memory hubs, the
+# hub clock follows the trace.
+#
+# Connection cache callbacks, service requests and spin loop iterations
+# are replayed in the recorded order, the connections in the connection
+# cache callbacks are registered on the fake master as they appear. Remote gateways aren't there, so
+# before each spin loop iteration the hubs are brought up to date with
+# what the recorded gateway read from them (gets, smembers, sismembers)
+# during that iteration. The gateway's own writes are its own. Flip requests
+# on the hubs are encrypted for the recorded gateway, so instead of reading
+# them the hubs hand back the decrypted requests it read (the trace's
+# 'flip_requests' records).
+#
+# Registrations of pulled/flipped in connections still call out to the
+# recorded node uris (publisherUpdate) - replay on a machine that can't
+# reach them so these fail fast.
+
+
+def scan(reader):
+    '''
+      @return the records and the hubs (uri : name)
+      @rtype ([(float, str, tuple)], dict)
+    '''
+    hub_name_key = hub_api.create_rocon_hub_key('name')
+    records = []
+    hubs = collections.OrderedDict()
+    for record in reader:
+        (unused_time, kind, payload) = record
+        records.append(record)
+        if kind == 'hub':
+            (uri, commands, results) = payload
+            hubs.setdefault(uri, None)
+            for (command, args, unused_kwargs), result in zip(commands, results or []):
+                if command == 'get' and args == (hub_name_key,) and result is not None:
+                    hubs[uri] = result
+    return records, hubs
+
+
+def seed(server, commands, results):
+    '''
+      Make the hub give the results the recorded gateway read.
+    '''
+    for (command, args, unused_kwargs), result in zip(commands, results):
+        if isinstance(result, Exception):
+            continue
+        if command == 'get':
+            if result is None:
+                server.delete(args[0])
+            else:
+                server.set(args[0], result)
+        elif command == 'smembers':
+            server.delete(args[0])
+            if result:
+                server.sadd(args[0], *result)
+        elif command == 'sismember':
+            if result:
+                server.sadd(args[0], args[1])
+            else:
+                server.srem(args[0], args[1])
+
+
+class Replay(object):
+
+    def __init__(self, path):
+        reader = trace.TraceReader(path)
+        try:
+            (self.records, hubs) = scan(reader)
+        finally:
+            reader.close()
+        if not hubs:
+            raise ValueError("trace has no hub traffic to replay against [%s]" % path)
+        self.clock = VirtualClock()
+        self.backend = rocon_hub_client.MemoryBackend(clock=self.clock.time)
+        self.servers = {}
+        for uri, name in hubs.items():
+            (ip, port) = uri.rsplit(':', 1)
+            self.servers[uri] = self.backend.add_server(ip, int(port), name or 'Replay Hub')
+        rocon_hub_client.set_backend(self.backend)
+
+        known_parameters = create_parameters(reader.param['name'])
+        param = dict((key, value) for key, value in reader.param.items() if key in known_parameters and key != 'name')
+        param['trace_file'] = ''
+        hub_addresses = [(uri.rsplit(':', 1)[0], int(uri.rsplit(':', 1)[1])) for uri in hubs]
+        self.virtual_gateway = VirtualGateway(reader.param['name'], hub_addresses[0], unique_name=reader.unique_name, **param)
+        for hub_address in hub_addresses[1:]:
+            self.virtual_gateway.connect(hub_address)
+        self.flip_requests = collections.defaultdict(collections.deque)  # hub uri : recorded reads to come
+        self.last_flip_requests = {}  # hub uri : the last recorded read
+        for hub in self.virtual_gateway.hub_manager.hubs:
+            hub.get_unblocked_flipped_in_connections = functools.partial(self._get_flip_requests, hub)
+        for server in self.servers.values():
+            server.reset_statistics()
+        self.virtual_gateway.fake_master.reset_statistics()
+
+        self.times = collections.defaultdict(list)  # kind : durations
+        self.errors = collections.defaultdict(int)  # kind : count
+
+    def run(self):
+        gateway = self.virtual_gateway.gateway
+        local_master = self.virtual_gateway.local_master
+        spins = [index for index, (unused_time, kind, unused_payload) in enumerate(self.records) if kind == 'spin']
+        next_spins = dict(zip(spins, spins[1:] + [len(self.records)]))
+        seeded_until = 0
+        for index, (record_time, kind, payload) in enumerate(self.records):
+            self.clock.advance(record_time - self.clock.time())
+            if kind in ('hub', 'flip_requests'):
+                if index >= seeded_until:  # not part of a spin iteration, e.g. the registration
+                    self._seed(kind, payload)
+                continue
+            if kind == 'spin':
+                for unused_time, other_kind, other_payload in self.records[index + 1:next_spins[index]]:
+                    if other_kind in ('hub', 'flip_requests'):
+                        self._seed(other_kind, other_payload)
+                seeded_until = next_spins[index]
+                function, args = gateway.spin_once, ()
+            elif kind == 'connections':
+                self._register(payload)
+                function, args = local_master._connection_cache_proxy_cb, payload
+            elif kind == 'service':
+                (name, request) = payload
+                function, args = getattr(gateway, 'ros_service_' + name), (request,)
+                kind = 'service/' + name
+            else:
+                continue  # newer kinds
+            start_time = time.time()
+            try:
+                function(*args)
+            except Exception:
+                self.errors[kind] += 1
+                if self.errors[kind] == 1:
+                    print(console.red + "Error replaying a %s record:\n%s" % (kind, traceback.format_exc()) + console.reset)
+            self.times[kind].append(time.time() - start_time)
+
+    def _register(self, system_states):
+        '''
+          Register the recorded connections on the fake master (they are
+          never unregistered), so the gateway's lookups of types, node and
+          service uris resolve as they did when recording.
+        '''
+        fake_master = self.virtual_gateway.fake_master
+        for system_state in system_states:
+            if system_state is None:
+                continue
+            for channels, register in [(system_state.publishers, fake_master.add_publisher),
+                                       (system_state.subscribers, fake_master.add_subscriber),
+                                       (system_state.action_servers, fake_master.add_action_server),
+                                       (system_state.action_clients, fake_master.add_action_client)]:
+                for channel in channels.values():
+                    channel_type = channel.type or ''
+                    if register in (fake_master.add_action_server, fake_master.add_action_client) and channel_type.endswith('ActionGoal'):
+                        channel_type = channel_type[:-len('ActionGoal')]
+                    for node, xmlrpc_uri in channel.nodes:
+                        fake_master.add_node(node, xmlrpc_uri)
+                        register(channel.name, channel_type, node)
+            for channel in system_state.services.values():
+                for node, xmlrpc_uri in channel.nodes:
+                    fake_master.add_node(node, xmlrpc_uri)
+                    fake_master.add_service(channel.name, node, channel.xmlrpc_uri)
+
+    def _seed(self, kind, payload):
+        if kind == 'flip_requests':
+            (uri, registrations) = payload
+            self.flip_requests[uri].append(registrations)
+            return
+        (uri, commands, results) = payload
+        if results is not None:
+            seed(self.servers[uri], commands, results)
+
+    def _get_flip_requests(self, hub):
+        '''
+          Stands in for the hub's get_unblocked_flipped_in_connections(), the recorded
+          requests can't be decrypted without the recorded gateway's private key.
+          If the recorded gateway didn't get an answer from the hub, it went with the last one.
+        '''
+        recorded = self.flip_requests[hub.uri]
+        if recorded:
+            self.last_flip_requests[hub.uri] = recorded.popleft()
+        return self.last_flip_requests.get(hub.uri, [])
+
+    def shutdown(self):
+        self.virtual_gateway.shutdown()
+        rocon_hub_client.set_backend(None)
+
+    def report(self, wall_time, cpu_time):
+        recorded_time = self.records[-1][0] - self.records[0][0] if self.records else 0.0
+        print(console.bold + "Replay" + console.reset + " [%d records, %.1fs recorded]" % (len(self.records), recorded_time))
+        for kind, times in sorted(self.times.items()):
+            print(console.cyan + "    %-24s: " % kind + console.yellow +
+                  "%6d  total %9.1fms  mean %8.3fms  max %8.3fms  errors %d" % (
+                      len(times), sum(times) * 1000.0, sum(times) * 1000.0 / len(times), max(times) * 1000.0,
+                      self.errors[kind]) +
+                  console.reset)
+        print(console.cyan + "    %-24s: " % 'total' + console.yellow +
+              "wall %.1fms  cpu %.1fms" % (wall_time * 1000.0, cpu_time * 1000.0) + console.reset)
+        print(console.cyan + "    %-24s: " % 'hub' + console.yellow +
+              "%d round trips  %d commands" % (sum(server.round_trips for server in self.servers.values()),
+                                               sum(server.commands_processed for server in self.servers.values())) +
+              console.reset)
+        print(console.cyan + "    %-24s: " % 'master' + console.yellow +
+              "%d calls" % sum(self.virtual_gateway.fake_master.statistics().values()) + console.reset)
+
+##############################################################################
+# Main
+##############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a gateway trace (recorded with ~trace_file) as fast as possible.')
+    parser.add_argument('trace', help='the trace file')
+    parser.add_argument('-p', '--profile', default=None, help='profile the replay, saving pstats to this file')
+    args = parser.parse_args()
+
+    replay = Replay(args.trace)
+    try:
+        profiler = cProfile.Profile() if args.profile is not None else None
+        start_wall_time = time.time()
+        start_cpu_time = time.clock()
+        if profiler is not None:
+            profiler.runcall(replay.run)
+        else:
+            replay.run()
+        (wall_time, cpu_time) = (time.time() - start_wall_time, time.clock() - start_cpu_time)
+        replay.report(wall_time, cpu_time)
+        if profiler is not None:
+            profiler.dump_stats(args.profile)
+            print(console.green + "  saved profile %s" % args.profile + console.reset)
+    finally:
+        replay.shutdown()
@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+
+from .fake_master import FakeMaster
+from .virtual_gateway import VirtualClock, VirtualGateway, VirtualTimeDriver
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import contextlib
+import random
+import SimpleXMLRPCServer
+import SocketServer
+import threading
+
+##############################################################################
+# Server
+##############################################################################
+
+
+class _RequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
+    # keep-alive, like the gateway's pooled connections expect
+    protocol_version = 'HTTP/1.1'
+    # serve every path - synthetic nodes have uris on this server too
+    rpc_paths = ()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadedXMLRPCServer(SocketServer.ThreadingMixIn, SimpleXMLRPCServer.SimpleXMLRPCServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+##############################################################################
+# Fake Master
+##############################################################################
+
+
+class FakeMaster(object):
+
+    '''
+      An in-process stand in for the ros master, serving the parts of the
+      master xmlrpc api the gateway uses (system state, topic types, lookups
+      and registrations) on a real xmlrpc server, so LocalMaster can be
+      pointed at it without a roscore.
+
+      It is populated with synthetic publishers, subscribers, services and
+      actions and can churn them. Every call is counted, so the cost of a
+      gateway operation in master calls can be measured:
+
+        master = FakeMaster()
+        master.populate(topics=3000, services=200, action_servers=20)
+        local_master = rocon_gateway.LocalMaster(master_uri=master.uri, use_connection_cache=False)
+        with master.count_calls() as calls:
+            local_master.refresh_connections()
+        print(calls)  # e.g. {'getSystemState': 1, 'getTopicTypes': 1, 'lookupNode': 300, ...}
+
+      Synthetic nodes get xmlrpc uris on this server (it also answers the
+      publisherUpdate node api call the gateway makes after registering
+      subscribers).
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, seed=None):
+        '''
+          @param port : port for the xmlrpc server (0 to pick a free one)
+          @type int
+          @param seed : seed for populate() and churn() so runs are repeatable
+          @type int
+        '''
+        self._server = _ThreadedXMLRPCServer((host, port), requestHandler=_RequestHandler,
+                                             logRequests=False, allow_none=True)
+        self._server.register_instance(_MasterApi(self))
+        self.uri = 'http://%s:%d/' % self._server.server_address
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self.publishers = {}  # topic : set of nodes
+        self.subscribers = {}  # topic : set of nodes
+        self.services = {}  # service : set of nodes
+        self.topic_types = {}  # topic : type
+        self.service_uris = {}  # service : rosrpc uri
+        self.node_uris = {}  # node : xmlrpc uri
+        self._calls = {}  # method name : count
+        self._synthetic_count = 0
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._churn_thread = None
+        self._churn_stop = threading.Event()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        self.stop_churn()
+        self._server.shutdown()
+        self._server.server_close()
+
+    ##########################################################################
+    # Graph
+    ##########################################################################
+
+    def add_node(self, node, xmlrpc_uri=None):
+        with self._lock:
+            if node not in self.node_uris:
+                self.node_uris[node] = xmlrpc_uri or (self.uri + node.lstrip('/'))
+            return self.node_uris[node]
+
+    def add_publisher(self, topic, topic_type, node):
+        with self._lock:
+            self.add_node(node)
+            self.publishers.setdefault(topic, set()).add(node)
+            self.topic_types.setdefault(topic, topic_type)
+
+    def add_subscriber(self, topic, topic_type, node):
+        with self._lock:
+            self.add_node(node)
+            self.subscribers.setdefault(topic, set()).add(node)
+            self.topic_types.setdefault(topic, topic_type)
+
+    def add_service(self, service, node, service_uri=None):
+        with self._lock:
+            self.add_node(node)
+            self.services.setdefault(service, set()).add(node)
+            self.service_uris[service] = service_uri or 'rosrpc://127.0.0.1:%d' % (40000 + len(self.service_uris))
+
+    def add_action_server(self, action, action_type, node):
+        self._add_action(action, action_type, node, self.add_subscriber, self.add_publisher)
+
+    def add_action_client(self, action, action_type, node):
+        self._add_action(action, action_type, node, self.add_publisher, self.add_subscriber)
+
+    def _add_action(self, action, action_type, node, add_inbound, add_outbound):
+        with self._lock:
+            add_inbound(action + '/goal', action_type + 'ActionGoal', node)
+            add_inbound(action + '/cancel', 'actionlib_msgs/GoalID', node)
+            add_outbound(action + '/status', 'actionlib_msgs/GoalStatusArray', node)
+            add_outbound(action + '/feedback', action_type + 'ActionFeedback', node)
+            add_outbound(action + '/result', action_type + 'ActionResult', node)
+
+    def remove_node(self, node):
+        '''
+          Drop a node and everything it has registered.
+        '''
+        with self._lock:
+            for registrations in (self.publishers, self.subscribers, self.services):
+                for name, nodes in registrations.items():
+                    nodes.discard(node)
+                    if not nodes:
+                        del registrations[name]
+            self.node_uris.pop(node, None)
+            self._forget_unused_names()
+
+    def _forget_unused_names(self):
+        for topic in self.topic_types.keys():
+            if topic not in self.publishers and topic not in self.subscribers:
+                del self.topic_types[topic]
+        for service in self.service_uris.keys():
+            if service not in self.services:
+                del self.service_uris[service]
+
+    ##########################################################################
+    # Synthetic Systems
+    ##########################################################################
+
+    def populate(self, topics=100, subscribers_per_topic=1, services=10, action_servers=0, action_clients=0, topics_per_node=10):
+        '''
+          Add a synthetic system. Each node publishes (up to) topics_per_node topics,
+          subscribers and services are spread over the same nodes. Action clients
+          get nodes of their own and connect to the first of the action servers.
+
+          @return the names of the nodes added
+          @rtype [str]
+        '''
+        nodes = []
+        with self._lock:
+            for i in range(topics):
+                if i % topics_per_node == 0:
+                    nodes.append(self._synthetic_name('node'))
+                topic = self._synthetic_name('topic')
+                self.add_publisher(topic, 'std_msgs/String', nodes[-1])
+                for unused_j in range(subscribers_per_topic):
+                    self.add_subscriber(topic, 'std_msgs/String', self._random.choice(nodes))
+            if not nodes:
+                nodes.append(self._synthetic_name('node'))
+            for unused_i in range(services):
+                self.add_service(self._synthetic_name('service'), self._random.choice(nodes))
+            for unused_i in range(action_servers):
+                action = self._synthetic_name('action')
+                self.add_action_server(action, 'actionlib_tutorials/Fibonacci', self._random.choice(nodes))
+                if action_clients:
+                    action_clients -= 1
+                    self.add_action_client(action, 'actionlib_tutorials/Fibonacci', self._synthetic_name('node'))
+        return nodes
+
+    def churn(self, count=1):
+        '''
+          Randomly drop or add synthetic publishers.
+
+          @param count : number of changes
+          @type int
+        '''
+        with self._lock:
+            for unused_i in range(count):
+                if self.publishers and self._random.random() < 0.5:
+                    topic = self._random.choice(sorted(self.publishers.keys()))
+                    node = self._random.choice(sorted(self.publishers[topic]))
+                    self.publishers[topic].discard(node)
+                    if not self.publishers[topic]:
+                        del self.publishers[topic]
+                    self._forget_unused_names()
+                else:
+                    node = self._random.choice(sorted(self.node_uris.keys())) if self.node_uris else self._synthetic_name('node')
+                    self.add_publisher(self._synthetic_name('topic'), 'std_msgs/String', node)
+
+    def start_churn(self, rate, count=1):
+        '''
+          Churn in the background.
+
+          @param rate : churn() calls per second
+          @type float
+          @param count : changes per churn() call
+          @type int
+        '''
+        self.stop_churn()
+        self._churn_stop.clear()
+
+        def churn_loop():
+            while not self._churn_stop.wait(1.0 / rate):
+                self.churn(count)
+        self._churn_thread = threading.Thread(target=churn_loop)
+        self._churn_thread.daemon = True
+        self._churn_thread.start()
+
+    def stop_churn(self):
+        if self._churn_thread is not None:
+            self._churn_stop.set()
+            self._churn_thread.join()
+            self._churn_thread = None
+
+    def _synthetic_name(self, kind):
+        self._synthetic_count += 1
+        return '/synthetic/%s_%d' % (kind, self._synthetic_count)
+
+    ##########################################################################
+    # Call Accounting
+    ##########################################################################
+
+    def record_call(self, method_name):
+        with self._lock:
+            self._calls[method_name] = self._calls.get(method_name, 0) + 1
+
+    def statistics(self):
+        '''
+          @return method name : number of calls since the last reset
+          @rtype dict
+        '''
+        with self._lock:
+            return dict(self._calls)
+
+    def reset_statistics(self):
+        with self._lock:
+            self._calls = {}
+
+    @contextlib.contextmanager
+    def count_calls(self):
+        '''
+          Count the calls made inside a with block. The yielded dictionary is
+          filled in (method name : calls) when the block exits.
+        '''
+        before = self.statistics()
+        calls = {}
+        try:
+            yield calls
+        finally:
+            for method_name, count in self.statistics().items():
+                if count != before.get(method_name, 0):
+                    calls[method_name] = count - before.get(method_name, 0)
+
+##############################################################################
+# Master Api
+##############################################################################
+
+
+class _MasterApi(object):
+
+    '''
+      The xmlrpc methods, returning (code, status message, value) like the
+      ros master does.
+    '''
+
+    def __init__(self, master):
+        self._master = master
+
+    def _dispatch(self, method, params):
+        self._master.record_call(str(method))
+        try:
+            function = getattr(self, method)
+        except AttributeError:
+            return -1, "unknown method [%s]" % method, 0
+        if method.startswith('_'):
+            return -1, "unknown method [%s]" % method, 0
+        with self._master._lock:
+            return function(*params)
+
+    @staticmethod
+    def _registrations(registrations):
+        return [[name, sorted(nodes)] for name, nodes in sorted(registrations.items())]
+
+    def getUri(self, caller_id):
+        return 1, "", self._master.uri
+
+    def getPid(self, caller_id):
+        return 1, "", 0
+
+    def getSystemState(self, caller_id):
+        return 1, "current system state", [self._registrations(self._master.publishers),
+                                           self._registrations(self._master.subscribers),
+                                           self._registrations(self._master.services)]
+
+    def getTopicTypes(self, caller_id):
+        return 1, "current topics", [[topic, topic_type] for topic, topic_type in sorted(self._master.topic_types.items())]
+
+    def getPublishedTopics(self, caller_id, subgraph):
+        return 1, "current topics", [[topic, self._master.topic_types[topic]]
+                                     for topic in sorted(self._master.publishers.keys()) if topic.startswith(subgraph)]
+
+    def lookupNode(self, caller_id, node_name):
+        uri = self._master.node_uris.get(node_name)
+        if uri is None:
+            return -1, "unknown node [%s]" % node_name, ''
+        return 1, "node api", uri
+
+    def lookupService(self, caller_id, service):
+        uri = self._master.service_uris.get(service)
+        if uri is None:
+            return -1, "no provider", ''
+        return 1, "rosrpc URI: [%s]" % uri, uri
+
+    def registerPublisher(self, caller_id, topic, topic_type, caller_api):
+        self._master.add_node(caller_id, caller_api)
+        self._master.add_publisher(topic, topic_type, caller_id)
+        subscriber_uris = [self._master.node_uris[node] for node in self._master.subscribers.get(topic, ())]
+        return 1, "registered [%s] as publisher of [%s]" % (caller_id, topic), subscriber_uris
+
+    def unregisterPublisher(self, caller_id, topic, caller_api):
+        return self._unregister(self._master.publishers, caller_id, topic)
+
+    def registerSubscriber(self, caller_id, topic, topic_type, caller_api):
+        self._master.add_node(caller_id, caller_api)
+        self._master.add_subscriber(topic, topic_type, caller_id)
+        publisher_uris = [self._master.node_uris[node] for node in self._master.publishers.get(topic, ())]
+        return 1, "subscribed to [%s]" % topic, publisher_uris
+
+    def unregisterSubscriber(self, caller_id, topic, caller_api):
+        return self._unregister(self._master.subscribers, caller_id, topic)
+
+    def registerService(self, caller_id, service, service_api, caller_api):
+        self._master.add_node(caller_id, caller_api)
+        self._master.add_service(service, caller_id, service_api)
+        return 1, "registered [%s] as provider of [%s]" % (caller_id, service), 1
+
+    def unregisterService(self, caller_id, service, service_api):
+        return self._unregister(self._master.services, caller_id, service)
+
+    def _unregister(self, registrations, caller_id, name):
+        nodes = registrations.get(name, set())
+        if caller_id not in nodes:
+            return 1, "[%s] is not registered for [%s]" % (caller_id, name), 0
+        nodes.discard(caller_id)
+        if not nodes:
+            del registrations[name]
+        self._master._forget_unused_names()
+        return 1, "unregistered [%s] for [%s]" % (caller_id, name), 1
+
+    # node api, for the synthetic nodes
+
+    def publisherUpdate(self, caller_id, topic, publishers):
+        return 1, "", 0
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import collections
+import threading
+import time
+import uuid
+
+import gateway_msgs.msg as gateway_msgs
+import gateway_msgs.srv as gateway_srvs
+import rocon_hub_client
+from rocon_gateway import gateway
+from rocon_gateway import gateway_hub
+from rocon_gateway import hub_manager
+from rocon_gateway import master_api
+from rocon_gateway import utils
+
+from .fake_master import FakeMaster
+
+##############################################################################
+# Virtual Time
+##############################################################################
+
+
+class VirtualClock(object):
+
+    '''
+      Time that only passes when told to. Given to the memory backend (for
+      key expiry) and its latency model (for round trips), hub time passes
+      without anyone actually waiting.
+    '''
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def sleep(self, duration):
+        with self._lock:
+            self._now += max(0.0, duration)
+
+    advance = sleep
+
+
+def create_parameters(name, **overrides):
+    '''
+      Gateway parameters as ros_parameters.setup_ros_parameters() would
+      give them with nothing on the parameter server.
+
+      @param overrides : parameters to change from their defaults
+      @type dict
+
+      @rtype dict
+    '''
+    param = {
+        'hub_uri': '',
+        'hub_whitelist': [],
+        'hub_blacklist': [],
+        'name': name,
+        'watch_loop_period': 10,
+        'default_blacklist': [],
+        'firewall': True,
+        'disable_zeroconf': True,
+        'disable_uuids': False,
+        'advertise_all': [],
+        'default_advertisements': [],
+        'default_flips': [],
+        'default_pulls': [],
+        'network_interface': '',
+        'trace_file': '',
+        'hub_serialization_format': 'pickle',
+        'profiling_interval': 0.01,
+    }
+    for key, value in overrides.items():
+        if key not in param:
+            raise KeyError("unknown gateway parameter [%s]" % key)
+        param[key] = value
+    return param
+
+##############################################################################
+# Virtual Gateway
+##############################################################################
+
+
+class VirtualGateway(object):
+
+    '''
+      A rocon_gateway.Gateway on its own fake ros master, registered on a
+      hub of the driver's memory backend. Nothing runs in the background:
+      the connection cache is replaced by polling the fake master and the
+      spin loop and heartbeats are stepped by the driver.
+
+      Polling rebuilds the whole connection state every step. To feed the
+      local master diffs instead, as the connection cache does, clear
+      poll_master and call local_master._connection_cache_proxy_cb yourself.
+    '''
+
+    def __init__(self, name, hub_address, unique_name=None, **param_overrides):
+        '''
+          @param hub_address : (ip, port) of the hub to register on
+          @type (str, int)
+          @param unique_name : name with the uuid postfix, generated if not given
+          @type str
+          @param param_overrides : gateway parameters to change from their defaults
+          @type dict
+        '''
+        self.name = name
+        self.param = create_parameters(name, **param_overrides)
+        if unique_name is not None:
+            self.unique_name = unique_name
+        else:
+            self.unique_name = name if self.param['disable_uuids'] else name + uuid.uuid4().hex
+        self.gateway_info_updates = 0
+        self.poll_master = True
+        utils.set_serialization_format(self.param['hub_serialization_format'])  # process wide
+        self.fake_master = FakeMaster().start()
+        self.local_master = master_api.LocalMaster(master_uri=self.fake_master.uri, use_connection_cache=False)
+        self.hub_manager = hub_manager.HubManager(
+            hub_whitelist=self.param['hub_whitelist'],
+            hub_blacklist=self.param['hub_blacklist'],
+            heartbeat_thread=False)
+        self.gateway = gateway.Gateway(self.hub_manager, self.param, self.unique_name, self._publish_gateway_info,
+                                       local_master=self.local_master)
+        try:
+            self.connect(hub_address)
+        except RuntimeError:
+            self.fake_master.shutdown()
+            raise
+
+    def connect(self, hub_address):
+        '''
+          Register on a(nother) hub.
+
+          @param hub_address : (ip, port) of the hub
+          @type (str, int)
+
+          @raise RuntimeError if registration failed
+        '''
+        (ip, port) = hub_address
+        hub = gateway_hub.GatewayHub(ip, port, self.param['hub_whitelist'], self.param['hub_blacklist'])
+        hub, error_code, error_code_str = self.hub_manager.connect_to_hub(
+            hub,
+            self.param['firewall'],
+            self.unique_name,
+            self.gateway.disengage_hub,
+            self.gateway.ip,
+            self.gateway.public_interface.getConnections())
+        if hub is None:
+            raise RuntimeError("virtual gateway failed to register with the hub [%s][%s:%s][%s][%s]" %
+                               (self.name, ip, port, error_code, error_code_str))
+
+    def _publish_gateway_info(self):
+        self.gateway_info_updates += 1
+
+    def step(self):
+        '''
+          Pick up the current state of the fake master (if polling), then run
+          a single iteration of the gateway loop.
+        '''
+        if self.poll_master:
+            self.local_master.refresh_connections()
+        self.gateway.spin_once()
+
+    def shutdown(self):
+        self.hub_manager.shutdown()
+        self.fake_master.shutdown()
+
+    ##########################################################################
+    # Requests
+    ##########################################################################
+
+    def advertise(self, name, connection_type, node=''):
+        return self.gateway.ros_service_advertise(
+            gateway_srvs.AdvertiseRequest(cancel=False, rules=[gateway_msgs.Rule(connection_type, name, node)]))
+
+    def advertise_all(self, blacklist=[]):
+        return self.gateway.ros_service_advertise_all(gateway_srvs.AdvertiseAllRequest(blacklist=blacklist, cancel=False))
+
+    def flip(self, remote_gateway, name, connection_type, node=''):
+        return self.gateway.ros_service_flip(gateway_srvs.RemoteRequest(
+            cancel=False, remotes=[gateway_msgs.RemoteRule(remote_gateway, gateway_msgs.Rule(connection_type, name, node))]))
+
+    def flip_all(self, remote_gateway, blacklist=[]):
+        return self.gateway.ros_service_flip_all(
+            gateway_srvs.RemoteAllRequest(gateway=remote_gateway, blacklist=blacklist, cancel=False))
+
+    def pull(self, remote_gateway, name, connection_type, node=''):
+        return self.gateway.ros_service_pull(gateway_srvs.RemoteRequest(
+            cancel=False, remotes=[gateway_msgs.RemoteRule(remote_gateway, gateway_msgs.Rule(connection_type, name, node))]))
+
+    ##########################################################################
+    # State
+    ##########################################################################
+
+    def flip_status(self, remote_gateway, name, connection_type):
+        '''
+          @return status of the flip of this connection to the remote gateway, None if not (yet) flipped
+          @rtype gateway_msgs.RemoteRuleWithStatus.XXX or None
+        '''
+        for flip in self.gateway.flipped_interface.get_flipped_connections():
+            if (flip.remote_rule.gateway == remote_gateway and
+                    flip.remote_rule.rule.name == name and
+                    flip.remote_rule.rule.type == connection_type):
+                return flip.status
+        return None
+
+    def is_flipped(self, remote_gateway, name, connection_type):
+        return self.flip_status(remote_gateway, name, connection_type) == gateway_msgs.RemoteRuleWithStatus.ACCEPTED
+
+    def is_pulled(self, remote_gateway, name, connection_type):
+        '''
+          @return whether the connection from the remote gateway is registered on the local (fake) master
+          @rtype bool
+        '''
+        for registration in self.gateway.pulled_interface.registrations.values():
+            if (registration.remote_gateway == remote_gateway and
+                    registration.connection.rule.name == name and
+                    registration.connection.rule.type == connection_type):
+                return True
+        return False
+
+##############################################################################
+# Driver
+##############################################################################
+
+Convergence = collections.namedtuple(
+    'Convergence', 'converged iterations virtual_time cpu_time hub_round_trips hub_commands master_calls')
+
+
+class VirtualTimeDriver(object):
+
+    '''
+      Steps a small network of gateways on a single in-memory hub under a
+      virtual clock. One iteration steps every gateway once (in the order
+      they were added), heartbeats them and then advances the clock by the
+      spin loop period, so convergence can be measured in iterations and
+      operations instead of minutes of wall time:
+
+        driver = VirtualTimeDriver(round_trip_time=0.02)
+        robot = driver.add_gateway('robot')
+        concert = driver.add_gateway('concert', firewall=False)
+        robot.fake_master.add_publisher('/chatter', 'std_msgs/String', '/talker')
+        robot.flip(concert.unique_name, '/chatter', gateway_msgs.ConnectionType.PUBLISHER)
+        result = driver.run_until(lambda: robot.is_flipped(concert.unique_name, '/chatter', 'publisher'))
+        print(result.iterations, result.hub_round_trips)
+
+      The memory backend is installed as the hub backend until shutdown().
+    '''
+
+    def __init__(self, period=1.0, round_trip_time=0.0, jitter=0.0, seed=None,
+                 hub_address=('localhost', 6380)):
+        '''
+          @param period : virtual time per iteration, the gateway's spin loop period (sec)
+          @type float
+          @param round_trip_time : mean (virtual) round trip time to the hub (sec)
+          @type float
+          @param jitter : round trips vary uniformly by up to +/- this much (sec)
+          @type float
+          @param seed : seed the jitter for repeatable runs
+          @type int
+        '''
+        self.period = period
+        self.clock = VirtualClock()
+        latency = rocon_hub_client.LatencyModel(round_trip_time, jitter, seed, sleep=self.clock.sleep)
+        self.backend = rocon_hub_client.MemoryBackend(latency=latency, clock=self.clock.time)
+        self.hub_address = hub_address
+        self.hub = self.backend.add_server(hub_address[0], hub_address[1], 'Virtual Hub')
+        rocon_hub_client.set_backend(self.backend)
+        self.gateways = []
+        self.iterations = 0
+
+    def add_gateway(self, name, **param_overrides):
+        '''
+          @rtype VirtualGateway
+        '''
+        virtual_gateway = VirtualGateway(name, self.hub_address, **param_overrides)
+        self.gateways.append(virtual_gateway)
+        return virtual_gateway
+
+    def step(self):
+        for virtual_gateway in self.gateways:
+            virtual_gateway.step()
+        for virtual_gateway in self.gateways:
+            virtual_gateway.hub_manager.heartbeat()
+        self.clock.advance(self.period)
+        self.iterations += 1
+
+    def run_until(self, condition, max_iterations=100):
+        '''
+          Step until the condition holds (checked before every iteration).
+
+          @param condition : e.g. a flip is accepted, a pull registered
+          @type func() -> bool
+          @param max_iterations : give up after this many iterations
+          @type int
+
+          @return iterations, virtual and cpu time and hub and master operations it took
+          @rtype Convergence
+        '''
+        start_iterations = self.iterations
+        start_virtual_time = self.clock.time()
+        self.hub.reset_statistics()
+        for virtual_gateway in self.gateways:
+            virtual_gateway.fake_master.reset_statistics()
+        start_cpu_time = time.clock()
+        converged = condition()
+        while not converged and self.iterations - start_iterations < max_iterations:
+            self.step()
+            converged = condition()
+        cpu_time = time.clock() - start_cpu_time
+        return Convergence(
+            converged=converged,
+            iterations=self.iterations - start_iterations,
+            virtual_time=self.clock.time() - start_virtual_time,
+            cpu_time=cpu_time,
+            hub_round_trips=self.hub.round_trips,
+            hub_commands=self.hub.commands_processed,
+            master_calls=sum(sum(virtual_gateway.fake_master.statistics().values())
+                             for virtual_gateway in self.gateways))
+
+    def shutdown(self):
+        for virtual_gateway in self.gateways:
+            virtual_gateway.shutdown()
+        self.gateways = []
+        rocon_hub_client.set_backend(None)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import unittest
+
+import gateway_msgs.msg as gateway_msgs
+from rocon_gateway import change_feed
+from rocon_gateway import public_interface
+from rocon_gateway import utils
+
+##############################################################################
+# Helpers
+##############################################################################
+
+
+def create_connection(name, connection_type=gateway_msgs.ConnectionType.PUBLISHER, node='/talker'):
+    return utils.Connection(gateway_msgs.Rule(connection_type, name, node), 'std_msgs/String', 'std_msgs/String',
+                            'http://localhost:11311/')
+
+
+def create_changes(added=(), removed=()):
+    '''
+      @return connection type keyed (added, removed) dictionaries of sets
+    '''
+    added_dict = utils.create_empty_connection_type_dictionary(set)
+    removed_dict = utils.create_empty_connection_type_dictionary(set)
+    for connection in added:
+        added_dict[connection.rule.type].add(connection)
+    for connection in removed:
+        removed_dict[connection.rule.type].add(connection)
+    return added_dict, removed_dict
+
+##############################################################################
+# Tests
+##############################################################################
+
+
+class TestConnectionChangeFeed(unittest.TestCase):
+
+    def test_empty_batches_are_dropped(self):
+        feed = change_feed.ConnectionChangeFeed()
+        self.assertEqual(feed.publish(*create_changes()), None)
+        self.assertEqual(feed.sequence, 0)
+        self.assertEqual(feed.drain(0), (0, [], False))
+
+    def test_drain_since(self):
+        feed = change_feed.ConnectionChangeFeed()
+        first = create_connection('/first')
+        second = create_connection('/second')
+        self.assertEqual(feed.publish(*create_changes(added=[first])), 1)
+        self.assertEqual(feed.publish(*create_changes(added=[second])), 2)
+        (sequence, changes, resync) = feed.drain(0)
+        self.assertEqual(sequence, 2)
+        self.assertEqual([change.sequence for change in changes], [1, 2])
+        self.assertFalse(resync)
+        (sequence, changes, resync) = feed.drain(1)
+        self.assertEqual([change.sequence for change in changes], [2])
+        self.assertEqual(changes[0].added[gateway_msgs.ConnectionType.PUBLISHER], set([second]))
+        self.assertFalse(resync)
+        self.assertEqual(feed.drain(2), (2, [], False))
+
+    def test_overflow_flags_a_resync(self):
+        feed = change_feed.ConnectionChangeFeed(max_length=2)
+        for i in range(4):
+            feed.publish(*create_changes(added=[create_connection('/topic_%d' % i)]))
+        (sequence, changes, resync) = feed.drain(0)
+        self.assertEqual(sequence, 4)
+        self.assertEqual([change.sequence for change in changes], [3, 4])
+        self.assertTrue(resync)
+        # only just caught up with what is still queued
+        (sequence, changes, resync) = feed.drain(2)
+        self.assertEqual([change.sequence for change in changes], [3, 4])
+        self.assertFalse(resync)
+
+
+class TestMergeChanges(unittest.TestCase):
+
+    def test_connections_that_came_and_went_cancel_out(self):
+        feed = change_feed.ConnectionChangeFeed()
+        transient = create_connection('/transient')
+        gone = create_connection('/gone', gateway_msgs.ConnectionType.SERVICE)
+        stays = create_connection('/stays', gateway_msgs.ConnectionType.SUBSCRIBER)
+        feed.publish(*create_changes(added=[transient, stays]))
+        feed.publish(*create_changes(removed=[transient, gone]))
+        (unused_sequence, changes, unused_resync) = feed.drain(0)
+        added, removed = change_feed.merge_changes(changes)
+        self.assertEqual(added[gateway_msgs.ConnectionType.SUBSCRIBER], set([stays]))
+        self.assertEqual(added[gateway_msgs.ConnectionType.PUBLISHER], set())
+        self.assertEqual(removed[gateway_msgs.ConnectionType.PUBLISHER], set())
+        self.assertEqual(removed[gateway_msgs.ConnectionType.SERVICE], set([gone]))
+
+    def test_removed_then_added_again(self):
+        connection = create_connection('/restarted')
+        changes = [change_feed.ConnectionChange(1, *create_changes(removed=[connection])),
+                   change_feed.ConnectionChange(2, *create_changes(added=[connection]))]
+        added, removed = change_feed.merge_changes(changes)
+        self.assertFalse(any(added.values()))
+        self.assertFalse(any(removed.values()))
+
+
+class TestPublicInterfaceChanges(unittest.TestCase):
+
+    '''
+      The public interface following the change feed has to end up where
+      matching the whole connection state would.
+    '''
+
+    def setUp(self):
+        self.interface = public_interface.PublicInterface(utils.create_empty_connection_type_dictionary(),
+                                                          utils.create_empty_connection_type_dictionary())
+        self.interface.advertise_all([gateway_msgs.Rule(gateway_msgs.ConnectionType.PUBLISHER, '/private', '.*')])
+        self.lookups_fail = set()
+
+    def generate(self, connection_type, name, node):
+        if name in self.lookups_fail:
+            return None
+        return create_connection(name, connection_type, node)
+
+    def public_names(self):
+        connections = self.interface.getConnections()[gateway_msgs.ConnectionType.PUBLISHER]
+        return sorted(connection.rule.name for connection in connections)
+
+    def test_added_and_removed(self):
+        chatter = create_connection('/chatter')
+        private = create_connection('/private')
+        new, lost = self.interface.update_changes(*(create_changes(added=[chatter, private]) + (self.generate,)))
+        self.assertEqual([c.rule.name for c in new[gateway_msgs.ConnectionType.PUBLISHER]], ['/chatter'])
+        self.assertEqual(self.public_names(), ['/chatter'])
+        new, lost = self.interface.update_changes(*(create_changes(removed=[chatter, private]) + (self.generate,)))
+        self.assertEqual([c.rule.name for c in lost[gateway_msgs.ConnectionType.PUBLISHER]], ['/chatter'])
+        self.assertEqual(self.public_names(), [])
+
+    def test_failed_lookups_are_retried(self):
+        self.lookups_fail.add('/slow')
+        slow = create_connection('/slow')
+        self.interface.update_changes(*(create_changes(added=[slow]) + (self.generate,)))
+        self.assertEqual(self.public_names(), [])
+        self.lookups_fail.clear()
+        self.interface.update_changes(*(create_changes() + (self.generate,)))
+        self.assertEqual(self.public_names(), ['/slow'])
+
+    def test_rule_changes_bump_the_rules_version(self):
+        version = self.interface.rules_version
+        self.interface.unadvertise_all()
+        self.assertNotEqual(self.interface.rules_version, version)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import time
+import unittest
+
+import rocon_hub_client
+import rocon_python_redis as redis
+from rocon_gateway import gateway_hub
+from rocon_hub_client.circuit_breaker import CircuitBreaker, CircuitBreakerRedis
+
+##############################################################################
+# Helpers
+##############################################################################
+
+
+class Probe(object):
+
+    def __init__(self):
+        self.reachable = False
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if not self.reachable:
+            raise redis.exceptions.ConnectionError("unreachable")
+
+
+def wait_for(condition, timeout=2.0):
+    end_time = time.time() + timeout
+    while not condition() and time.time() < end_time:
+        time.sleep(0.005)
+    return condition()
+
+
+class FakeHub(object):
+
+    '''
+      Just enough of a gateway hub for the heartbeat scheduler.
+    '''
+
+    def __init__(self, circuit_breaker=None, alive=True, uri='localhost:6380', delay=0.0):
+        self.uri = uri
+        self.circuit_breaker = circuit_breaker
+        self.alive = alive
+        self.delay = delay
+        self.heartbeats = 0
+        self.lost = False
+
+    def heartbeat(self):
+        self.heartbeats += 1
+        time.sleep(self.delay)
+        if not self.alive and self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure("timed out")
+        return self.alive, "" if self.alive else "timed out"
+
+    def _hub_connection_lost_hook(self):
+        self.lost = True
+
+##############################################################################
+# Tests
+##############################################################################
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.probe = Probe()
+        self.circuit_breaker = CircuitBreaker('localhost:6380', self.probe, slow_call_duration=0.1,
+                                              slow_call_threshold=2, probe_period=0.01)
+
+    def tearDown(self):
+        self.circuit_breaker.shutdown()
+
+    def test_failure_opens_until_the_probe_succeeds(self):
+        self.assertTrue(self.circuit_breaker.allow())
+        self.assertEqual(self.circuit_breaker.open_duration(), 0.0)
+        self.circuit_breaker.record_failure(redis.exceptions.ConnectionError("timed out"))
+        self.assertFalse(self.circuit_breaker.allow())
+        self.assertTrue(wait_for(lambda: self.probe.calls >= 3))
+        self.assertNotEqual(self.circuit_breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.circuit_breaker.open_duration() > 0.0)
+        self.probe.reachable = True
+        self.assertTrue(wait_for(lambda: self.circuit_breaker.state == CircuitBreaker.CLOSED))
+        self.assertTrue(self.circuit_breaker.allow())
+        self.assertEqual(self.circuit_breaker.open_duration(), 0.0)
+
+    def test_slow_calls_open_once_they_pile_up(self):
+        self.circuit_breaker.record_success(0.5)
+        self.circuit_breaker.record_success(0.01)  # resets the count
+        self.circuit_breaker.record_success(0.5)
+        self.assertTrue(self.circuit_breaker.allow())
+        self.circuit_breaker.record_success(0.5)
+        self.assertFalse(self.circuit_breaker.allow())
+
+    def test_no_probing_after_shutdown(self):
+        self.circuit_breaker.shutdown()
+        self.circuit_breaker.record_failure("timed out")
+        time.sleep(0.05)
+        self.assertEqual(self.probe.calls, 0)
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.OPEN)
+
+
+class TestCircuitBreakerRedis(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = rocon_hub_client.MemoryBackend()
+        self.server = self.backend.add_server('localhost', 6380, 'Test Hub')
+        self.probe = Probe()
+        self.circuit_breaker = CircuitBreaker('localhost:6380', self.probe, probe_period=60.0)
+        client = self.backend.create_client(self.backend.create_connection_pool('localhost', 6380))
+        self.redis_server = CircuitBreakerRedis(client, self.circuit_breaker)
+
+    def tearDown(self):
+        self.circuit_breaker.shutdown()
+
+    def test_fails_fast_while_open(self):
+        self.redis_server.set('rocon:key', 'value')
+        self.assertEqual(self.redis_server.get('rocon:key'), 'value')
+        self.backend.remove_server('localhost', 6380)
+        self.assertRaises(redis.exceptions.ConnectionError, self.redis_server.get, 'rocon:key')
+        self.assertFalse(self.circuit_breaker.allow())
+        round_trips = self.server.round_trips
+        self.assertRaises(redis.exceptions.ConnectionError, self.redis_server.get, 'rocon:key')
+        self.assertEqual(self.server.round_trips, round_trips)
+
+    def test_pipelines_go_through_the_breaker(self):
+        with self.redis_server.pipeline() as pipe:
+            # with and chained commands must not hand out the underlying pipeline
+            self.assertTrue(pipe.set('rocon:key', 'value').get('rocon:key') is pipe)
+            self.assertEqual(len(pipe), 2)
+            self.assertEqual(pipe.execute(), [True, 'value'])
+        self.backend.remove_server('localhost', 6380)
+        pipe = self.redis_server.pipeline()
+        pipe.get('rocon:key')
+        self.assertRaises(redis.exceptions.ConnectionError, pipe.execute)
+        self.assertFalse(self.circuit_breaker.allow())
+        pipe.get('rocon:key')
+        self.assertRaises(redis.exceptions.ConnectionError, pipe.execute)
+
+
+class TestHeartbeatScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.circuit_breaker = CircuitBreaker('localhost:6380', Probe(), probe_period=60.0)
+        self.scheduler = gateway_hub.HeartbeatScheduler(unresponsive_timeout=0.05)
+
+    def tearDown(self):
+        self.circuit_breaker.shutdown()
+        self.scheduler.shutdown()
+
+    def test_open_breaker_skips_beats(self):
+        hub = FakeHub(self.circuit_breaker, alive=False)
+        self.scheduler.add(hub)
+        self.scheduler.beat()
+        self.assertFalse(hub.lost)
+        self.scheduler.beat()
+        self.assertEqual(hub.heartbeats, 1)  # failing fast, not tried again
+        self.assertFalse(hub.lost)
+        time.sleep(0.06)
+        self.scheduler.beat()
+        self.assertTrue(hub.lost)
+
+    def test_unregistered_is_dead(self):
+        # reachable (breaker closed), but the gateway isn't registered any more
+        hub = FakeHub(self.circuit_breaker, alive=False)
+        hub.circuit_breaker = None
+        self.scheduler.add(hub)
+        self.scheduler.beat()
+        self.assertTrue(hub.lost)
+        self.scheduler.beat()
+        self.assertEqual(hub.heartbeats, 1)
+
+    def test_slow_hubs_dont_hold_up_the_others(self):
+        self.scheduler.period = 0.1
+        slow_hub = FakeHub(uri='slow:6380', delay=0.5)
+        hub = FakeHub(uri='localhost:6380')
+        self.scheduler.add(slow_hub)
+        self.scheduler.add(hub)
+        start_time = time.time()
+        self.scheduler.beat()
+        self.scheduler.beat()
+        self.assertTrue(time.time() - start_time < 0.4)
+        self.assertEqual(hub.heartbeats, 2)
+        self.assertEqual(slow_hub.heartbeats, 1)  # still busy with the first beat
+
+
+if __name__ == '__main__':
+    unittest.main()
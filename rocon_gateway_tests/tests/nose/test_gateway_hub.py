@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import unittest
+
+import rocon_hub_client
+from rocon_gateway import gateway_hub
+from rocon_hub_client import hub_api
+
+##############################################################################
+# Tests
+##############################################################################
+
+
+class TestUnregisterNamedGateway(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = rocon_hub_client.MemoryBackend()
+        self.server = self.backend.add_server('localhost', 6380, 'Test Hub')
+        rocon_hub_client.set_backend(self.backend)
+        self.hub = gateway_hub.GatewayHub('localhost', 6380, [], [])
+        self.server.set('rocon:concert:ip', '192.168.1.2')  # someone else's
+
+    def tearDown(self):
+        rocon_hub_client.set_backend(None)
+
+    def gateway_keys(self, unique_gateway_name):
+        return sorted(self.server.keys(hub_api.create_rocon_key(unique_gateway_name) + ':*'))
+
+    def test_registered_keys_are_removed(self):
+        self.hub.register_gateway(False, 'robot', None, '192.168.1.3')
+        self.server.sadd(hub_api.create_rocon_gateway_key('robot', 'flips'), 'flip')
+        self.assertTrue(self.gateway_keys('robot'))
+        self.hub.unregister_named_gateway('rocon:robot')
+        self.assertEqual(self.gateway_keys('robot'), [])
+        self.assertFalse(self.server.sismember('rocon:hub:gatewaylist', 'rocon:robot'))
+        self.assertEqual(self.server.get('rocon:concert:ip'), '192.168.1.2')
+
+    def test_gateways_without_a_registry_are_scanned_for(self):
+        # what a gateway from before the key registry leaves on the hub
+        self.server.sadd('rocon:hub:gatewaylist', 'rocon:robot')
+        for suffix in ['ip', 'firewall', 'public_key', 'latency:avg']:
+            self.server.set(hub_api.create_rocon_gateway_key('robot', suffix), 'value')
+        self.server.sadd(hub_api.create_rocon_gateway_key('robot', 'advertisements'), 'advertisement')
+        self.hub.unregister_named_gateway('rocon:robot')
+        self.assertEqual(self.gateway_keys('robot'), [])
+        self.assertFalse(self.server.sismember('rocon:hub:gatewaylist', 'rocon:robot'))
+        self.assertEqual(self.server.get('rocon:concert:ip'), '192.168.1.2')
+
+
+if __name__ == '__main__':
+    unittest.main()
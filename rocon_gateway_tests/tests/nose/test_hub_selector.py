@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import unittest
+
+from rocon_gateway import gateway_hub
+from rocon_gateway import hub_selector
+
+##############################################################################
+# Helpers
+##############################################################################
+
+
+class FakeCircuitBreaker(object):
+
+    def __init__(self):
+        self.closed = True
+
+    def allow(self):
+        return self.closed
+
+
+class FakeHub(object):
+
+    '''
+      Just enough of a gateway hub for the selector.
+    '''
+
+    def __init__(self, uri, rtt=None):
+        self.uri = uri
+        self.circuit_breaker = FakeCircuitBreaker()
+        self.latency_statistics = gateway_hub.LatencyStatistics(window=1)
+        if rtt is not None:
+            self.set_rtt(rtt)
+
+    def set_rtt(self, rtt):
+        '''
+          @param rtt : round trip time (ms)
+          @type float
+        '''
+        self.latency_statistics.add(rtt / 1000.0)
+
+##############################################################################
+# Tests
+##############################################################################
+
+
+class TestHubSelector(unittest.TestCase):
+
+    def setUp(self):
+        self.selector = hub_selector.HubSelector(switch_ratio=0.7, switch_margin=2.0)
+        self.near = FakeHub('near:6380', rtt=10.0)
+        self.far = FakeHub('far:6380', rtt=50.0)
+
+    def best(self, hubs, remote_gateway='robot'):
+        return self.selector.rank(remote_gateway, hubs)[0]
+
+    def test_fastest_first(self):
+        unmeasured = FakeHub('unmeasured:6380')
+        ranked = self.selector.rank('robot', [unmeasured, self.far, self.near])
+        self.assertEqual([hub.uri for hub in ranked], ['near:6380', 'far:6380', 'unmeasured:6380'])
+
+    def test_sticks_through_jitter(self):
+        self.assertTrue(self.best([self.near, self.far]) is self.near)
+        # faster, but not by a clear margin
+        self.far.set_rtt(8.0)
+        self.assertTrue(self.best([self.near, self.far]) is self.near)
+        # the ordering of the others still follows the rtt
+        self.assertEqual([hub.uri for hub in self.selector.rank('robot', [self.near, self.far])],
+                         ['near:6380', 'far:6380'])
+        # a fresh remote gateway has no preference yet
+        self.assertTrue(self.best([self.near, self.far], 'concert') is self.far)
+
+    def test_switches_when_clearly_faster(self):
+        self.assertTrue(self.best([self.near, self.far]) is self.near)
+        self.far.set_rtt(5.0)
+        self.assertTrue(self.best([self.near, self.far]) is self.far)
+        # and sticks with the new one
+        self.far.set_rtt(9.0)
+        self.assertTrue(self.best([self.near, self.far]) is self.far)
+
+    def test_small_rtts_need_the_margin(self):
+        self.near.set_rtt(2.0)
+        self.far.set_rtt(3.0)
+        self.assertTrue(self.best([self.near, self.far]) is self.near)
+        self.near.set_rtt(2.5)
+        self.far.set_rtt(1.0)  # below the ratio, but only 1.5ms faster
+        self.assertTrue(self.best([self.near, self.far]) is self.near)
+
+    def test_switches_away_from_unhealthy(self):
+        self.assertTrue(self.best([self.near, self.far]) is self.near)
+        self.near.circuit_breaker.closed = False
+        self.assertTrue(self.best([self.near, self.far]) is self.far)
+        # recovering doesn't switch back unless clearly faster
+        self.near.circuit_breaker.closed = True
+        self.far.set_rtt(12.0)
+        self.assertTrue(self.best([self.near, self.far]) is self.far)
+
+    def test_switches_when_current_disappears(self):
+        self.assertTrue(self.best([self.near, self.far]) is self.near)
+        other = FakeHub('other:6380', rtt=45.0)
+        self.assertTrue(self.best([self.far, other]) is other)
+        other.set_rtt(48.0)
+        self.far.set_rtt(45.0)
+        self.assertTrue(self.best([self.far, other]) is other)
+
+    def test_partial_rankings_keep_the_preference(self):
+        middle = FakeHub('middle:6380', rtt=40.0)
+        hubs = [self.near, middle, self.far]
+        self.assertTrue(self.best(hubs) is self.near)
+        # the preferred hub didn't answer this time round
+        ranked = self.selector.rank('robot', [middle, self.far], update_preference=False)
+        self.assertEqual([hub.uri for hub in ranked], ['middle:6380', 'far:6380'])
+        # and is still preferred once it does, though the others are now faster
+        middle.set_rtt(8.0)
+        self.far.set_rtt(9.0)
+        self.assertTrue(self.best(hubs) is self.near)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import unittest
+
+import rocon_hub_client
+import rocon_python_redis as redis
+from rocon_hub_client.memory_backend import LatencyModel
+
+##############################################################################
+# Helpers
+##############################################################################
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+##############################################################################
+# Tests
+##############################################################################
+
+
+class TestMemoryBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.backend = rocon_hub_client.MemoryBackend(clock=self.clock)
+        self.server = self.backend.add_server('localhost', 6380, 'Test Hub')
+        self.redis_server = self.backend.create_client(self.backend.create_connection_pool('localhost', 6380))
+
+    def test_strings(self):
+        self.assertEqual(self.redis_server.get('rocon:key'), None)
+        self.assertTrue(self.redis_server.set('rocon:key', 42))
+        self.assertEqual(self.redis_server.get('rocon:key'), '42')
+        self.redis_server.set('rocon:key', u'/t\xe4lker')
+        self.assertEqual(self.redis_server.get('rocon:key'), '/t\xc3\xa4lker')
+        self.assertTrue(self.redis_server.exists('rocon:key'))
+        self.assertEqual(self.redis_server.delete('rocon:key', 'rocon:missing'), 1)
+        self.assertFalse(self.redis_server.exists('rocon:key'))
+
+    def test_sets(self):
+        self.assertEqual(self.redis_server.sadd('rocon:set', 'a', 'b', 'a'), 2)
+        self.assertEqual(self.redis_server.sadd('rocon:set', 'b', 'c'), 1)
+        self.assertEqual(self.redis_server.smembers('rocon:set'), set(['a', 'b', 'c']))
+        self.assertTrue(self.redis_server.sismember('rocon:set', 'a'))
+        self.assertEqual(self.redis_server.scard('rocon:set'), 3)
+        self.assertEqual(self.redis_server.srem('rocon:set', 'a', 'missing'), 1)
+        self.redis_server.srem('rocon:set', 'b', 'c')
+        # emptied sets go away, like in redis
+        self.assertFalse(self.redis_server.exists('rocon:set'))
+        self.assertEqual(self.redis_server.smembers('rocon:set'), set())
+
+    def test_sorted_sets(self):
+        self.assertEqual(self.redis_server.zadd('rocon:zset', 'a', 3, b=1, c=2), 3)
+        self.assertEqual(self.redis_server.zadd('rocon:zset', a=0.5), 0)
+        self.assertEqual(self.redis_server.zscore('rocon:zset', 'a'), 0.5)
+        self.assertEqual(self.redis_server.zcard('rocon:zset'), 3)
+        self.assertEqual(self.redis_server.zrangebyscore('rocon:zset', '-inf', '+inf'), ['a', 'b', 'c'])
+        self.assertEqual(self.redis_server.zrangebyscore('rocon:zset', 1, 2, withscores=True), [('b', 1.0), ('c', 2.0)])
+        self.assertEqual(self.redis_server.zrangebyscore('rocon:zset', '-inf', '+inf', start=1, num=1), ['b'])
+        self.assertEqual(self.redis_server.zrem('rocon:zset', 'a', 'b', 'c'), 3)
+        self.assertFalse(self.redis_server.exists('rocon:zset'))
+
+    def test_wrong_type(self):
+        self.redis_server.set('rocon:key', 'value')
+        self.redis_server.sadd('rocon:set', 'a')
+        self.assertRaises(redis.exceptions.ResponseError, self.redis_server.sadd, 'rocon:key', 'a')
+        self.assertRaises(redis.exceptions.ResponseError, self.redis_server.zadd, 'rocon:set', a=1)
+        self.assertRaises(redis.exceptions.ResponseError, self.redis_server.get, 'rocon:set')
+        # set overwrites whatever was there
+        self.redis_server.set('rocon:set', 'value')
+        self.assertEqual(self.redis_server.get('rocon:set'), 'value')
+
+    def test_expiry(self):
+        self.assertEqual(self.redis_server.ttl('rocon:key'), -2)
+        self.assertFalse(self.redis_server.expire('rocon:key', 10))
+        self.redis_server.set('rocon:key', 'value')
+        self.assertEqual(self.redis_server.ttl('rocon:key'), -1)
+        self.assertTrue(self.redis_server.expire('rocon:key', 10))
+        self.clock.now += 4.0
+        self.assertEqual(self.redis_server.ttl('rocon:key'), 6)
+        self.clock.now += 6.0
+        self.assertEqual(self.redis_server.get('rocon:key'), None)
+        self.assertEqual(self.redis_server.ttl('rocon:key'), -2)
+        self.assertEqual(self.redis_server.keys('rocon:key*'), [])
+
+    def test_set_clears_the_expiry(self):
+        self.redis_server.set('rocon:key', 'value')
+        self.redis_server.expire('rocon:key', 10)
+        self.redis_server.set('rocon:key', 'other')
+        self.assertEqual(self.redis_server.ttl('rocon:key'), -1)
+        self.clock.now += 20.0
+        self.assertEqual(self.redis_server.get('rocon:key'), 'other')
+
+    def test_scan(self):
+        for key in ['rocon:robot:a', 'rocon:robot:b', 'rocon:concert:c']:
+            self.redis_server.set(key, 'value')
+        (cursor, keys) = self.redis_server.scan(0, match='rocon:robot:*')
+        self.assertEqual((cursor, sorted(keys)), ('0', ['rocon:robot:a', 'rocon:robot:b']))
+        (cursor, keys) = self.redis_server.execute_command('SCAN', 0, 'MATCH', 'rocon:robot:*', 'COUNT', 1000)
+        self.assertEqual((cursor, sorted(keys)), ('0', ['rocon:robot:a', 'rocon:robot:b']))
+        self.assertEqual(self.redis_server.execute_command('UNLINK', 'rocon:robot:a', 'rocon:robot:b'), 2)
+        self.assertEqual(sorted(self.redis_server.keys('rocon:*')), ['rocon:concert:c', 'rocon:hub:name'])
+
+    def test_unknown_commands(self):
+        self.assertRaises(redis.exceptions.ResponseError, self.redis_server.execute_command, 'FLUSHALL')
+        self.assertRaises(redis.exceptions.ResponseError, self.redis_server.hgetall, 'rocon:hash')
+
+    def test_pipelines_are_one_round_trip(self):
+        self.server.reset_statistics()
+        pipe = self.redis_server.pipeline()
+        pipe.set('rocon:key', 'value').expire('rocon:key', 10)
+        pipe.sadd('rocon:set', 'a')
+        pipe.ttl('rocon:key')
+        self.assertEqual(len(pipe), 4)
+        self.assertEqual(pipe.execute(), [True, True, 1, 10])
+        self.assertEqual(len(pipe), 0)
+        self.assertEqual(pipe.execute(), [])
+        self.assertEqual((self.server.round_trips, self.server.commands_processed), (1, 4))
+        self.server.reset_statistics()
+        self.assertEqual((self.server.round_trips, self.server.commands_processed), (0, 0))
+
+    def test_pipeline_errors_come_after_everything_ran(self):
+        self.redis_server.set('rocon:key', 'value')
+        pipe = self.redis_server.pipeline()
+        pipe.sadd('rocon:key', 'a')
+        pipe.set('rocon:other', 'value')
+        self.assertRaises(redis.exceptions.ResponseError, pipe.execute)
+        self.assertEqual(self.redis_server.get('rocon:other'), 'value')
+        pipe.sadd('rocon:key', 'a')
+        pipe.get('rocon:other')
+        results = pipe.execute(raise_on_error=False)
+        self.assertTrue(isinstance(results[0], redis.exceptions.ResponseError))
+        self.assertEqual(results[1], 'value')
+
+    def test_removed_servers_refuse_connections(self):
+        self.redis_server.set('rocon:key', 'value')
+        self.backend.remove_server('localhost', 6380)
+        self.assertRaises(redis.exceptions.ConnectionError, self.redis_server.get, 'rocon:key')
+        pipe = self.redis_server.pipeline()
+        pipe.get('rocon:key')
+        self.assertRaises(redis.exceptions.ConnectionError, pipe.execute)
+        unknown = self.backend.create_client(self.backend.create_connection_pool('localhost', 6381))
+        self.assertRaises(redis.exceptions.ConnectionError, unknown.ping)
+
+
+class TestLatencyModel(unittest.TestCase):
+
+    def test_every_round_trip_waits(self):
+        clock = FakeClock()
+        backend = rocon_hub_client.MemoryBackend(latency=LatencyModel(round_trip_time=0.05, sleep=clock.sleep),
+                                                 clock=clock)
+        backend.add_server('localhost', 6380)
+        redis_server = backend.create_client(backend.create_connection_pool('localhost', 6380))
+        start_time = clock.now
+        redis_server.set('rocon:key', 'value')
+        pipe = redis_server.pipeline()
+        pipe.get('rocon:key').get('rocon:key')
+        pipe.execute()
+        self.assertAlmostEqual(clock.now - start_time, 0.1)
+
+    def test_seeded_jitter_repeats(self):
+        delays = []
+        for unused_i in range(2):
+            latency = LatencyModel(round_trip_time=0.05, jitter=0.02, seed=7)
+            delays.append([latency.delay() for unused_j in range(10)])
+        self.assertEqual(delays[0], delays[1])
+        self.assertTrue(all(0.03 <= delay <= 0.07 for delay in delays[0]))
+        # jitter never makes for a negative delay
+        latency = LatencyModel(round_trip_time=0.01, jitter=0.05, seed=7)
+        self.assertTrue(all(latency.delay() >= 0.0 for unused_i in range(100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
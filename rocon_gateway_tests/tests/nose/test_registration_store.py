@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import unittest
+
+import gateway_msgs.msg as gateway_msgs
+from rocon_gateway import registration_store
+from rocon_gateway import utils
+
+##############################################################################
+# Helpers
+##############################################################################
+
+
+def create_registration(name, remote_gateway='robot', local_node=None, connection_type=gateway_msgs.ConnectionType.PUBLISHER,
+                        xmlrpc_uri='http://robot:40000/'):
+    connection = utils.Connection(gateway_msgs.Rule(connection_type, name, '/talker'), 'std_msgs/String',
+                                  'std_msgs/String', xmlrpc_uri)
+    return utils.Registration(connection, remote_gateway, local_node)
+
+##############################################################################
+# Tests
+##############################################################################
+
+
+class TestRegistrationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = registration_store.RegistrationStore()
+
+    def test_find(self):
+        registration = create_registration('/chatter', local_node='/robot_chatter_a1')
+        self.assertTrue(self.store.add(registration))
+        self.assertEqual(self.store.find('robot', gateway_msgs.ConnectionType.PUBLISHER, '/chatter', '/talker'),
+                         registration)
+        self.assertEqual(self.store.find('concert', gateway_msgs.ConnectionType.PUBLISHER, '/chatter', '/talker'), None)
+        self.assertEqual(self.store.find_by_local_node('/robot_chatter_a1'), registration)
+        self.assertEqual(self.store[gateway_msgs.ConnectionType.PUBLISHER], [registration])
+        self.assertEqual(self.store[gateway_msgs.ConnectionType.SUBSCRIBER], [])
+        self.assertEqual(len(self.store), 1)
+
+    def test_duplicates_are_refused(self):
+        original = create_registration('/chatter', local_node='/robot_chatter_a1')
+        duplicate = create_registration('/chatter', local_node='/robot_chatter_b2', xmlrpc_uri='http://robot:40001/')
+        self.assertTrue(self.store.add(original))
+        self.assertFalse(self.store.add(duplicate))
+        # the original is still tracked, so it can still be unregistered
+        self.assertEqual(self.store.find('robot', gateway_msgs.ConnectionType.PUBLISHER, '/chatter', '/talker'), original)
+        self.assertEqual(self.store.find_by_local_node('/robot_chatter_a1'), original)
+        self.assertEqual(self.store.find_by_local_node('/robot_chatter_b2'), None)
+        self.assertEqual(len(self.store), 1)
+
+    def test_remove(self):
+        registration = create_registration('/chatter', local_node='/robot_chatter_a1')
+        self.store.add(registration)
+        self.store.remove(registration)
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(self.store.find_by_local_node('/robot_chatter_a1'), None)
+        self.assertRaises(ValueError, self.store.remove, registration)
+
+    def test_remove_only_removes_the_stored_registration(self):
+        stored = create_registration('/chatter', local_node='/robot_chatter_a1')
+        other = create_registration('/chatter', local_node='/robot_chatter_b2', xmlrpc_uri='http://robot:40001/')
+        self.store.add(stored)
+        self.assertRaises(ValueError, self.store.remove, other)
+        self.assertEqual(len(self.store), 1)
+
+    def test_same_name_from_different_gateways(self):
+        from_robot = create_registration('/chatter', remote_gateway='robot')
+        from_concert = create_registration('/chatter', remote_gateway='concert')
+        self.assertTrue(self.store.add(from_robot))
+        self.assertTrue(self.store.add(from_concert))
+        self.assertEqual(sorted(registration.remote_gateway for registration in self.store.values()),
+                         ['concert', 'robot'])
+
+
+if __name__ == '__main__':
+    unittest.main()
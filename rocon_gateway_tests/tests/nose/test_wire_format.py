@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import cPickle as pickle
+import os
+import unittest
+
+from rocon_gateway import utils
+from rocon_gateway import wire_format
+
+##############################################################################
+# Helpers
+##############################################################################
+
+
+class Exploit(object):
+
+    '''
+      Unpickling this runs a command, the sort of thing a hostile hub entry could hold.
+    '''
+
+    def __reduce__(self):
+        return (os.system, ('true',))
+
+##############################################################################
+# Tests
+##############################################################################
+
+
+class TestWireFormat(unittest.TestCase):
+
+    def test_round_trip(self):
+        fields = ['publisher', '/chatter', None, '', u'/t\xe4lker']
+        data = wire_format.encode(wire_format.GENERIC, fields)
+        self.assertTrue(wire_format.is_encoded(data))
+        self.assertEqual(wire_format.decode(data), (wire_format.GENERIC, ['publisher', '/chatter', None, '',
+                                                                         '/t\xc3\xa4lker']))
+        self.assertEqual(wire_format.decode(wire_format.encode(wire_format.GENERIC, [])), (wire_format.GENERIC, []))
+
+    def test_schemas_fix_the_field_count(self):
+        fields = ['/gateway', '/chatter', 'publisher', '/talker']
+        self.assertEqual(wire_format.decode(wire_format.encode(wire_format.DETAILS, fields)),
+                         (wire_format.DETAILS, fields))
+        self.assertRaises(ValueError, wire_format.encode, wire_format.DETAILS, fields[:3])
+        # a corrupt field count
+        data = wire_format.encode(wire_format.GENERIC, fields[:3])
+        self.assertRaises(ValueError, wire_format.decode, data[:2] + chr(wire_format.DETAILS) + data[3:])
+
+    def test_rejects_what_it_cant_encode(self):
+        self.assertRaises(TypeError, wire_format.encode, wire_format.GENERIC, [1])
+        self.assertRaises(ValueError, wire_format.encode, wire_format.GENERIC, ['x' * (wire_format.MAX_ENTRY_LENGTH + 1)])
+        self.assertRaises(ValueError, wire_format.encode, wire_format.GENERIC, ['x'] * (wire_format.MAX_FIELDS + 1))
+
+    def test_rejects_corrupt_entries(self):
+        data = wire_format.encode(wire_format.GENERIC, ['publisher', '/chatter'])
+        self.assertRaises(ValueError, wire_format.decode, data[:-1])
+        self.assertRaises(ValueError, wire_format.decode, data + 'x')
+        self.assertRaises(ValueError, wire_format.decode, data[:5])
+        self.assertRaises(ValueError, wire_format.decode, data[:3])
+        self.assertRaises(ValueError, wire_format.decode, wire_format.MAGIC + chr(wire_format.VERSION + 1) + data[2:])
+        self.assertRaises(ValueError, wire_format.decode, pickle.dumps(['publisher', '/chatter']))
+
+    def test_compiled_layouts(self):
+        # from the second read of a header on, entries are decoded with a compiled layout
+        fields = ['publisher', None, '/chatter', '', u'/t\xe4lker']
+        data = wire_format.encode(wire_format.GENERIC, fields)
+        expected = (wire_format.GENERIC, ['publisher', None, '/chatter', '', '/t\xc3\xa4lker'])
+        for unused_i in range(3):
+            self.assertEqual(wire_format.decode(data), expected)
+        # a different entry with the same header
+        self.assertEqual(wire_format.decode(wire_format.encode(wire_format.GENERIC, ['subscriber', None, '/chatter', '',
+                                                                                      '/listener'])),
+                         (wire_format.GENERIC, ['subscriber', None, '/chatter', '', '/listener']))
+        # decoded lists aren't shared
+        wire_format.decode(data)[1].append('x')
+        self.assertEqual(wire_format.decode(data), expected)
+        self.assertRaises(ValueError, wire_format.decode, data[:-1])
+        self.assertRaises(ValueError, wire_format.decode, data + 'x')
+
+
+class TestLegacyUnpickler(unittest.TestCase):
+
+    def test_reads_old_entries(self):
+        fields = ['publisher', '/chatter', None, u'/talker']
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            data = pickle.dumps(fields, protocol)
+            self.assertFalse(wire_format.is_encoded(data))
+            self.assertEqual(wire_format.decode_legacy(data), fields)
+
+    def test_refuses_objects(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertRaises(pickle.UnpicklingError, wire_format.decode_legacy, pickle.dumps(Exploit(), protocol))
+            self.assertRaises(pickle.UnpicklingError, wire_format.decode_legacy,
+                              pickle.dumps([set(['publisher'])], protocol))
+
+
+class TestSerialization(unittest.TestCase):
+
+    def tearDown(self):
+        utils.set_serialization_format(utils.PICKLE)
+
+    def test_writes_pickles_by_default(self):
+        data = utils.serialize(['publisher', '/chatter'], wire_format.GENERIC)
+        # what gateways older than the wire format read entries with
+        self.assertEqual(pickle.loads(data), ['publisher', '/chatter'])
+        self.assertEqual(utils.deserialize(data), ['publisher', '/chatter'])
+
+    def test_wire_format(self):
+        utils.set_serialization_format(utils.WIRE_FORMAT)
+        data = utils.serialize(['/gateway', '/chatter', 'publisher', '/talker'], wire_format.DETAILS)
+        self.assertTrue(wire_format.is_encoded(data))
+        self.assertEqual(utils.deserialize(data), ['/gateway', '/chatter', 'publisher', '/talker'])
+        self.assertRaises(ValueError, utils.set_serialization_format, 'json')
+
+    def test_bad_entries_are_dropped(self):
+        self.assertEqual(utils.deserialize(pickle.dumps(Exploit())), None)
+        self.assertEqual(utils.deserialize(wire_format.MAGIC + 'garbage'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,7 @@ import sys
 # Ros imports
 import rospy
 import std_srvs.srv as std_srvs
+from rocon_hub_client import profiler
 
 # Local imports
 from . import utils
@@ -65,5 +66,8 @@ def main():
 
     watcher_thread = watcher.WatcherThread('localhost', param['port'])
     watcher_thread.start()
+    # covers the watcher threads and the redis server's ros callbacks
+    profiling_services = profiler.ProfilingServices(param['profiling_interval'])
     rospy.spin()
+    profiling_services.shutdown()
     shutdown()
@@ -26,6 +26,7 @@ except ImportError:
     # actually unused right now while we use redis as a ros package
     sys.exit("\n[ERROR] No python-redis found - 'rosdep install rocon_hub'\n")
 import rocon_semantic_version as semantic_version
+from rocon_hub_client import hub_api
 import rocon_console.console as console
 
 from . import utils
@@ -123,17 +124,8 @@ class RedisServer:
         while count < no_attempts:
             try:
                 self._server = redis.Redis(connection_pool=pool)
-                rocon_keys = self._server.keys("rocon:*")
-                pattern = re.compile("rocon:*")
-                keys_to_delete = []
-                for key in rocon_keys:
-                    if pattern.match(key):
-                        keys_to_delete.append(key)
-                pipe = self._server.pipeline()
-                if len(keys_to_delete) != 0:
-                    pipe.delete(*keys_to_delete)  # * unpacks the list args - http://stackoverflow.com/questions/2921847/python-once-and-for-all-what-does-the-star-operator-mean-in-python
-                pipe.set("rocon:hub:name", self._parameters['name'])
-                pipe.execute()
+                self._clear_rocon_keys()
+                self._server.set("rocon:hub:name", self._parameters['name'])
                 rospy.loginfo("Hub : reset hub variables on the redis server.")
                 break
             except redis.ConnectionError:
@@ -144,21 +136,19 @@ class RedisServer:
                 else:
                     rospy.rostime.wallsleep(0.1)
 
+    def _clear_rocon_keys(self):
+        '''
+          Delete all rocon:xxx variables, incrementally (SCAN + chunked deletes)
+          so other clients aren't stalled while a big hub is cleared.
+        '''
+        hub_api.delete_keys(self._server, hub_api.scan_keys(self._server, "rocon:*"))
+
     def shutdown(self):
         '''
           Clears rocon: keys on the server.
         '''
         try:
-            rocon_keys = self._server.keys("rocon:*")
-            pattern = re.compile("rocon:*")
-            keys_to_delete = []
-            for key in rocon_keys:
-                if pattern.match(key):
-                    keys_to_delete.append(key)
-            pipe = self._server.pipeline()
-            if len(keys_to_delete) != 0:
-                pipe.delete(*keys_to_delete)  # * unpacks the list args - http://stackoverflow.com/questions/2921847/python-once-and-for-all-what-does-the-star-operator-mean-in-python
-            pipe.execute()
+            self._clear_rocon_keys()
             #rospy.loginfo("Hub : clearing hub variables on the redis server.")
         except redis.ConnectionError:
             pass
@@ -19,6 +19,7 @@ def load():
      - port       : port number to run the server (default: 6380)
      - zeroconf   : whether or not to zeroconf publish this hub
      - max_memory : max amount of ram allocated for this redis server
+     - profiling_interval : time between samples of the ~start_profiling/~stop_profiling profiler (sec)
     '''
     param = {}
 
@@ -26,5 +27,6 @@ def load():
     param['port'] = rospy.get_param('~port', '6380')
     param['zeroconf'] = rospy.get_param("~zeroconf", True)
     param['max_memory'] = rospy.get_param('~max_memory', '10mb')
+    param['profiling_interval'] = rospy.get_param('~profiling_interval', 0.01)
 
     return param
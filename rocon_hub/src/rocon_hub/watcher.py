@@ -11,13 +11,14 @@
 from gateway_msgs.msg import ConnectionStatistics
 from rocon_gateway import gateway_hub
 from rocon_hub_client import hub_api
-from rocon_python_comms import WallRate
 
 
 import rocon_hub_client
+import rocon_python_redis as redis
 import rospy
 import sys
 import threading
+import time
 
 ##############################################################################
 # Main watcher thread
@@ -26,83 +27,251 @@ import threading
 
 class WatcherThread(threading.Thread):
 
+    '''
+      Keeps track of which gateways on the hub are alive.
+
+      If the redis server publishes keyspace notifications, presence is event
+      driven - every renewal of a gateway's ping key is heard by a listener
+      thread and recorded (hub clock) in the presence sorted set. Finding
+      stale gateways is then a single ZRANGEBYSCORE. Otherwise (older redis
+      servers) the ping key TTLs of all gateways are polled every sweep.
+    '''
+
     def __init__(self, ip, port):
         threading.Thread.__init__(self)
         self.daemon = True
         self.gateway_gone_timeout = rospy.get_param('~gateway_gone_timeout', 300.0)
         self.watcher_thread_rate = rospy.get_param('~watcher_thread_rate', 0.2)
+        self._ip = ip
+        self._port = port
         try:
             self.hub = gateway_hub.GatewayHub(ip, port, [], [])
         except rocon_hub_client.HubError as e:
             rospy.logfatal("Hub Watcher: unable to connect to hub: %s" % str(e))
             sys.exit(-1)
-        self.unavailable_gateways = []
-        self.starting_up_gateways = {}
+        self._presence_key = hub_api.create_rocon_hub_key('presence')
+        # all of these only hold gateways currently on the hub (pruned every sweep)
+        self.unavailable_gateways = set()  # gateway keys
+        self.starting_up_gateways = {}  # gateway name : time of discovery (secs)
+        self._published_availability = {}  # gateway key : (available, seconds since last seen)
+        self._tracked_gateways = set()  # gateway keys in the presence set
+        # ping key renewals heard by the listener since the last sweep
+        self._last_seen = {}  # gateway key : time
+        self._last_seen_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._event_driven = self._keyspace_notifications_enabled()
+        if self._event_driven:
+            self._listener = threading.Thread(target=self._listen)
+            self._listener.daemon = True
+            self._listener.start()
+        else:
+            rospy.loginfo("Hub Watcher: keyspace notifications disabled on the redis server, polling ping keys instead.")
 
     def run(self):
         '''
           Run the hub watcher (sidekick) thread at the rate specified by the
-          watcher_thread_rate parameter. The watcher thread does the following:
-              1. For all gateways available, see if we have a pinger available.
-              2. Add and remove pingers as necessary
-              3. Depending on pinger stats, update hub appropriately
+          watcher_thread_rate parameter. Each sweep does the following:
+              1. Work out how long it has been since each gateway was seen
+              2. Write back the availability that changed in one pipeline
+              3. Unregister gateways that have been gone too long
         '''
-        rate = WallRate(self.watcher_thread_rate)
-        unavailable_set = set()
+        period = 1.0 / self.watcher_thread_rate
         while True:
-            remote_gateway_names = self.hub.list_remote_gateway_names()
+            start_time = time.time()
+            try:
+                self._sweep(period)
+            except (redis.exceptions.ConnectionError, rocon_hub_client.HubError) as e:
+                rospy.logwarn("Hub Watcher: lost contact with the hub during a sweep [%s]" % str(e))
+            sweep_duration = time.time() - start_time
+            if sweep_duration > period:
+                rospy.logwarn("Hub Watcher: sweep took longer than the watcher period [%.2fs]" % sweep_duration)
+            # an expired ping key wakes us up early
+            self._wake_up.wait(max(0.0, period - sweep_duration))
+            self._wake_up.clear()
 
-            # Check all pingers
-            for name in remote_gateway_names:
+    def _sweep(self, period):
+        '''
+          @param period : watcher period, gateways not seen for longer are unavailable (sec)
+          @type float
+        '''
+        remote_gateway_names = self.hub.list_remote_gateway_names()
+        if self._event_driven:
+            seconds_since_last_seen = self._seconds_since_last_seen_from_presence(remote_gateway_names, period)
+        else:
+            seconds_since_last_seen = self._seconds_since_last_seen_from_ttls(remote_gateway_names)
 
-                gateway_key = hub_api.create_rocon_key(name)
-                # Get time for this gateway when hub was last seen
-                ping_key = hub_api.create_rocon_gateway_key(name, ':ping')
-                expiration_time = self.hub._redis_server.ttl(ping_key)
-                # rospy.logwarn("<= {0} TTL {1}".format(ping_key, expiration_time))
-
-                if expiration_time is None or expiration_time == -2:
-                    # Probably in the process of starting up, ignore for now
-                    if name in self.starting_up_gateways:
-                        seconds_since_last_seen = int(rospy.Time.now().secs - self.starting_up_gateways[name])
-                        rospy.logwarn("Hub Watcher: gateway " + name +
-                                      " has invalid TTL as before, check it based on the time of discovery.")
-                    else:
-                        self.starting_up_gateways[name] = rospy.Time.now().secs
-                        rospy.logwarn("Hub Watcher: gateway " + name +
-                                      " probably in the process of starting up, ignore for now.")
-                        continue
-                else:
-                    seconds_since_last_seen = int(ConnectionStatistics.MAX_TTL - expiration_time)
-                    if name in self.starting_up_gateways:
-                        self.starting_up_gateways.pop(name)
+        updates = []
+        gone_gateway_keys = []
+        for name in remote_gateway_names:
+            if name not in seconds_since_last_seen:
+                continue  # starting up
+            gateway_key = hub_api.create_rocon_key(name)
+            seconds = seconds_since_last_seen[name]
+            # if it has been gone for more than one loop
+            if seconds > period:
+                rospy.logwarn("Hub Watcher: gateway " + name +
+                              " has been unavailable for " + str(seconds) +
+                              " seconds.")
+                self.unavailable_gateways.add(gateway_key)
+                availability = (False, seconds)
+                # Check if gateway gone
+                if seconds > self.gateway_gone_timeout:
+                    rospy.logwarn("Hub Watcher: gateway " + name +
+                                  " has been unavailable for " +
+                                  str(self.gateway_gone_timeout) +
+                                  " seconds! Removing from hub.")
+                    gone_gateway_keys.append(gateway_key)
+                    continue
+            # Mark gateway as available
+            else:
+                if gateway_key in self.unavailable_gateways:
+                    rospy.logwarn("Hub Watcher: gateway " + name +
+                                  " detected available again !")
+                    self.unavailable_gateways.discard(gateway_key)
+                availability = (True, seconds)
+            # only write what changed
+            if self._published_availability.get(gateway_key) != availability:
+                updates.append((gateway_key,) + availability)
+                self._published_availability[gateway_key] = availability
+        self.hub.mark_named_gateways_available(updates)
+
+        for gateway_key in gone_gateway_keys:
+            # Gone for too long => unregister (also drops it from the presence set)
+            self.hub.unregister_named_gateway(gateway_key)
+
+        # forget about gateways that have left the hub
+        current_keys = set(hub_api.create_rocon_key(name) for name in remote_gateway_names) - set(gone_gateway_keys)
+        current_names = set(name for name in remote_gateway_names if hub_api.create_rocon_key(name) in current_keys)
+        for name in self.starting_up_gateways.keys():
+            if name not in current_names:
+                del self.starting_up_gateways[name]
+        self.unavailable_gateways &= current_keys
+        for gateway_key in self._published_availability.keys():
+            if gateway_key not in current_keys:
+                del self._published_availability[gateway_key]
+        departed_gateway_keys = self._tracked_gateways - current_keys
+        if departed_gateway_keys:
+            self.hub._redis_server.zrem(self._presence_key, *departed_gateway_keys)
+            self._tracked_gateways &= current_keys
 
-                # rospy.logwarn("<= Not seen since {0} secs...".format(seconds_since_last_seen))
+    ##########################################################################
+    # Polling
+    ##########################################################################
+
+    def _seconds_since_last_seen_from_ttls(self, remote_gateway_names):
+        '''
+          Fetch the ping key TTLs of all gateways in one pipeline.
+
+          @return name : seconds since last seen, gateways that are starting up are left out
+          @rtype dict
+        '''
+        expiration_times = []
+        if remote_gateway_names:
+            pipe = self.hub._redis_server.pipeline(transaction=False)
+            for name in remote_gateway_names:
+                # Get time for this gateway when hub was last seen
+                pipe.ttl(hub_api.create_rocon_gateway_key(name, ':ping'))
+            expiration_times = pipe.execute()
 
-                # if it has been gone for more than one loop
-                if seconds_since_last_seen > rate.period:
+        now = rospy.Time.now().secs
+        seconds_since_last_seen = {}
+        for name, expiration_time in zip(remote_gateway_names, expiration_times):
+            if expiration_time is None or expiration_time == -2:
+                # Probably in the process of starting up, ignore for now
+                if name in self.starting_up_gateways:
+                    seconds_since_last_seen[name] = int(now - self.starting_up_gateways[name])
                     rospy.logwarn("Hub Watcher: gateway " + name +
-                                  " has been unavailable for " + str(seconds_since_last_seen) +
-                                  " seconds.")
-                    unavailable_set.add(gateway_key)
-                    self.hub.mark_named_gateway_available(gateway_key, False, seconds_since_last_seen)
-
-                    # Check if gateway gone
-                    if seconds_since_last_seen > self.gateway_gone_timeout:
-                        rospy.logwarn("Hub Watcher: gateway " + name +
-                                      " has been unavailable for " +
-                                      str(self.gateway_gone_timeout) +
-                                      " seconds! Removing from hub.")
-
-                        # Gone for too long => unregister
-                        self.hub.unregister_named_gateway(gateway_key)
-
-                # Mark gateway as available
+                                  " has invalid TTL as before, check it based on the time of discovery.")
                 else:
-                    if gateway_key in unavailable_set:
-                        rospy.logwarn("Hub Watcher: gateway " + name +
-                                      " detected available again !")
-                        unavailable_set.remove(gateway_key)
-                    self.hub.mark_named_gateway_available(gateway_key, True, seconds_since_last_seen)
+                    self.starting_up_gateways[name] = now
+                    rospy.logwarn("Hub Watcher: gateway " + name +
+                                  " probably in the process of starting up, ignore for now.")
+            else:
+                seconds_since_last_seen[name] = int(ConnectionStatistics.MAX_TTL - expiration_time)
+                self.starting_up_gateways.pop(name, None)
+        return seconds_since_last_seen
+
+    ##########################################################################
+    # Presence
+    ##########################################################################
+
+    def _keyspace_notifications_enabled(self):
+        try:
+            config = self.hub._redis_server.config_get('notify-keyspace-events')
+        except redis.exceptions.ResponseError:
+            return False  # pre 2.8 servers don't know the setting
+        flags = config.get('notify-keyspace-events', '') if config else ''
+        return 'K' in flags and ('$' in flags or 'A' in flags)
+
+    def _listen(self):
+        '''
+          Listener thread - records every renewal of a gateway ping key
+          (keyspace notifications for rocon:<gateway>::ping).
+        '''
+        ping_suffix = '::ping'  # rocon:<gateway>::ping, see GatewayHub.heartbeat
+        pattern = '__keyspace@0__:' + hub_api.create_rocon_gateway_key('*', ':ping')
+        while True:
+            try:
+                # no socket timeout, it would be forever tripping up on a quiet hub
+                pubsub = redis.Redis(host=self._ip, port=self._port).pubsub()
+                pubsub.psubscribe(pattern)
+                for message in pubsub.listen():
+                    if message['type'] != 'pmessage':
+                        continue
+                    gateway_key = message['channel'].split('__:', 1)[1][:-len(ping_suffix)]
+                    if message['data'] == 'set':
+                        with self._last_seen_lock:
+                            self._last_seen[gateway_key] = time.time()
+                    elif message['data'] == 'expired':
+                        rospy.loginfo("Hub Watcher: gateway ping expired [%s]" % hub_api.key_base_name(gateway_key))
+                        self._wake_up.set()
+            except redis.exceptions.ConnectionError as e:
+                # anything missed meanwhile is caught by the ttl check on stale gateways
+                rospy.logwarn("Hub Watcher: lost the keyspace notification subscription, retrying [%s]" % str(e))
+                time.sleep(1.0)
+
+    def _seconds_since_last_seen_from_presence(self, remote_gateway_names, period):
+        '''
+          Record the ping renewals heard since the last sweep in the presence set
+          and pull out the gateways that haven't been seen within the period.
+          Only those have their ping key TTL double checked, in case the listener
+          missed an event.
+
+          @return name : seconds since last seen
+          @rtype dict
+        '''
+        now = time.time()
+        with self._last_seen_lock:
+            last_seen = self._last_seen
+            self._last_seen = {}
+        gateway_keys = dict((hub_api.create_rocon_key(name), name) for name in remote_gateway_names)
+        for gateway_key in gateway_keys:
+            if gateway_key not in self._tracked_gateways and gateway_key not in last_seen:
+                last_seen[gateway_key] = now  # new to us, probably starting up - time from discovery
+        pipe = self.hub._redis_server.pipeline(transaction=False)
+        if last_seen:
+            pipe.zadd(self._presence_key, **last_seen)
+        pipe.zrangebyscore(self._presence_key, '-inf', now - period, withscores=True)
+        stale = dict((gateway_key, score) for gateway_key, score in pipe.execute()[-1] if gateway_key in gateway_keys)
+        self._tracked_gateways.update(last_seen.keys())
+
+        if stale:
+            stale_gateway_keys = stale.keys()
+            pipe = self.hub._redis_server.pipeline(transaction=False)
+            for gateway_key in stale_gateway_keys:
+                pipe.ttl(gateway_key + '::ping')
+            refreshed = {}
+            for gateway_key, expiration_time in zip(stale_gateway_keys, pipe.execute()):
+                if expiration_time is None or expiration_time < 0:
+                    continue
+                ping_time = now - (ConnectionStatistics.MAX_TTL - expiration_time)
+                if ping_time > stale[gateway_key]:
+                    refreshed[gateway_key] = ping_time
+            if refreshed:
+                self.hub._redis_server.zadd(self._presence_key, **refreshed)
+                stale.update(refreshed)
 
-            rate.sleep()
+        seconds_since_last_seen = {}
+        for gateway_key, name in gateway_keys.items():
+            seconds_since_last_seen[name] = int(now - stale[gateway_key]) if gateway_key in stale else 0
+        return seconds_since_last_seen
@@ -5,7 +5,10 @@
 #
 
 import hub_api
-from .hub_client import Hub, ping_hub
+from .hub_client import Hub, ping_hub, create_connection_pool
+from .backend import RedisBackend, get_backend, set_backend
+from .memory_backend import MemoryBackend, LatencyModel
+from .circuit_breaker import CircuitBreaker
 from .hub_discovery import HubDiscovery
 from .exceptions import HubError, \
                         HubNotFoundError, HubNameNotFoundError, \
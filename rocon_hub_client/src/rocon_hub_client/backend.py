@@ -0,0 +1,59 @@
+#
+# License: BSD
+#
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+###############################################################################
+# Imports
+###############################################################################
+
+import rocon_python_redis as redis
+
+##############################################################################
+# Backends
+##############################################################################
+#
+# A backend is what hub clients (Hub._redis_server, hub pings, hub discovery's
+# warm connection pools) get their redis connections from. It has two
+# methods:
+#
+#  - create_connection_pool(ip, port, socket_timeout) : a pool for a hub
+#    address (with a disconnect() method)
+#  - create_client(connection_pool) : a redis style client on the pool (with
+#    the commands and pipelines the gateway uses, raising
+#    redis.exceptions.ConnectionError if the hub can't be reached)
+#
+# The default talks to real redis servers. Swap in another (e.g.
+# rocon_hub_client.MemoryBackend) with set_backend() before creating any hubs.
+
+
+class RedisBackend(object):
+
+    '''
+      Connections to real redis servers over tcp.
+    '''
+
+    def create_connection_pool(self, ip, port, socket_timeout=5.0):
+        return redis.ConnectionPool(host=ip, port=port, db=0, socket_timeout=socket_timeout)
+
+    def create_client(self, connection_pool):
+        return redis.Redis(connection_pool=connection_pool)
+
+_backend = RedisBackend()
+
+
+def get_backend():
+    '''
+      @return the backend hub clients currently connect through
+      @rtype RedisBackend or compatible
+    '''
+    return _backend
+
+
+def set_backend(backend):
+    '''
+      @param backend : backend for hub clients to connect through from now on (None for the default)
+      @type RedisBackend or compatible
+    '''
+    global _backend
+    _backend = backend if backend is not None else RedisBackend()
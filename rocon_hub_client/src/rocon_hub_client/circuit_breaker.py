@@ -0,0 +1,235 @@
+#
+# License: BSD
+#
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+###############################################################################
+# Imports
+###############################################################################
+
+import threading
+import time
+
+import rospy
+import rocon_python_redis as redis
+
+##############################################################################
+# Circuit Breaker
+##############################################################################
+
+
+class CircuitBreaker(object):
+
+    '''
+      Tracks the health of calls to a single hub.
+
+       - closed    : calls go through, failures and slow calls are counted
+       - open      : calls fail immediately, a background probe checks the hub periodically
+       - half-open : the probe is testing the hub, calls still fail immediately
+
+      A connection failure (usually a socket timeout) opens the breaker
+      straight away - on an unreachable hub every further call would just
+      cost another timeout. Slow calls only open it once they pile up.
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, probe, slow_call_duration=1.0, slow_call_threshold=3, probe_period=1.0):
+        '''
+          @param name : for logging (usually the hub uri)
+          @type str
+          @param probe : callable that raises redis.ConnectionError if the hub is still unavailable
+          @type method
+          @param slow_call_duration : calls taking longer than this count against the hub (sec)
+          @type float
+          @param slow_call_threshold : number of consecutive slow calls that will open the breaker
+          @type int
+          @param probe_period : time between probes while open (sec)
+          @type float
+        '''
+        self.name = name
+        self.state = CircuitBreaker.CLOSED
+        self._probe = probe
+        self._slow_call_duration = slow_call_duration
+        self._slow_call_threshold = slow_call_threshold
+        self._probe_period = probe_period
+        self._slow_calls = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+        self._probe_thread = None
+        self._shutdown = False
+
+    def allow(self):
+        '''
+          @return True if a call should be attempted
+          @rtype bool
+        '''
+        return self.state == CircuitBreaker.CLOSED
+
+    def open_duration(self):
+        '''
+          @return how long the breaker has been open or half-open (sec), 0.0 if closed
+          @rtype float
+        '''
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return time.time() - self._opened_at
+
+    def record_success(self, duration):
+        with self._lock:
+            if duration > self._slow_call_duration:
+                self._slow_calls += 1
+                if self._slow_calls >= self._slow_call_threshold:
+                    self._open("%s consecutive calls slower than %ss" % (self._slow_calls, self._slow_call_duration))
+            else:
+                self._slow_calls = 0
+
+    def record_failure(self, error):
+        with self._lock:
+            self._open(str(error))
+
+    def shutdown(self):
+        '''
+          Stop probing (the hub is being disengaged).
+        '''
+        self._shutdown = True
+
+    def _open(self, reason):
+        '''
+          Must be called with the lock held.
+        '''
+        if self.state != CircuitBreaker.CLOSED:
+            return
+        rospy.logwarn("Hub Client : hub is unresponsive, failing calls fast until it recovers [%s][%s]" % (self.name, reason))
+        self.state = CircuitBreaker.OPEN
+        self._opened_at = time.time()
+        if self._probe_thread is None and not self._shutdown:
+            self._probe_thread = threading.Thread(target=self._probe_loop)
+            self._probe_thread.daemon = True
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        while not self._shutdown and not rospy.is_shutdown():
+            time.sleep(self._probe_period)
+            with self._lock:
+                self.state = CircuitBreaker.HALF_OPEN
+            try:
+                self._probe()  # not under the lock, it may sit out a socket timeout
+            except redis.exceptions.ConnectionError:
+                with self._lock:
+                    self.state = CircuitBreaker.OPEN
+                continue
+            with self._lock:
+                rospy.loginfo("Hub Client : hub is responsive again [%s]" % self.name)
+                self._slow_calls = 0
+                self._opened_at = None
+                self.state = CircuitBreaker.CLOSED
+                self._probe_thread = None
+            return
+        with self._lock:
+            self._probe_thread = None
+
+##############################################################################
+# Redis Client
+##############################################################################
+
+
+class CircuitBreakerRedis(object):
+
+    '''
+      Wraps a redis client (or a pipeline) so that every command is
+      accounted for by the circuit breaker and fails fast with a
+      redis.ConnectionError (which callers already handle as a lost hub)
+      while the breaker is open.
+    '''
+
+    def __init__(self, client, circuit_breaker):
+        self._client = client
+        self._circuit_breaker = circuit_breaker
+
+    def pipeline(self, *args, **kwargs):
+        return _CircuitBreakerPipeline(self._client.pipeline(*args, **kwargs), self._circuit_breaker)
+
+    def pubsub(self, *args, **kwargs):
+        return self._client.pubsub(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+        return lambda *args, **kwargs: _call(self._circuit_breaker, attribute, args, kwargs)
+
+
+class _CircuitBreakerPipeline(object):
+
+    '''
+      Pipelined commands are only buffered, the network traffic (and hence
+      the breaker bookkeeping) happens in execute - and in watch/unwatch and
+      any command issued while watching, which redis-py runs immediately.
+
+      Everything that can reach the hub is wrapped explicitly, a bare proxy
+      would hand out the underlying pipeline (from a with statement or a
+      chained command) and let calls past the breaker.
+    '''
+
+    def __init__(self, pipeline, circuit_breaker):
+        self._pipeline = pipeline
+        self._circuit_breaker = circuit_breaker
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def __len__(self):
+        return len(self._pipeline)
+
+    def execute(self, *args, **kwargs):
+        '''
+          A single call as far as the breaker is concerned - redis-py's own
+          reconnect and retry on a dropped connection happens inside it, so
+          is timed with it and its failure opens the breaker. Nothing is
+          attempted while the breaker is open.
+        '''
+        return _call(self._circuit_breaker, self._pipeline.execute, args, kwargs)
+
+    def watch(self, *names):
+        return _call(self._circuit_breaker, self._pipeline.watch, names, {})
+
+    def unwatch(self):
+        return _call(self._circuit_breaker, self._pipeline.unwatch, (), {})
+
+    def multi(self):
+        self._pipeline.multi()
+
+    def reset(self):
+        # only releases the connection (and unwatches if watching), never worth failing fast
+        self._pipeline.reset()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._pipeline, name)
+        if not callable(attribute):
+            return attribute
+
+        def command(*args, **kwargs):
+            if getattr(self._pipeline, 'watching', False) is True:  # redis-py's flag, not a stand in's command
+                return _call(self._circuit_breaker, attribute, args, kwargs)
+            attribute(*args, **kwargs)
+            return self  # chain on the wrapper, not the underlying pipeline
+        return command
+
+
+def _call(circuit_breaker, method, args, kwargs):
+    if not circuit_breaker.allow():
+        raise redis.exceptions.ConnectionError("hub is unresponsive, not trying [%s]" % circuit_breaker.name)
+    start_time = time.time()
+    try:
+        result = method(*args, **kwargs)
+    except redis.exceptions.ConnectionError as e:
+        circuit_breaker.record_failure(e)
+        raise
+    circuit_breaker.record_success(time.time() - start_time)
+    return result
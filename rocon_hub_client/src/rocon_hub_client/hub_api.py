@@ -9,6 +9,8 @@
 
 import re
 
+import rocon_python_redis as redis
+
 ###############################################################################
 # Utility Functions
 ###############################################################################
@@ -45,6 +47,32 @@ def create_rocon_gateway_key(unique_gateway_name, key):
     return 'rocon:' + unique_gateway_name + ":" + key
 
 
+# Everything a gateway (or the hub on its behalf) keeps under its own namespace.
+# These get recorded in the gateway's key registry so they can be cleaned up without KEYS.
+gateway_key_suffixes = [
+    ':ping', 'ip', 'firewall', 'public_key', 'available', 'time_since_last_seen',
+    'advertisements', 'flips', 'pulls', 'flip_ins',
+    'latency:min', 'latency:avg', 'latency:max', 'latency:mdev',
+    'network:info_available', 'network:type',
+    'wireless:bitrate', 'wireless:quality', 'wireless:signal_level', 'wireless:noise_level'
+]
+
+
+def create_rocon_gateway_registry_key(unique_gateway_name):
+    '''
+      The set holding the names of all the keys belonging to a gateway.
+    '''
+    return create_rocon_gateway_key(unique_gateway_name, 'keys')
+
+
+def create_rocon_gateway_keys(unique_gateway_name):
+    '''
+      @return all the keys a gateway may have on the hub
+      @rtype str[]
+    '''
+    return [create_rocon_gateway_key(unique_gateway_name, suffix) for suffix in gateway_key_suffixes]
+
+
 def extract_rocon_key(key):
     '''
       Extract the specified redis key name from our pseudo redis database.
@@ -61,3 +89,77 @@ def key_base_name(key):
       e.g. rocon:key:pirate24 -> pirate24
     '''
     return key.split(':')[-1]
+
+###############################################################################
+# Bulk Key Operations
+###############################################################################
+
+
+def scan_keys(server, pattern, count=1000):
+    '''
+      Incrementally iterate over the keys matching a pattern with SCAN so the
+      server isn't blocked for a walk over the entire keyspace like it is with
+      KEYS. Falls back to KEYS on servers that predate SCAN (< 2.8).
+
+      @param server : redis client
+      @param pattern : glob style pattern, e.g. rocon:*
+      @type str
+      @param count : hint for the number of keys to inspect per call
+      @type int
+
+      @return generator over the matching keys (may repeat keys, as SCAN does)
+    '''
+    cursor = '0'
+    try:
+        while True:
+            cursor, keys = server.execute_command('SCAN', cursor, 'MATCH', pattern, 'COUNT', count)
+            for key in keys:
+                yield key
+            if int(cursor) == 0:
+                return
+    except redis.exceptions.ResponseError:  # unknown command
+        if cursor != '0':
+            raise
+    for key in server.keys(pattern):
+        yield key
+
+
+def delete_keys(server, keys, chunk_size=500):
+    '''
+      Delete keys in chunks rather than one huge variadic command. Uses UNLINK
+      (memory is reclaimed in the background) where the server supports it (>= 4.0).
+
+      @param server : redis client
+      @param keys : keys to delete (any iterable, e.g. from scan_keys)
+      @param chunk_size : number of keys per command
+      @type int
+
+      @return number of keys deleted
+      @rtype int
+    '''
+    command = 'UNLINK'
+    deleted = 0
+    chunk = []
+    for key in keys:
+        chunk.append(key)
+        if len(chunk) < chunk_size:
+            continue
+        (command, count) = _delete_chunk(server, command, chunk)
+        deleted += count
+        chunk = []
+    if chunk:
+        (command, count) = _delete_chunk(server, command, chunk)
+        deleted += count
+    return deleted
+
+
+def _delete_chunk(server, command, chunk):
+    '''
+      @return the command that worked (so the caller sticks with it) and the number of keys deleted
+    '''
+    if command == 'UNLINK':
+        try:
+            return command, server.execute_command('UNLINK', *chunk)
+        except redis.exceptions.ResponseError:  # unknown command
+            command = 'DEL'
+    return command, server.execute_command('DEL', *chunk)
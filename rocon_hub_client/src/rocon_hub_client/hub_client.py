@@ -14,6 +14,8 @@ import rocon_python_redis as redis
 import rocon_gateway_utils
 
 from . import hub_api
+from .backend import get_backend
+from .circuit_breaker import CircuitBreaker, CircuitBreakerRedis
 from .exceptions import HubNameNotFoundError, HubNotFoundError, \
     HubConnectionBlacklistedError, HubConnectionNotWhitelistedError
 
@@ -42,17 +44,30 @@ class HubConnection(redis.Connection):
 ##############################################################################
 
 
-def ping_hub(ip, port, timeout=5.0):
+def create_connection_pool(ip, port, socket_timeout=5.0):
+    '''
+      Connection pool to a hub's redis server. Connections are only opened on
+      demand and stay open when returned to the pool.
+
+      @rtype redis.ConnectionPool
+    '''
+    return get_backend().create_connection_pool(ip, port, socket_timeout)
+
+
+def ping_hub(ip, port, timeout=5.0, connection_pool=None):
     '''
       Pings the hub for identification. This is currently used
       by the hub discovery module.
 
+      @param connection_pool : reuse this (warm) pool rather than setting up a new connection
+      @type redis.ConnectionPool
+
       @return Bool, Latency
     '''
     try:
-        connection_pool = redis.ConnectionPool(host=ip, port=port,
-                                               connection_class=HubConnection, socket_timeout=timeout)
-        r = redis.Redis(connection_pool=connection_pool)
+        if connection_pool is None:
+            connection_pool = create_connection_pool(ip, port, socket_timeout=timeout)
+        r = get_backend().create_client(connection_pool)
         name = r.get("rocon:hub:name")
     except redis.exceptions.ConnectionError as e:
         return False, str(e)
@@ -67,13 +82,15 @@ def ping_hub(ip, port, timeout=5.0):
 
 class Hub(object):
 
-    def __init__(self, ip, port, whitelist=[], blacklist=[]):
+    def __init__(self, ip, port, whitelist=[], blacklist=[], connection_pool=None):
         '''
           @param remote_gateway_request_callbacks : to handle redis responses
           @type list of function pointers (back to GatewaySync class
 
           @param ip : redis server ip
           @param port : redis server port
+          @param connection_pool : an already verified pool to the server (e.g. from hub discovery)
+          @type redis.ConnectionPool
 
           @raise HubNameNotFoundError, HubNotFoundError
         '''
@@ -88,15 +105,22 @@ class Hub(object):
         # actually resolvable or it times out. Ideally we want to use socket_timeouts throughout,
         # but that will need modification of the way we handle the RedisListenerThread in
         # gateway_hub.py
+        backend = get_backend()
+        if connection_pool is None:
+            try:
+                unused_ping = backend.create_client(create_connection_pool(ip, port)).ping()
+                # should check ping result? Typically it just throws the timeout error
+            except redis.exceptions.ConnectionError:
+                self._redis_server = None
+                raise HubNotFoundError("couldn't connect to the redis server")
         try:
-            unused_ping = redis.Redis(host=ip, socket_timeout=5.0, port=port).ping()
-            # should check ping result? Typically it just throws the timeout error
-        except redis.exceptions.ConnectionError:
-            self._redis_server = None
-            raise HubNotFoundError("couldn't connect to the redis server")
-        try:
-            self.pool = redis.ConnectionPool(host=ip, port=port, db=0, socket_timeout=5.0)
-            self._redis_server = redis.Redis(connection_pool=self.pool)
+            # if we were handed a pool, it was just probed - reuse its open connection
+            self.pool = connection_pool if connection_pool is not None else create_connection_pool(ip, port)
+            # fail fast while the hub is unresponsive (e.g. out of wireless range) rather than
+            # every call in the gateway loop sitting out its own socket timeout
+            unguarded_redis_server = backend.create_client(self.pool)
+            self.circuit_breaker = CircuitBreaker(self.uri, unguarded_redis_server.ping)
+            self._redis_server = CircuitBreakerRedis(unguarded_redis_server, self.circuit_breaker)
             self._redis_pubsub_server = self._redis_server.pubsub()
             hub_key_name = self._redis_server.get("rocon:hub:name")
             # Be careful, hub_name is None, it means the redis server is
@@ -139,6 +163,7 @@ class Hub(object):
           will hang all open connections indefinitely
         '''
         try:
+            self.circuit_breaker.shutdown()
             self._redis_server.connection_pool.disconnect()
         except AttributeError:
             # Disconnecting individual connection takes some time. This
@@ -6,10 +6,15 @@
 # Imports
 ###############################################################################
 
+import collections
+import multiprocessing
+import multiprocessing.pool
+import Queue
 import threading
 from urlparse import urlparse
 import rospy
 import time
+import zeroconf_msgs.msg as zeroconf_msgs
 import zeroconf_msgs.srv as zeroconf_srvs
 from gateway_msgs.msg import ErrorCodes
 
@@ -27,31 +32,56 @@ class HubDiscovery(threading.Thread):
     '''
       Used to discover hubs via zeroconf.
     '''
-    def __init__(self, verify_connection_hook, direct_hub_uri_list=[], disable_zeroconf=False, blacklisted_hubs={}):
+    def __init__(self, verify_connection_hook, direct_hub_uri_list=[], disable_zeroconf=False, blacklisted_hubs={},
+                 lost_connection_hook=None):
         '''
           :param external_discovery_update: is a callback function that takes action on a discovery
-          :type external_discovery_update: GatewayNode.register_gateway(ip, port)
+          :type external_discovery_update: GatewayNode.register_gateway(ip, port, connection_pool)
 
           :param str[] direct_hub_uri_list: list of uri's to hubs (e.g. http://localhost:6380)
 
           :param disallowed_hubs:
           :type disallowed_hubs: # 'ip:port' : (error_code, error_code_str) dictionary of hubs that have been blacklisted (maintained by manager of this class)
+
+          :param lost_connection_hook: called when zeroconf reports a hub has gone away (optional)
+          :type lost_connection_hook: method(ip, port)
         '''
         threading.Thread.__init__(self)
         self.verify_connection_hook = verify_connection_hook
+        self.lost_connection_hook = lost_connection_hook
         self._trigger_shutdown = False
         self.trigger_update = False
         self._direct_hub_uri_list = direct_hub_uri_list
         self._direct_discovered_hubs = []
         self._zeroconf_services_available = False if disable_zeroconf else _zeroconf_services_available()
         self._blacklisted_hubs = blacklisted_hubs
+        # direct hubs are probed concurrently, each over a connection pool that is kept warm
+        # between scans and handed on to the hub connection when one is made
+        self._probe_timeout = 1.0
+        self._probe_executor = None  # created on demand, see _get_probe_executor
+        self._probes_in_flight = {}  # uri : AsyncResult
+        self._connection_pools = {}  # 'ip:port' : redis.ConnectionPool
+        # zeroconf hubs advertising several addresses have them raced against each other
+        # (in the background, the winner is picked up on a later loop), the winner is
+        # remembered for reconnects
+        self._race_timeout = 2.0
+        self._races = {}  # zeroconf service name : _Race
+        self._preferred_addresses = {}  # zeroconf service name : ip
+        self._discovered_hubs_modification_mutex = threading.Lock()
         if self._zeroconf_services_available:
-            self._discovery_request = zeroconf_srvs.ListDiscoveredServicesRequest()
-            self._discovery_request.service_type = HubDiscovery.gateway_hub_service
-            _add_listener()
-            self._list_discovered_services = rospy.ServiceProxy("zeroconf/list_discovered_services", zeroconf_srvs.ListDiscoveredServices, persistent=True)
+            # zeroconf tells us when services come and go, we just keep track of them
+            #   pending    : known services we keep trying (and re-checking) every loop
+            #   discovered : known services we have stopped trying (e.g. not in the whitelist)
+            self._zeroconf_pending_services = []
             self._zeroconf_discovered_hubs = []
-        self._discovered_hubs_modification_mutex = threading.Lock()
+            self._zeroconf_events = collections.deque()  # (is_new, zeroconf_msgs.DiscoveredService)
+            _add_listener()
+            self._zeroconf_subscribers = [
+                rospy.Subscriber("zeroconf/new_connections", zeroconf_msgs.DiscoveredService,
+                                 self._zeroconf_new_service_callback),
+                rospy.Subscriber("zeroconf/lost_connections", zeroconf_msgs.DiscoveredService,
+                                 self._zeroconf_lost_service_callback)
+            ]
         # Only run the thread if we need to.
         if self._zeroconf_services_available or self._direct_hub_uri_list:
             self.start()
@@ -70,10 +100,11 @@ class HubDiscovery(threading.Thread):
 
     def run(self):
         '''
-          The hub discovery thread worker function. Monitors zeroconf for the presence of new hubs.
+          The hub discovery thread worker function. Handles zeroconf events for hubs coming
+          and going and pings the direct hub uris.
 
-          Note that the zeroconf service is persistent. Alternatively we could use the zeroconf
-          subscriber to be a wee bit more efficient.
+          Zeroconf is only queried once (for hubs it already knew about before we subscribed),
+          from then on its new/lost connection events wake this thread up immediately.
         '''
         half_sec = 0.5  # rospy.Duration(0, 500000000)
         self._loop_period = half_sec
@@ -89,16 +120,30 @@ class HubDiscovery(threading.Thread):
             # ErrorCodes.HUB_CONNECTION_UNRESOLVABLE
         ]
         unresolvable_hub = []
+        if self._zeroconf_services_available:
+            for service in self._zeroconf_list_services():
+                self._zeroconf_events.append((True, service))
         while not rospy.is_shutdown() and not self._trigger_shutdown:
             self._discovered_hubs_modification_mutex.acquire()
-            # Zeroconf scanning
+            # Zeroconf events
+            lost_services = []
             if self._zeroconf_services_available:
-                new_services, unused_lost_services = self._zeroconf_scan()
-                for service in new_services:
-                    (ip, port) = _resolve_address(service)
+                lost_services = self._zeroconf_process_events()
+                for service in lost_services:
+                    (ip, port) = self._resolve_zeroconf_address(service, race=False)
+                    service_uri = str(ip) + ':' + str(port)
+                    if service_uri in unresolvable_hub:
+                        unresolvable_hub.remove(service_uri)
+                for service in list(self._zeroconf_pending_services):
+                    (ip, port) = self._resolve_zeroconf_address(service)
+                    if ip is None:
+                        continue  # still racing its addresses (or none answered), try again next loop
                     service_uri = str(ip) + ':' + str(port)
                     if service_uri not in self._blacklisted_hubs.keys():
-                        result, reason = self.verify_connection_hook(ip, port)
+                        result, reason = self.verify_connection_hook(ip, port, self._get_connection_pool(ip, port))
+                        if result in [ErrorCodes.HUB_CONNECTION_UNRESOLVABLE, ErrorCodes.HUB_CONNECTION_FAILED]:
+                            # the remembered address may have gone stale, race them all again next time
+                            self._preferred_addresses.pop(service.name, None)
                         if result == ErrorCodes.HUB_CONNECTION_UNRESOLVABLE:
                             if service_uri not in unresolvable_hub:
                                 rospy.loginfo("Gateway : unresolvable hub [%s]" % reason)
@@ -111,22 +156,31 @@ class HubDiscovery(threading.Thread):
                                 unresolvable_hub.remove(service_uri)
                         else:  # any of the other reasons not to keep scanning
                             rospy.loginfo("Gateway : removing hub from the list to be resolved via zeroconf [%s]" % reason)
+                            self._zeroconf_pending_services.remove(service)
                             self._zeroconf_discovered_hubs.append(service)
             # Direct scanning
             new_hubs, unused_lost_hubs = self._direct_scan()
             for hub_uri in new_hubs:
                 hostname, port = _resolve_url(hub_uri)
-                result, _ = self.verify_connection_hook(hostname, port)
+                result, _ = self.verify_connection_hook(hostname, port, self._get_connection_pool(hostname, port))
                 if result in reasons_not_to_keep_scanning:
                     rospy.loginfo("Gateway : ignoring discovered hub [%s]" % hub_uri)
                     self._direct_discovered_hubs.append(hub_uri)
             self._discovered_hubs_modification_mutex.release()
+            # outside the mutex - tearing down the hub calls back into disengage_hub
+            if self.lost_connection_hook is not None:
+                for service in lost_services:
+                    (ip, port) = self._resolve_zeroconf_address(service, race=False)
+                    self.lost_connection_hook(ip, port)
             if not self._zeroconf_services_available and not self._direct_hub_uri_list:
                 rospy.logfatal("Gateway : zeroconf unavailable and no valid direct hub uris. Stopping hub discovery.")
                 break  # nothing left to do
             self._sleep()
         if self._zeroconf_services_available:
-            self._list_discovered_services.close()
+            for subscriber in self._zeroconf_subscribers:
+                subscriber.unregister()
+        if self._probe_executor is not None:
+            self._probe_executor.terminate()
 
     def disengage_hub(self, hub):
         '''
@@ -143,6 +197,10 @@ class HubDiscovery(threading.Thread):
         self._direct_discovered_hubs[:] = [x for x in self._direct_discovered_hubs
                                            if not _match_url_to_hub_url(x, hub.uri)]
         if self._zeroconf_services_available:
+            # zeroconf won't announce these again while they are still up, so go back to trying them
+            for service in self._zeroconf_discovered_hubs:
+                if _match_zeroconf_address_to_hub_url(service, hub.uri):
+                    self._zeroconf_pending_services.append(service)
             self._zeroconf_discovered_hubs[:] = [x for x in self._zeroconf_discovered_hubs
                                                  if not _match_zeroconf_address_to_hub_url(x, hub.uri)]
         self._discovered_hubs_modification_mutex.release()
@@ -161,23 +219,131 @@ class HubDiscovery(threading.Thread):
     # Private methods
     #############################
 
+    def _get_connection_pool(self, ip, port):
+        '''
+          @return the warm connection pool for this hub address (created if necessary)
+          @rtype redis.ConnectionPool
+        '''
+        address = str(ip) + ':' + str(port)
+        try:
+            return self._connection_pools[address]
+        except KeyError:
+            return self._connection_pools.setdefault(address, hub_client.create_connection_pool(ip, port))
+
+    def _get_probe_executor(self):
+        if self._probe_executor is None:
+            self._probe_executor = multiprocessing.pool.ThreadPool(4)
+        return self._probe_executor
+
+    def _resolve_zeroconf_address(self, service, race=True):
+        '''
+          Work out which of the service's addresses to connect on. Local services
+          use localhost, single address services use that address. Otherwise the
+          remembered winner of a previous race is used, or (if race is set) the
+          addresses are raced. Races don't block, they are started here and their
+          winner collected on a later call.
+
+          @param service : the discovered hub
+          @type zeroconf_msgs.DiscoveredService
+          @param race : set to false to avoid network traffic (falls back to the first address)
+          @type bool
+
+          @return ip, port pair, ip is None while the race is running or if no address answered
+          @rtype (str, int)
+        '''
+        if service.is_local or len(service.ipv4_addresses) < 2:
+            return _resolve_address(service)
+        ip = self._preferred_addresses.get(service.name)
+        if ip is None and race:
+            ip = self._race_addresses(service)
+            if ip is not None:
+                self._preferred_addresses[service.name] = ip
+        elif ip is None:
+            ip = service.ipv4_addresses[0]
+        return (ip, service.port)
+
+    def _race_addresses(self, service):
+        '''
+          Ping the hub on all its addresses at once and go with the first to answer,
+          i.e. the one with the lowest round trip time. The first call starts the race
+          and later calls check on it, nothing waits for the pings - the first one
+          to succeed wakes the discovery loop up. Slower pings are left to finish in
+          the background (their connections are kept in the pools).
+
+          A race where no address answered within the race timeout is dropped, the
+          next call starts a new one.
+
+          @return the winning address or None if there is none (yet)
+          @rtype str
+        '''
+        race = self._races.get(service.name)
+        if race is None:
+            race = _Race(len(service.ipv4_addresses))
+            self._races[service.name] = race
+
+            def finished(result):
+                race.results.put(result)
+                if result[1]:
+                    self.trigger_update = True  # don't wait out the loop period to pick up the winner
+            for address in service.ipv4_addresses:
+                self._get_probe_executor().apply_async(
+                    _timed_ping, (address, service.port, self._get_connection_pool(address, service.port)),
+                    callback=finished)
+            return None
+        while True:
+            try:
+                (address, success, rtt) = race.results.get_nowait()
+            except Queue.Empty:
+                break
+            race.answers += 1
+            if success:
+                rospy.loginfo("Gateway : hub answered fastest on [%s:%s][%.1fms]" % (address, service.port, rtt * 1000))
+                del self._races[service.name]
+                return address
+        if race.answers == race.runners or time.time() - race.start_time > self._race_timeout:
+            del self._races[service.name]
+        return None
+
     def _direct_scan(self):
         '''
           Ping the list of hubs we are directly looking for to see if they are alive.
           Also check if the gateway there is listed to determine if the connection should be refreshed
+
+          All hubs are pinged concurrently. A hub that doesn't answer within the probe
+          timeout is treated as not (yet) discovered; its ping is left to finish in the
+          background and collected on a later scan rather than being fired again.
         '''
         discovered_hubs = []
-        already_used_hubs = []
         remove_uris = []
         for uri in self._direct_hub_uri_list:
+            if uri in self._probes_in_flight:
+                continue
             (hostname, port) = _resolve_url(uri)
             if not hostname:
                 rospy.logerr("Gateway : Unable to parse direct hub uri [%s]" % uri)
                 remove_uris.append(uri)
                 continue
-            (ping_result, unused_ping_error_message) = hub_client.ping_hub(hostname, port)
+            self._probes_in_flight[uri] = self._get_probe_executor().apply_async(
+                hub_client.ping_hub, (hostname, port), {'connection_pool': self._get_connection_pool(hostname, port)})
+        deadline = time.time() + self._probe_timeout
+        for uri, probe in self._probes_in_flight.items():
+            probe.wait(max(0.0, deadline - time.time()))
+            if not probe.ready():
+                continue
+            del self._probes_in_flight[uri]
+            try:
+                (ping_result, unused_ping_error_message) = probe.get()
+            except Exception as e:  # ping_hub handles redis errors, anything else is unexpected
+                rospy.logwarn("Gateway : error while pinging hub [%s][%s]" % (uri, str(e)))
+                ping_result = False
             if ping_result:
                 discovered_hubs.append(uri)
+            else:
+                # don't hang on to dead sockets
+                (hostname, port) = _resolve_url(uri)
+                pool = self._connection_pools.get(str(hostname) + ':' + str(port))
+                if pool is not None:
+                    pool.disconnect()
         difference = lambda l1, l2: [x for x in l1 if x not in l2]
         self._direct_hub_uri_list[:] = difference(self._direct_hub_uri_list, remove_uris)
         new_hubs = difference(discovered_hubs, self._direct_discovered_hubs)
@@ -186,28 +352,63 @@ class HubDiscovery(threading.Thread):
         # self._direct_discovered_hubs.extend(discovered_hubs)
         return new_hubs, lost_hubs
 
-    def _zeroconf_scan(self):
+    def _zeroconf_new_service_callback(self, service):
+        if service.type == HubDiscovery.gateway_hub_service:
+            self._zeroconf_events.append((True, service))
+            self.trigger_update = True  # don't wait out the loop period
+
+    def _zeroconf_lost_service_callback(self, service):
+        if service.type == HubDiscovery.gateway_hub_service:
+            self._zeroconf_events.append((False, service))
+            self.trigger_update = True
+
+    def _zeroconf_process_events(self):
         '''
-          This checks for new services and adds them. I'm not taking any
-          action when a discovered service disappears yet though. Probably
-          should take of that at some time.
+          Apply the zeroconf events received since the last loop to the pending/discovered
+          service lists. Must be called with the modification mutex held.
+
+          @return the known services that zeroconf has lost (as we stored them, i.e. with addresses)
+          @rtype zeroconf_msgs.DiscoveredService[]
+        '''
+        lost_services = []
+        while self._zeroconf_events:
+            (is_new, service) = self._zeroconf_events.popleft()
+            known_services = [s for s in self._zeroconf_pending_services + self._zeroconf_discovered_hubs
+                              if _match_zeroconf_service(s, service)]
+            if is_new:
+                if not known_services:
+                    self._zeroconf_pending_services.append(service)
+                continue
+            for known_service in known_services:
+                rospy.loginfo("Gateway : zeroconf lost the hub [%s]" % known_service.name)
+                lost_services.append(known_service)
+            self._zeroconf_pending_services[:] = [s for s in self._zeroconf_pending_services
+                                                  if not _match_zeroconf_service(s, service)]
+            self._zeroconf_discovered_hubs[:] = [s for s in self._zeroconf_discovered_hubs
+                                                 if not _match_zeroconf_service(s, service)]
+        return lost_services
+
+    def _zeroconf_list_services(self):
         '''
-        # rospy.loginfo("Gateway : checking for autodiscovered gateway hubs")
+          One off query for the hubs zeroconf already knows about. Everything
+          after this arrives via the new/lost connection subscribers.
+        '''
+        discovery_request = zeroconf_srvs.ListDiscoveredServicesRequest()
+        discovery_request.service_type = HubDiscovery.gateway_hub_service
         try:
-            response = self._list_discovered_services(self._discovery_request)
+            list_discovered_services = rospy.ServiceProxy("zeroconf/list_discovered_services",
+                                                          zeroconf_srvs.ListDiscoveredServices)
+            response = list_discovered_services(discovery_request)
         except (rospy.service.ServiceException, rospy.exceptions.ROSInterruptException):
             # means we've shut down, just return so it can cleanly shutdown back in run()
-            return [], []
+            return []
         except (rospy.exceptions.TransportTerminated, AttributeError) as unused_e:
             # We should never ever see this - but we're calling the zeroconf node
             # when we may be in a shutdown hook. Instead of getting one of the standard
             # exceptions above, it gives us anyone of these curious errors.
             # Rospy could handle this better...
-            return [], []
-        difference = lambda l1, l2: [x for x in l1 if x not in l2]
-        new_services = difference(response.services, self._zeroconf_discovered_hubs)
-        lost_services = difference(self._zeroconf_discovered_hubs, response.services)
-        return new_services, lost_services
+            return []
+        return response.services
 
 ###############################################################################
 # Functions
@@ -262,14 +463,54 @@ def _resolve_address(msg):
 
 def _match_zeroconf_address_to_hub_url(msg, hub_uri):
     '''
+      Matches on any of the advertised addresses since the hub may be connected
+      on whichever won the race.
+
       @param msg: The original zeroconf address used to specify the hub
       @type zeroconf_msgs.DiscoveredService
 
       @param hub_uri: The uri constructed by the hub, devoid of any URL scheme
       @type string: of the form ip:port
     '''
-    (ip, port) = _resolve_address(msg)
-    return (hub_uri == str(ip) + ":" + str(port))
+    if msg.is_local:
+        return (hub_uri == "localhost:" + str(msg.port))
+    return hub_uri in [str(ip) + ":" + str(msg.port) for ip in msg.ipv4_addresses]
+
+
+class _Race(object):
+
+    '''
+      Pings of a hub's addresses, results arrive in the order they answered.
+    '''
+
+    def __init__(self, runners):
+        self.runners = runners
+        self.answers = 0
+        self.results = Queue.Queue()  # (ip, success, round trip time)
+        self.start_time = time.time()
+
+
+def _timed_ping(ip, port, connection_pool):
+    '''
+      @return (ip, success, round trip time in seconds)
+      @rtype (str, bool, float)
+    '''
+    start_time = time.time()
+    try:
+        (success, unused_error_message) = hub_client.ping_hub(ip, port, connection_pool=connection_pool)
+    except Exception:  # ping_hub handles redis errors, but the race must always get a result
+        success = False
+    return (ip, success, time.time() - start_time)
+
+
+def _match_zeroconf_service(service, other):
+    '''
+      Lost events can't be compared wholesale with the stored (resolved) service,
+      so match on the zeroconf identity only.
+
+      @type zeroconf_msgs.DiscoveredService
+    '''
+    return (service.name, service.type, service.domain) == (other.name, other.type, other.domain)
 
 
 def _zeroconf_services_available():
@@ -0,0 +1,504 @@
+#
+# License: BSD
+#
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+###############################################################################
+# Imports
+###############################################################################
+
+import fnmatch
+import random
+import threading
+import time
+
+import rocon_python_redis as redis
+
+##############################################################################
+# Latency
+##############################################################################
+
+
+class LatencyModel(object):
+
+    '''
+      Simulated network latency, paid once per round trip to the hub (a
+      single command or a whole pipeline).
+    '''
+
+    def __init__(self, round_trip_time=0.0, jitter=0.0, seed=None, sleep=time.sleep):
+        '''
+          @param round_trip_time : mean round trip time (sec)
+          @type float
+          @param jitter : round trips vary uniformly by up to +/- this much (sec)
+          @type float
+          @param seed : seed the jitter for repeatable runs
+          @type int
+          @param sleep : how to pass the time (swap in a virtual clock's sleep to skip the waiting)
+          @type func(float)
+        '''
+        self.round_trip_time = round_trip_time
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._sleep = sleep
+
+    def delay(self):
+        '''
+          @return the latency of the next round trip (sec)
+          @rtype float
+        '''
+        if not self.jitter:
+            return self.round_trip_time
+        return max(0.0, self.round_trip_time + self._random.uniform(-self.jitter, self.jitter))
+
+    def wait(self):
+        delay = self.delay()
+        if delay > 0.0:
+            self._sleep(delay)
+
+##############################################################################
+# Backend
+##############################################################################
+
+
+class MemoryBackend(object):
+
+    '''
+      Hub backend with in-process redis stand-ins instead of redis servers,
+      for hermetic (and fast) tests and benchmarks of the hub and gateway
+      logic. Implements the commands and pipelines the hub clients use, not
+      all of redis.
+
+      Servers are added per address. Clients connecting to any other
+      address (or one that has been removed) get the same
+      redis.exceptions.ConnectionError a real unreachable hub would give.
+
+      Usage:
+
+        backend = rocon_hub_client.MemoryBackend()
+        backend.add_server('localhost', 6380, 'Test Hub', latency=rocon_hub_client.LatencyModel(0.05))
+        rocon_hub_client.set_backend(backend)
+        hub = rocon_gateway.gateway_hub.GatewayHub('localhost', 6380, [], [])
+    '''
+
+    def __init__(self, latency=None, clock=time.time):
+        '''
+          @param latency : default latency for servers
+          @type LatencyModel
+          @param clock : time source for key expiry
+          @type func() -> float
+        '''
+        self._latency = latency
+        self._clock = clock
+        self._servers = {}  # 'ip:port' : MemoryServer
+        self._lock = threading.Lock()
+
+    def add_server(self, ip, port, name=None, latency=None):
+        '''
+          @param name : name of the hub (sets rocon:hub:name, like the rocon hub does)
+          @type str
+          @param latency : latency for this server, overriding the backend's default
+          @type LatencyModel
+
+          @rtype MemoryServer
+        '''
+        server = MemoryServer(latency if latency is not None else self._latency, self._clock)
+        if name is not None:
+            server.set('rocon:hub:name', name)
+        with self._lock:
+            self._servers[_address(ip, port)] = server
+        return server
+
+    def remove_server(self, ip, port):
+        '''
+          Simulate the hub going away - subsequent commands raise connection errors.
+        '''
+        with self._lock:
+            self._servers.pop(_address(ip, port), None)
+
+    def get_server(self, ip, port):
+        '''
+          @rtype MemoryServer or None
+        '''
+        with self._lock:
+            return self._servers.get(_address(ip, port))
+
+    def create_connection_pool(self, ip, port, socket_timeout=5.0):
+        return MemoryConnectionPool(self, ip, port)
+
+    def create_client(self, connection_pool):
+        return MemoryRedis(connection_pool)
+
+
+def _address(ip, port):
+    return str(ip) + ':' + str(port)
+
+
+class MemoryConnectionPool(object):
+
+    def __init__(self, backend, ip, port):
+        self.backend = backend
+        self.ip = ip
+        self.port = port
+
+    def get_server(self):
+        server = self.backend.get_server(self.ip, self.port)
+        if server is None:
+            raise redis.exceptions.ConnectionError("Error connecting to %s:%s. Connection refused." % (self.ip, self.port))
+        return server
+
+    def disconnect(self):
+        pass
+
+##############################################################################
+# Server
+##############################################################################
+
+
+class MemoryServer(object):
+
+    '''
+      The data store for one hub address. Values are kept as strings, like
+      redis does. Commands are the redis-py (Redis, not StrictRedis) methods
+      of the same name.
+    '''
+
+    commands = frozenset([
+        'ping', 'exists', 'delete', 'unlink', 'keys', 'scan', 'expire', 'ttl', 'config_get', 'info',
+        'get', 'set',
+        'sadd', 'srem', 'smembers', 'sismember', 'scard',
+        'zadd', 'zrem', 'zscore', 'zcard', 'zrangebyscore',
+    ])
+
+    def __init__(self, latency, clock):
+        self.latency = latency
+        self.config = {'notify-keyspace-events': ''}
+        self.round_trips = 0
+        self.commands_processed = 0
+        self._clock = clock
+        self._data = {}
+        self._expiry = {}  # key : time
+        self._lock = threading.RLock()
+
+    def round_trip(self, commands):
+        '''
+          Execute a batch of commands in one (simulated) round trip.
+
+          @param commands : (name, args, kwargs) tuples
+          @type list
+
+          @return the results, exceptions in place of the results of failed commands
+          @rtype list
+        '''
+        if self.latency is not None:
+            self.latency.wait()
+        results = []
+        with self._lock:
+            self.round_trips += 1
+            self.commands_processed += len(commands)
+            for name, args, kwargs in commands:
+                try:
+                    if name not in MemoryServer.commands:
+                        raise redis.exceptions.ResponseError("unknown command '%s'" % name)
+                    results.append(getattr(self, name)(*args, **kwargs))
+                except redis.exceptions.ResponseError as e:
+                    results.append(e)
+        return results
+
+    def reset_statistics(self):
+        with self._lock:
+            self.round_trips = 0
+            self.commands_processed = 0
+
+    ##########################################################################
+    # Keys
+    ##########################################################################
+
+    def _get(self, key, default=None):
+        expiry = self._expiry.get(key)
+        if expiry is not None and expiry <= self._clock():
+            del self._data[key]
+            del self._expiry[key]
+        return self._data.get(key, default)
+
+    def _get_typed(self, key, collection_type):
+        value = self._get(key)
+        if value is not None and not isinstance(value, collection_type):
+            raise redis.exceptions.ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _live_keys(self):
+        return [key for key in self._data.keys() if self._get(key) is not None]
+
+    def ping(self):
+        return True
+
+    def exists(self, key):
+        return self._get(key) is not None
+
+    def delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self._get(key) is not None:
+                del self._data[key]
+                self._expiry.pop(key, None)
+                deleted += 1
+        return deleted
+
+    unlink = delete
+
+    def keys(self, pattern='*'):
+        return [key for key in self._live_keys() if fnmatch.fnmatchcase(key, pattern)]
+
+    def scan(self, cursor=0, match=None, count=None):
+        # everything in one go is a legitimate (if unhurried) scan
+        return '0', self.keys(match if match is not None else '*')
+
+    def expire(self, key, seconds):
+        if self._get(key) is None:
+            return False
+        self._expiry[key] = self._clock() + float(seconds)
+        return True
+
+    def ttl(self, key):
+        if self._get(key) is None:
+            return -2
+        if key not in self._expiry:
+            return -1
+        return int(self._expiry[key] - self._clock() + 0.5)
+
+    def config_get(self, pattern='*'):
+        return dict((name, value) for name, value in self.config.items() if fnmatch.fnmatchcase(name, pattern))
+
+    def info(self):
+        with self._lock:
+            keys = self._live_keys()
+            used_memory = 0
+            for key in keys:
+                value = self._data[key]
+                used_memory += len(key)
+                if isinstance(value, str):
+                    used_memory += len(value)
+                else:
+                    used_memory += sum(len(member) for member in value)
+            return {
+                'redis_version': 'memory',
+                'total_commands_processed': self.commands_processed,
+                'used_memory': used_memory,
+                'db0': {'keys': len(keys), 'expires': len(self._expiry)},
+            }
+
+    ##########################################################################
+    # Strings
+    ##########################################################################
+
+    def get(self, key):
+        return self._get_typed(key, str)
+
+    def set(self, key, value):
+        self._data[key] = _encode(value)
+        self._expiry.pop(key, None)
+        return True
+
+    ##########################################################################
+    # Sets
+    ##########################################################################
+
+    def sadd(self, key, *values):
+        members = self._get_typed(key, set)
+        if members is None:
+            members = self._data[key] = set()
+        count = len(members)
+        members.update(_encode(value) for value in values)
+        return len(members) - count
+
+    def srem(self, key, *values):
+        members = self._get_typed(key, set)
+        if members is None:
+            return 0
+        count = len(members)
+        members.difference_update(_encode(value) for value in values)
+        if not members:
+            self.delete(key)
+        return count - len(members)
+
+    def smembers(self, key):
+        return set(self._get_typed(key, set) or ())
+
+    def sismember(self, key, value):
+        return _encode(value) in (self._get_typed(key, set) or ())
+
+    def scard(self, key):
+        return len(self._get_typed(key, set) or ())
+
+    ##########################################################################
+    # Sorted Sets
+    ##########################################################################
+
+    def zadd(self, key, *args, **kwargs):
+        '''
+          redis-py style - zadd(key, name1, score1, ..., name=score, ...)
+        '''
+        pairs = zip(args[::2], args[1::2]) + kwargs.items()
+        scores = self._get_typed(key, dict)
+        if scores is None:
+            scores = self._data[key] = {}
+        count = len(scores)
+        for member, score in pairs:
+            scores[_encode(member)] = float(score)
+        return len(scores) - count
+
+    def zrem(self, key, *values):
+        scores = self._get_typed(key, dict)
+        if scores is None:
+            return 0
+        count = len(scores)
+        for value in values:
+            scores.pop(_encode(value), None)
+        if not scores:
+            self.delete(key)
+        return count - len(scores)
+
+    def zscore(self, key, value):
+        return (self._get_typed(key, dict) or {}).get(_encode(value))
+
+    def zcard(self, key):
+        return len(self._get_typed(key, dict) or ())
+
+    def zrangebyscore(self, key, min, max, start=None, num=None, withscores=False):
+        (min, max) = (float(min), float(max))  # float() also understands '-inf', '+inf'
+        scores = self._get_typed(key, dict) or {}
+        matches = sorted((score, member) for member, score in scores.items() if min <= score <= max)
+        if start is not None and num is not None:
+            matches = matches[start:start + num]
+        if withscores:
+            return [(member, score) for score, member in matches]
+        return [member for unused_score, member in matches]
+
+
+def _encode(value):
+    '''
+      What redis stores for a value - a string.
+    '''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+##############################################################################
+# Clients
+##############################################################################
+
+
+class MemoryRedis(object):
+
+    '''
+      Client for a memory server, standing in for redis.Redis.
+    '''
+
+    def __init__(self, connection_pool):
+        self.connection_pool = connection_pool
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        # commands run under the server lock - every pipeline is atomic
+        return MemoryPipeline(self.connection_pool)
+
+    def pubsub(self, shard_hint=None):
+        return MemoryPubSub()
+
+    def execute_command(self, *args):
+        '''
+          Raw commands, e.g. execute_command('SCAN', 0, 'MATCH', 'rocon:*', 'COUNT', 1000).
+        '''
+        name = args[0].lower()
+        name = 'delete' if name == 'del' else name
+        args = list(args[1:])
+        kwargs = {}
+        if name == 'scan':
+            options = dict(zip([option.lower() for option in args[1::2]], args[2::2]))
+            args = args[:1]
+            kwargs = options
+        return self._round_trip(name, args, kwargs)
+
+    def _round_trip(self, name, args, kwargs):
+        result = self.connection_pool.get_server().round_trip([(name, args, kwargs)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._round_trip(name, args, kwargs)
+
+
+class MemoryPipeline(object):
+
+    '''
+      Buffers commands and sends them in one round trip on execute(),
+      raising the first error (after running everything) like redis-py.
+    '''
+
+    def __init__(self, connection_pool):
+        self.connection_pool = connection_pool
+        self._commands = []
+
+    def execute(self, raise_on_error=True):
+        (commands, self._commands) = (self._commands, [])
+        if not commands:
+            return []
+        results = self.connection_pool.get_server().round_trip(commands)
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    def reset(self):
+        self._commands = []
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+        return command
+
+
+class MemoryPubSub(object):
+
+    '''
+      The hub clients open a pubsub but don't listen on it, so this only
+      keeps track of subscriptions.
+    '''
+
+    def __init__(self):
+        self.channels = set()
+        self.patterns = set()
+
+    def subscribe(self, *channels):
+        self.channels.update(channels)
+
+    def unsubscribe(self, *channels):
+        if channels:
+            self.channels.difference_update(channels)
+        else:
+            self.channels.clear()
+
+    def psubscribe(self, *patterns):
+        self.patterns.update(patterns)
+
+    def punsubscribe(self, *patterns):
+        if patterns:
+            self.patterns.difference_update(patterns)
+        else:
+            self.patterns.clear()
+
+    def listen(self):
+        return iter([])
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import marshal
+import os
+import sys
+import threading
+import time
+
+import rospkg
+import rospy
+import std_srvs.srv as std_srvs
+
+##############################################################################
+# Sampling Profiler
+##############################################################################
+
+
+class SamplingProfiler(object):
+
+    '''
+      Statistical profiler that can be attached to a running process. A
+      daemon thread wakes up every interval and records the stack of every
+      other thread (sys._current_frames()), so nothing is instrumented and
+      the overhead only depends on the interval, not on what is profiled.
+
+      It is a wall clock profile - threads waiting on locks, sockets or
+      sleeps show up where they wait.
+    '''
+
+    def __init__(self, interval=0.01):
+        '''
+          @param interval : time between samples (sec)
+          @type float
+        '''
+        self.interval = interval
+        self.samples = 0
+        self.start_time = None
+        self.stop_time = None
+        self._stacks = {}  # (thread name, ((filename, first line, function), ...) outermost first) : [samples, seconds]
+        self._running = False
+        self._thread = None
+
+    def is_running(self):
+        return self._running
+
+    def start(self):
+        '''
+          Start sampling, dropping whatever was sampled before.
+
+          @return False if already sampling
+          @rtype bool
+        '''
+        if self._running:
+            return False
+        self.samples = 0
+        self._stacks = {}
+        self.start_time = time.time()
+        self.stop_time = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='sampling_profiler')
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def stop(self):
+        '''
+          @return False if not sampling
+          @rtype bool
+        '''
+        if not self._running:
+            return False
+        self._running = False
+        self._thread.join()
+        self._thread = None
+        self.stop_time = time.time()
+        return True
+
+    def _run(self):
+        own_ident = threading.current_thread().ident
+        last_time = time.time()
+        while self._running:
+            time.sleep(self.interval)
+            now = time.time()
+            # time since the last sample, so samples delayed by the gil weigh more
+            elapsed = now - last_time
+            last_time = now
+            thread_names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                stack.reverse()
+                key = (thread_names.get(ident, str(ident)), tuple(stack))
+                entry = self._stacks.get(key)
+                if entry is None:
+                    self._stacks[key] = [1, elapsed]
+                else:
+                    entry[0] += 1
+                    entry[1] += elapsed
+            self.samples += 1
+
+    ##########################################################################
+    # Output
+    ##########################################################################
+
+    def write_collapsed(self, path):
+        '''
+          Write the samples as collapsed stacks, one 'thread;outermost;...;innermost count'
+          line per distinct stack - the input of flamegraph.pl, speedscope and friends.
+        '''
+        with open(path, 'w') as f:
+            for (thread_name, stack), (samples, unused_seconds) in sorted(self._stacks.items()):
+                frames = [thread_name] + ['%s (%s:%d)' % (function, os.path.basename(filename), line)
+                                          for filename, line, function in stack]
+                f.write('%s %d\n' % (';'.join(frame.replace(';', ':') for frame in frames), samples))
+
+    def write_pstats(self, path):
+        '''
+          Write the samples in the format pstats.Stats loads (and snakeviz,
+          gprof2dot... read). Every sample a function is seen in counts as
+          a call, its time is the time the samples stand for.
+        '''
+        stats = {}  # function : [primitive calls, calls, self time, cumulative time, {caller : [...]}]
+
+        def entry(table, function):
+            if function not in table:
+                table[function] = [0, 0, 0.0, 0.0, {}] if table is stats else [0, 0, 0.0, 0.0]
+            return table[function]
+
+        for (unused_thread_name, stack), (samples, seconds) in self._stacks.items():
+            if not stack:
+                continue
+            seen = set()
+            for depth, function in enumerate(stack):
+                function_stats = entry(stats, function)
+                if function not in seen:  # recursion only counts once per sample
+                    seen.add(function)
+                    function_stats[0] += samples
+                    function_stats[1] += samples
+                    function_stats[3] += seconds
+                if depth > 0:
+                    caller_stats = entry(function_stats[4], stack[depth - 1])
+                    caller_stats[0] += samples
+                    caller_stats[1] += samples
+                    caller_stats[3] += seconds
+            entry(stats, stack[-1])[2] += seconds
+            caller_stats = stats[stack[-1]][4].get(stack[-2]) if len(stack) > 1 else None
+            if caller_stats is not None:
+                caller_stats[2] += seconds
+        with open(path, 'wb') as f:
+            marshal.dump(dict((function, (cc, nc, tt, ct,
+                                          dict((caller, tuple(values)) for caller, values in callers.items())))
+                              for function, (cc, nc, tt, ct, callers) in stats.items()), f)
+
+##############################################################################
+# Ros Api
+##############################################################################
+
+
+class ProfilingServices(object):
+
+    '''
+      The ~start_profiling and ~stop_profiling (std_srvs/Trigger) services,
+      for profiling a misbehaving node in the field without restarting it.
+      Stopping writes the profile to ROS_HOME/profiles as collapsed stacks
+      (.collapsed) and pstats (.pstats) files named after the node.
+    '''
+
+    def __init__(self, interval=0.01, directory=None):
+        '''
+          @param interval : time between samples (sec)
+          @type float
+          @param directory : where to write profiles, ROS_HOME/profiles if not set
+          @type str
+        '''
+        self._profiler = SamplingProfiler(interval)
+        self._directory = directory if directory is not None else os.path.join(rospkg.get_ros_home(), 'profiles')
+        self._services = [rospy.Service('~start_profiling', std_srvs.Trigger, self.ros_service_start_profiling),
+                          rospy.Service('~stop_profiling', std_srvs.Trigger, self.ros_service_stop_profiling)]
+
+    def ros_service_start_profiling(self, unused_request):
+        response = std_srvs.TriggerResponse()
+        if self._profiler.start():
+            response.success = True
+            response.message = "sampling all threads every %.1fms" % (self._profiler.interval * 1000.0)
+            rospy.loginfo("Profiler : started, %s." % response.message)
+        else:
+            response.success = False
+            response.message = "already profiling"
+        return response
+
+    def ros_service_stop_profiling(self, unused_request):
+        response = std_srvs.TriggerResponse()
+        if not self._profiler.stop():
+            response.success = False
+            response.message = "not profiling"
+            return response
+        basename = os.path.join(self._directory, '%s_%s' % (rospy.get_name().strip('/').replace('/', '_'),
+                                                            time.strftime('%Y%m%d-%H%M%S')))
+        try:
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+            self._profiler.write_collapsed(basename + '.collapsed')
+            self._profiler.write_pstats(basename + '.pstats')
+        except (IOError, OSError) as e:
+            response.success = False
+            response.message = "failed to write the profile [%s]" % str(e)
+            rospy.logerr("Profiler : %s." % response.message)
+            return response
+        response.success = True
+        response.message = "%d samples over %.1fs written to %s.{collapsed,pstats}" % (
+            self._profiler.samples, self._profiler.stop_time - self._profiler.start_time, basename)
+        rospy.loginfo("Profiler : stopped, %s." % response.message)
+        return response
+
+    def shutdown(self):
+        self._profiler.stop()
+        for service in self._services:
+            service.shutdown()